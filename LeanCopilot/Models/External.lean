@@ -12,6 +12,9 @@ structure ExternalModel where
   name : String
   host : String := "localhost"
   port : UInt16 := 23337
+  -- Path of a Unix domain socket that the server also listens on. When set, requests
+  -- are sent through it instead of TCP.
+  socket : Option String := none
 deriving Inhabited, Repr
 
 
@@ -48,11 +51,14 @@ structure EncoderResponse where
 deriving FromJson
 
 
-def send {α β : Type} [ToJson α] [FromJson β] (req : α) (url : String) : IO β := do
-  let reqStr := (toJson req).pretty 99999999999999999
+def send {α β : Type} [ToJson α] [FromJson β] (req : α) (url : String) (socket : Option String := none) : IO β := do
+  let reqStr := (toJson req).compress
+  let socketArgs := match socket with
+    | some path => #["--unix-socket", path]
+    | none => #[]
   let out ← IO.Process.output {
     cmd := "curl"
-    args := #["-X", "POST", url, "-H", "accept: application/json", "-H", "Content-Type: application/json", "-d", reqStr]
+    args := socketArgs ++ #["-X", "POST", url, "-H", "accept: application/json", "-H", "Content-Type: application/json", "-d", reqStr]
   }
   if out.exitCode != 0 then
      throw $ IO.userError s!"Request failed. Please check if the server is up at `{url}`."
@@ -70,7 +76,7 @@ def ExternalGenerator.generate (model : ExternalGenerator) (input : String) (tar
     input := input,
     «prefix» := targetPrefix
   }
-  let res : GeneratorResponse ← send req url
+  let res : GeneratorResponse ← send req url model.socket
   return res.outputs.map fun g => (g.output, g.score)
 
 
@@ -87,7 +93,7 @@ def ExternalEncoder.encode (model : ExternalEncoder) (input : String) : IO Float
     name := model.name,
     input := input,
   }
-  let res : EncoderResponse ← send req url
+  let res : EncoderResponse ← send req url model.socket
   return FloatArray.mk res.outputs
 
 
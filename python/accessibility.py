@@ -0,0 +1,208 @@
+import os
+import re
+import json
+import shutil
+import numpy as np
+from loguru import logger
+from typing import Dict, Iterable, List, Optional
+
+from corpus import Corpus
+
+# The accessibility index of a corpus is a directory with:
+# - meta.json: the version of the format and the number of premises and files.
+# - files.json: the path of each file, in the order of the other arrays.
+# - rows.npy and offsets.npy: the premises of file i are
+#   rows[offsets[i]:offsets[i + 1]].
+# - closure.npy: one bitset of files per file (np.packbits), the files it imports
+#   directly or transitively, and itself.
+FORMAT_VERSION = 1
+
+# Words of an import line that are not module names.
+IMPORT_KEYWORDS = {"import", "public", "meta", "all"}
+
+
+def module_name(path: str) -> Optional[str]:
+    """The name of the Lean module of `path`, e.g., `Mathlib.Data.Nat.Basic` for
+    `.lake/packages/mathlib/Mathlib/Data/Nat/Basic.lean`: its longest suffix of
+    capitalized components."""
+    if not path.endswith(".lean"):
+        return None
+    parts = path[: -len(".lean")].split("/")
+    i = len(parts)
+    while i > 0 and parts[i - 1][:1].isupper():
+        i -= 1
+    return ".".join(parts[i:]) or None
+
+
+def parse_imports(source: str) -> List[str]:
+    """The modules imported by the header of the Lean file `source`, including the
+    implicit `Init` of files that are not `prelude`."""
+    # The header ends before the first line that is not an import or comment.
+    header = re.sub(r"/-.*?-/|--[^\n]*", "", source, flags=re.DOTALL)
+    names = []
+    prelude = False
+    for line in header.splitlines():
+        words = line.split()
+        if not words:
+            continue
+        if words[0] in ("module", "prelude"):
+            prelude = prelude or words[0] == "prelude"
+            if len(words) == 1:
+                continue
+            words = words[1:]
+        # E.g., `import A`, `public import A`, `meta import A`, `import all A`.
+        i = 0
+        while i < len(words) and words[i] in ("public", "meta"):
+            i += 1
+        if i == len(words) or words[i] != "import":
+            break
+        names.extend(w for w in words[i + 1 :] if w not in IMPORT_KEYWORDS)
+    if not prelude and "Init" not in names:
+        names.insert(0, "Init")
+    return names
+
+
+def read_imports(root: str, paths: Iterable[str]) -> Dict[str, List[str]]:
+    """The modules imported by the Lean files `paths` (relative to `root`)."""
+    imports = {}
+    for path in paths:
+        try:
+            with open(os.path.join(root, path), encoding="utf-8") as f:
+                source = f.read()
+        except OSError:
+            logger.warning(f"Cannot read {path}; assuming it imports nothing")
+            imports[path] = []
+            continue
+        imports[path] = parse_imports(source)
+    return imports
+
+
+def build_accessibility(
+    corpus: Corpus, imports: Dict[str, List[str]], directory: Optional[str] = None
+) -> None:
+    """Record which premises of `corpus` each file can use: those of the files it
+    imports, directly or transitively. `imports` maps the path of each file to
+    the paths or module names of its imports. The index is saved in `directory`
+    (by default, the `access` directory of the corpus)."""
+    if directory is None:
+        directory = os.path.join(corpus.directory, "access")
+    paths = [corpus.string("path", i) for i in range(len(corpus))]
+    files = sorted(set(paths) | set(imports))
+    index = {f: i for i, f in enumerate(files)}
+    modules = {module_name(f): i for i, f in enumerate(files) if module_name(f)}
+
+    file_ids = np.array([index[p] for p in paths], dtype=np.int64)
+    rows = np.argsort(file_ids, kind="stable")
+    offsets = np.zeros(len(files) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(file_ids, minlength=len(files)))
+
+    edges: List[List[int]] = [[] for _ in files]
+    unknown = set()
+    for path, names in imports.items():
+        for name in names:
+            i = index.get(name, modules.get(name))
+            if i is None:
+                unknown.add(name)
+            else:
+                edges[index[path]].append(i)
+    if unknown:
+        logger.warning(
+            f"{len(unknown)} imported modules have no premises, e.g., {min(unknown)}"
+        )
+
+    # Closures in post-order (imports first), without recursion. A file is merged
+    # with its imports once all of them are done; an import that is still on the
+    # path is a cycle, which Lean does not allow, and is only skipped.
+    closure = np.zeros((len(files), (len(files) + 7) // 8), dtype=np.uint8)
+    done = np.zeros(len(files), dtype=bool)
+    on_path = np.zeros(len(files), dtype=bool)
+    for start in range(len(files)):
+        if done[start]:
+            continue
+        # Each entry is a file and the index of its next import to visit.
+        stack = [(start, 0)]
+        on_path[start] = True
+        while stack:
+            f, next_import = stack[-1]
+            if next_import < len(edges[f]):
+                stack[-1] = (f, next_import + 1)
+                g = edges[f][next_import]
+                if not done[g] and not on_path[g]:
+                    stack.append((g, 0))
+                    on_path[g] = True
+                continue
+            closure[f, f // 8] |= np.uint8(0x80 >> (f % 8))
+            for g in edges[f]:
+                closure[f] |= closure[g]
+            done[f] = True
+            on_path[f] = False
+            stack.pop()
+
+    tmp = f"{directory.rstrip(os.sep)}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, array in [("rows", rows), ("offsets", offsets), ("closure", closure)]:
+        np.save(os.path.join(tmp, f"{name}.npy"), array)
+    with open(os.path.join(tmp, "files.json"), "w") as f:
+        json.dump(files, f)
+    meta = {"version": FORMAT_VERSION, "count": len(corpus), "files": len(files)}
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp, directory)
+
+
+class Accessibility:
+    """The premises that a file can use, from an index of `build_accessibility`."""
+
+    def __init__(self, directory: str) -> None:
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["version"] > FORMAT_VERSION:
+            raise ValueError(f"{directory} has version {self.meta['version']}")
+        with open(os.path.join(directory, "files.json")) as f:
+            self.files: List[str] = json.load(f)
+        self.index = {f: i for i, f in enumerate(self.files)}
+        for i, f in enumerate(self.files):
+            self.index.setdefault(module_name(f), i)
+        load = lambda name: np.load(
+            os.path.join(directory, f"{name}.npy"), mmap_mode="r"
+        )
+        self.rows = load("rows")
+        self.offsets = load("offsets")
+        self.closure = load("closure")
+
+    def _file(self, name: str) -> int:
+        i = self.index.get(name)
+        if i is None:
+            raise KeyError(f"Unknown file or module: {name}")
+        return i
+
+    def allowed_files(
+        self, file: Optional[str] = None, imports: Optional[List[str]] = None
+    ) -> np.ndarray:
+        """The bitset of the files whose premises can be used in `file` (without
+        those of `file` itself, which may come after the goal) or in a file with
+        `imports`."""
+        bits = np.zeros(self.closure.shape[1], dtype=np.uint8)
+        if file is not None:
+            f = self._file(file)
+            bits |= self.closure[f]
+            bits[f // 8] &= ~np.uint8(0x80 >> (f % 8))
+        for name in imports or []:
+            bits |= self.closure[self._file(name)]
+        return bits
+
+    def premises(
+        self, file: Optional[str] = None, imports: Optional[List[str]] = None
+    ) -> np.ndarray:
+        """The rows of the premises that can be used in `file` or in a file with
+        `imports`, sorted."""
+        allowed = np.flatnonzero(
+            np.unpackbits(self.allowed_files(file, imports))[: len(self.files)]
+        )
+        rows = np.concatenate(
+            [self.rows[self.offsets[f] : self.offsets[f + 1]] for f in allowed]
+            or [np.empty(0, dtype=np.int64)]
+        )
+        return np.sort(rows)
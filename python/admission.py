@@ -0,0 +1,177 @@
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import List, Optional
+
+# Priority classes, most urgent first. Requests are interactive unless they say
+# otherwise, e.g., proof search sends `X-Priority: batch`.
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+# Never cut the number of candidates below this fraction to meet a deadline.
+MIN_SCALE = 0.25
+
+
+@dataclass
+class Budget:
+    """How urgent a request is and how long it may take."""
+
+    priority: int = 0
+    # Absolute `time.monotonic()` by which the request must be done.
+    deadline: Optional[float] = None
+    # Fraction of the usual number of candidates to generate, set when the request
+    # starts running.
+    scale: float = 1.0
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+
+current_budget: ContextVar[Optional[Budget]] = ContextVar(
+    "current_budget", default=None
+)
+
+
+def scaled(n: int) -> int:
+    """The number of candidates (or beams) to generate for the current request."""
+    budget = current_budget.get()
+    if budget is None or budget.scale >= 1.0:
+        return n
+    return max(1, math.ceil(n * budget.scale))
+
+
+class Rejected(Exception):
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float = 1.0) -> None:
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class QueueFull(Rejected):
+    status_code = 429
+
+
+class DeadlineExceeded(Rejected):
+    status_code = 503
+
+
+class ServiceTime:
+    """Exponentially weighted moving average of how long a model call takes."""
+
+    def __init__(self, alpha: float = 0.2) -> None:
+        self.alpha = alpha
+        self.estimate: Optional[float] = None
+
+    def observe(self, seconds: float) -> None:
+        if self.estimate is None:
+            self.estimate = seconds
+        else:
+            self.estimate += self.alpha * (seconds - self.estimate)
+
+
+class AdmissionQueue:
+    """A bounded priority queue in front of a model's `limit` concurrent slots.
+
+    Requests wait in order of priority, then deadline, then arrival. A request is
+    rejected up front if the queue is full of requests at least as urgent as it is,
+    or if its deadline cannot be met given the time model calls usually take. When
+    the queue is full, a more urgent request takes the place of the least urgent
+    waiting one, which is rejected instead.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: Optional[int] = None) -> None:
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.service_time = ServiceTime()
+        self._free = limit
+        self._waiters: List[list] = []
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    def _expected_wait(self, ahead: int) -> float:
+        """Seconds until a request with `ahead` requests before it starts running."""
+        if self.service_time.estimate is None:
+            return 0.0
+        if self._free > ahead:
+            return 0.0
+        return (ahead // self.limit + 1) * self.service_time.estimate
+
+    def _remove(self, entry: list) -> None:
+        self._waiters.remove(entry)
+        heapq.heapify(self._waiters)
+
+    async def acquire(self, budget: Budget) -> None:
+        # Infeasible deadlines are rejected whether or not a slot is free, so that
+        # the outcome does not depend on the state of the queue.
+        ahead = sum(1 for w in self._waiters if w[0] <= budget.priority)
+        wait = self._expected_wait(ahead)
+        remaining = budget.remaining()
+        if remaining is not None:
+            service = self.service_time.estimate or 0.0
+            if remaining <= 0 or wait + MIN_SCALE * service > remaining:
+                raise DeadlineExceeded(
+                    f"{self.name} cannot finish the request before its deadline",
+                    retry_after=wait,
+                )
+
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+
+        if self.max_queue is not None and len(self._waiters) >= self.max_queue:
+            victim = max(self._waiters, key=lambda w: (w[0], w[2]))
+            if victim[0] <= budget.priority:
+                raise QueueFull(f"Too many requests for {self.name}", retry_after=wait)
+            self._remove(victim)
+            victim[3].set_exception(
+                QueueFull(
+                    f"Too many requests for {self.name}",
+                    retry_after=self._expected_wait(len(self._waiters)),
+                )
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        deadline = budget.deadline if budget.deadline is not None else math.inf
+        entry = [budget.priority, deadline, next(self._counter), future]
+        heapq.heappush(self._waiters, entry)
+        try:
+            await asyncio.wait_for(future, remaining)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(
+                f"{self.name} did not start the request before its deadline",
+                retry_after=self._expected_wait(len(self._waiters)),
+            ) from None
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just before the request was cancelled.
+                self.release()
+            raise
+        finally:
+            if entry in self._waiters:
+                self._remove(entry)
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1
+
+    def scale(self, budget: Budget) -> float:
+        """The fraction of the usual work that fits in the remaining budget."""
+        remaining = budget.remaining()
+        if remaining is None or self.service_time.estimate is None:
+            return 1.0
+        if remaining <= 0:
+            raise DeadlineExceeded(
+                f"{self.name} did not start the request before its deadline"
+            )
+        return min(1.0, max(MIN_SCALE, remaining / self.service_time.estimate))
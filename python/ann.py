@@ -0,0 +1,288 @@
+import os
+import json
+import shutil
+import numpy as np
+from loguru import logger
+from typing import Any, Dict, Optional, Tuple
+
+from corpus import CHUNK_ROWS, Corpus
+from retrieval import top_k
+
+# An IVF index is a directory with:
+# - meta.json: the version of the format, the number of vectors, their dimension,
+#   the number of lists and the product quantizer (`pq_m` subvectors of `ksub`
+#   centroids each, or none).
+# - centroids.npy: the coarse centroids, one per list.
+# - offsets.npy and ids.npy: the ids of the vectors of list i are
+#   ids[offsets[i]:offsets[i + 1]].
+# - codes.npy and codebooks.npy (with a product quantizer): the codes of the
+#   residuals of the vectors (to their centroid), in the order of `ids`, and the
+#   centroids of each subvector.
+FORMAT_VERSION = 1
+
+
+def kmeans(
+    x: np.ndarray, k: int, iters: int = 20, seed: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """The `k` centroids of `x` and the assignment of its rows (Lloyd's algorithm)."""
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(iters):
+        assignment = assign(x, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        empty = counts == 0
+        # The sums of the rows of each (non-empty) cluster, which are contiguous
+        # once sorted by cluster.
+        order = np.argsort(assignment, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[~empty]
+        sums = np.add.reduceat(x[order], starts, axis=0)
+        centroids[~empty] = sums / counts[~empty, None]
+        # Empty clusters restart from random points.
+        centroids[empty] = x[rng.choice(len(x), size=int(empty.sum()))]
+    return centroids, assign(x, centroids)
+
+
+def assign(x: np.ndarray, centroids: np.ndarray, chunk: int = 4096) -> np.ndarray:
+    """The index of the nearest (in L2) of `centroids` to each row of `x`."""
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, where |x|^2 does not change the argmin.
+    # Rows are assigned in chunks, which bounds the memory of the distances.
+    norms = (centroids**2).sum(axis=1)
+    return np.concatenate(
+        [
+            np.argmin(norms - 2 * (x[start : start + chunk] @ centroids.T), axis=1)
+            for start in range(0, len(x), chunk)
+        ]
+    )
+
+
+class IVFIndex:
+    """An inverted file index for the maximum inner product search of premise
+    embeddings, optionally with product quantization (IVF-PQ).
+
+    Vectors are partitioned by their nearest coarse centroid, and a query only
+    scores the vectors of the `nprobe` lists whose centroids have the largest inner
+    products with it. With a product quantizer, those vectors are scored from their
+    codes (`pq_m` bytes each) without reading them, and only the best `rerank` are
+    scored exactly with the embeddings of the corpus.
+    """
+
+    def __init__(
+        self,
+        meta: Dict[str, Any],
+        centroids: np.ndarray,
+        offsets: np.ndarray,
+        ids: np.ndarray,
+        codes: Optional[np.ndarray] = None,
+        codebooks: Optional[np.ndarray] = None,
+        corpus: Optional[Corpus] = None,
+        nprobe: int = 8,
+    ) -> None:
+        self.meta = meta
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.codes = codes
+        self.codebooks = codebooks
+        # Vectors to score exactly. Required without a product quantizer.
+        self.corpus = corpus
+        self.nprobe = nprobe
+
+    def __len__(self) -> int:
+        return self.meta["count"]
+
+    @property
+    def dim(self) -> int:
+        return self.meta["dim"]
+
+    @classmethod
+    def build(
+        cls,
+        corpus: Corpus,
+        nlist: Optional[int] = None,
+        pq_m: Optional[int] = None,
+        ksub: int = 256,
+        sample_size: int = 100_000,
+        iters: int = 20,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """Train the coarse centroids (and product quantizer, with `pq_m`) on a sample
+        of `corpus` and add all its vectors. `nlist` defaults to 4 sqrt(N)."""
+        count, dim = len(corpus), corpus.dim
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(count)))
+        if pq_m is not None and dim % pq_m != 0:
+            raise ValueError(f"pq_m ({pq_m}) must divide the dimension ({dim})")
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+        sample = corpus.take(rows)
+
+        logger.info(f"Training {nlist} coarse centroids on {len(sample)} vectors")
+        centroids, sample_lists = kmeans(sample, nlist, iters, seed)
+        codebooks = None
+        if pq_m is not None:
+            logger.info(f"Training a product quantizer with {pq_m} subvectors")
+            residuals = (sample - centroids[sample_lists]).reshape(
+                len(sample), pq_m, -1
+            )
+            codebooks = np.stack(
+                [kmeans(residuals[:, j], ksub, iters, seed)[0] for j in range(pq_m)]
+            )
+
+        logger.info(f"Adding {count} vectors")
+        lists = np.empty(count, dtype=np.int64)
+        codes = np.empty((count, pq_m), dtype=np.uint8) if pq_m is not None else None
+        for start in range(0, count, CHUNK_ROWS):
+            x = corpus.vectors(start, start + CHUNK_ROWS)
+            lists[start : start + len(x)] = assign(x, centroids)
+            if codes is not None:
+                residuals = x - centroids[lists[start : start + len(x)]]
+                codes[start : start + len(x)] = encode(residuals, codebooks)
+
+        order = np.argsort(lists, kind="stable")
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(lists, minlength=len(centroids)))
+        meta = {
+            "version": FORMAT_VERSION,
+            "count": count,
+            "dim": dim,
+            "nlist": len(centroids),
+            "pq_m": pq_m,
+            "ksub": codebooks.shape[1] if codebooks is not None else None,
+        }
+        return cls(
+            meta,
+            centroids,
+            offsets,
+            order.astype(np.uint32 if count < 2**32 else np.int64),
+            codes[order] if codes is not None else None,
+            codebooks,
+            corpus,
+        )
+
+    def save(self, directory: str) -> None:
+        tmp = f"{directory.rstrip(os.sep)}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        arrays = {"centroids": self.centroids, "offsets": self.offsets, "ids": self.ids}
+        if self.codes is not None:
+            arrays.update(codes=self.codes, codebooks=self.codebooks)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=2)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+
+    @classmethod
+    def load(
+        cls, directory: str, corpus: Optional[Corpus] = None, nprobe: int = 8
+    ) -> "IVFIndex":
+        """Load an index saved in `directory`, memory-mapping its lists and codes."""
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["version"] > FORMAT_VERSION:
+            raise ValueError(f"{directory} has version {meta['version']} of the format")
+        if corpus is not None and len(corpus) != meta["count"]:
+            raise ValueError(
+                f"{directory} indexes {meta['count']} vectors, not {len(corpus)}"
+            )
+
+        def array(name: str, mmap_mode: Optional[str] = None) -> np.ndarray:
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        pq = meta["pq_m"] is not None
+        return cls(
+            meta,
+            array("centroids"),
+            array("offsets"),
+            array("ids", "r"),
+            array("codes", "r") if pq else None,
+            array("codebooks") if pq else None,
+            corpus,
+            nprobe,
+        )
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        rerank: Optional[int] = None,
+        rows: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The ids and scores of (approximately) the `k` vectors with the largest
+        inner products with each row of `queries`, best first.
+
+        With a product quantizer, the best `rerank` (by default, 10 k) of the vectors
+        in the probed lists are scored exactly if the index has a corpus; `rerank=0`
+        returns the approximate scores. Only the vectors `rows` are returned if
+        given. Rows with fewer than `k` candidates are padded with id -1 and score
+        -inf.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.codes is None and self.corpus is None:
+            raise ValueError("An index without product quantizer needs a corpus")
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        if rerank is None:
+            rerank = 10 * k
+        allowed = None
+        if rows is not None:
+            allowed = np.zeros(len(self), dtype=bool)
+            allowed[rows] = True
+        coarse = queries @ self.centroids.T
+        probed, _ = top_k(coarse, nprobe)
+
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for b, (query, lists) in enumerate(zip(queries, probed)):
+            ranges = [(self.offsets[l], self.offsets[l + 1]) for l in lists]
+            candidates = np.concatenate(
+                [self.ids[start:end] for start, end in ranges]
+            ).astype(np.int64)
+            if len(candidates) == 0:
+                continue
+            if self.codes is not None:
+                # q.x = q.c + q.r for a vector x in the list of centroid c, and the
+                # residual r is approximated by its code.
+                sizes = [end - start for start, end in ranges]
+                approx = np.repeat(coarse[b, lists], sizes) + self._pq_scores(
+                    query, np.concatenate([self.codes[s:e] for s, e in ranges])
+                )
+                if allowed is not None:
+                    approx = approx[allowed[candidates]]
+                    candidates = candidates[allowed[candidates]]
+                if rerank == 0 or self.corpus is None:
+                    best, best_scores = top_k(approx[None], k)
+                    ids[b, : best.shape[1]] = candidates[best[0]]
+                    scores[b, : best.shape[1]] = best_scores[0]
+                    continue
+                shortlist, _ = top_k(approx[None], max(rerank, k))
+                candidates = candidates[shortlist[0]]
+            elif allowed is not None:
+                candidates = candidates[allowed[candidates]]
+            # Sorted ids read the memory-mapped corpus in order.
+            candidates = np.sort(candidates)
+            exact = self.corpus.take(candidates) @ query
+            best, best_scores = top_k(exact[None], k)
+            ids[b, : best.shape[1]] = candidates[best[0]]
+            scores[b, : best.shape[1]] = best_scores[0]
+        return ids, scores
+
+    def _pq_scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """The inner products of `query` with the residuals quantized as `codes`."""
+        m = self.meta["pq_m"]
+        # One table per subvector: the inner products of the subvector of the query
+        # with each centroid of that subvector.
+        tables = np.einsum("md,mkd->mk", query.reshape(m, -1), self.codebooks)
+        return tables[np.arange(m), codes].sum(axis=1)
+
+
+def encode(residuals: np.ndarray, codebooks: np.ndarray) -> np.ndarray:
+    """The product quantization codes of `residuals`."""
+    m = len(codebooks)
+    sub = residuals.reshape(len(residuals), m, -1)
+    return np.stack([assign(sub[:, j], codebooks[j]) for j in range(m)], axis=1).astype(
+        np.uint8
+    )
@@ -0,0 +1,66 @@
+import threading
+from loguru import logger
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from metrics import record_assisted
+from precision import prepare
+
+if TYPE_CHECKING:
+    import torch
+
+
+class DraftModel:
+    """A small model that proposes tokens for a larger one with the same tokenizer
+    (assisted decoding in transformers).
+
+    The target model checks all the proposed tokens in one forward pass and keeps
+    those it would have generated, so greedy outputs are unchanged and samples have
+    the same distribution. transformers only supports it for one sequence at a time
+    without beam search.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        target: "torch.nn.Module",
+        num_assistant_tokens: Optional[int] = None,
+        precision: str = "fp32",
+    ) -> None:
+        from transformers import AutoModelForCausalLM
+
+        logger.info(f"Loading draft model {name} on {target.device}")
+        model = AutoModelForCausalLM.from_pretrained(name, trust_remote_code=True)
+        self.model = prepare(model.to(target.device), precision)
+        if self.model.config.vocab_size != target.config.vocab_size:
+            raise ValueError(
+                f"The draft model {name} has a vocabulary of "
+                f"{self.model.config.vocab_size} tokens instead of "
+                f"{target.config.vocab_size}"
+            )
+        if num_assistant_tokens is not None:
+            # By default, transformers adapts the number of proposed tokens to how
+            # many were accepted.
+            self.model.generation_config.num_assistant_tokens = num_assistant_tokens
+            self.model.generation_config.num_assistant_tokens_schedule = "constant"
+        # Forward passes of the target model, per thread, to report the number of
+        # tokens accepted per pass.
+        self._steps = threading.local()
+        target.register_forward_hook(self._count)
+
+    def _count(self, module: Any, args: Any, output: Any) -> None:
+        self._steps.count = getattr(self._steps, "count", 0) + 1
+
+    def generate_kwargs(self) -> Dict[str, Any]:
+        """The arguments of `generate` for one assisted generation."""
+        self._steps.count = 0
+        return {"assistant_model": self.model}
+
+    def steps(self) -> int:
+        """Forward passes of the target model in this thread since the last call to
+        `generate_kwargs`."""
+        return getattr(self._steps, "count", 0)
+
+    def record(self, tokens: int, steps: Optional[int] = None) -> None:
+        """Report the `tokens` generated in `steps` forward passes (by default, those
+        of the last generation in this thread)."""
+        record_assisted(tokens, self.steps() if steps is None else steps)
@@ -0,0 +1,107 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from admission import Budget, DeadlineExceeded, current_budget
+from executor import InferenceExecutor
+from tracing import Trace, current_trace, joined, span
+
+_Pending = Tuple[tuple, Optional[Budget], Optional[Trace], asyncio.Future]
+# Model, method, priority and whether the requests have a deadline.
+_Key = Tuple[str, str, int, bool]
+
+
+@dataclass
+class BatchConfig:
+    max_batch_size: int = 8
+    # How long the first request of a batch waits for others to join it.
+    max_wait_ms: float = 5.0
+
+
+# The batched method that serves each single-input method.
+BATCH_METHODS = {"generate": "generate_batch", "encode": "encode_batch"}
+
+
+class BatchScheduler:
+    """Collects concurrent requests to the same model into batches.
+
+    Models without a `BatchConfig` are called one request at a time.
+    """
+
+    def __init__(self, executor: InferenceExecutor) -> None:
+        self.executor = executor
+        self._configs: Dict[str, BatchConfig] = {}
+        self._pending: Dict[_Key, List[_Pending]] = {}
+        self._timers: Dict[_Key, asyncio.TimerHandle] = {}
+
+    def configure(self, name: str, **kwargs) -> None:
+        self._configs[name] = BatchConfig(**kwargs)
+
+    async def run(self, name: str, method: str, *args) -> Any:
+        config = self._configs.get(name)
+        if config is None or config.max_batch_size <= 1:
+            return await self.executor.run(name, method, *args)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        budget = current_budget.get()
+        # Only requests of the same priority, and either all with or all without a
+        # deadline, share a batch: a batch is admitted and scaled as a whole.
+        key = (
+            name,
+            method,
+            budget.priority if budget is not None else Budget.priority,
+            budget is not None and budget.deadline is not None,
+        )
+        batch = self._pending.setdefault(key, [])
+        batch.append((args, budget, current_trace.get(), future))
+        if len(batch) >= config.max_batch_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(
+                config.max_wait_ms / 1000, self._flush, key
+            )
+        with span("batch"):
+            return await future
+
+    def _flush(self, key: _Key) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            asyncio.ensure_future(self._dispatch(key, batch))
+
+    async def _dispatch(self, key: _Key, batch: List[_Pending]) -> None:
+        name, method, priority, _ = key
+        # Transpose [(input, prefix), ...] into ([input, ...], [prefix, ...]).
+        columns = [list(column) for column in zip(*(args for args, _, _, _ in batch))]
+        # The batch is as urgent as its most urgent request.
+        budgets = [b for _, b, _, _ in batch if b is not None]
+        deadlines = [b.deadline for b in budgets if b.deadline is not None]
+        budget = Budget(priority=priority, deadline=min(deadlines, default=None))
+        current_budget.set(budget)
+        # The stages of the batch are recorded in the trace of each request.
+        current_trace.set(joined([t for _, _, t, _ in batch]))
+        try:
+            results = await self.executor.run(name, BATCH_METHODS[method], *columns)
+        except DeadlineExceeded as e:
+            # Only the requests with the earliest deadline are infeasible; the
+            # others are tried again without them.
+            late = [p for p in batch if p[1].deadline > budget.deadline]
+            for _, b, _, future in batch:
+                if b.deadline <= budget.deadline and not future.done():
+                    future.set_exception(e)
+            if late:
+                await self._dispatch(key, late)
+            return
+        except Exception as e:
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for b in budgets:
+            b.scale = budget.scale
+        for (_, _, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,144 @@
+"""Measure assisted decoding with a draft model against decoding without it.
+
+Run from the `python` folder:
+
+    python benchmarks/assisted_decoding.py --kind hf \\
+        --model internlm/internlm2-math-plus-7b \\
+        --draft-model internlm/internlm2-math-plus-1_8b
+    python benchmarks/assisted_decoding.py --kind decoder \\
+        --model wellecks/llmstep-mathlib4-pythia2.8b \\
+        --draft-model EleutherAI/pythia-160m
+
+The model is loaded once with its draft model and run on the goals of
+`benchmarks/goals.jsonl` (or `--goals`, one `{"goal": ...}` per line), first without
+and then with the draft model. The script reports the tokens accepted per forward
+pass of the target model, the throughput in tokens/s and the end-to-end speedup.
+With greedy decoding (`--kind decoder`, or `--greedy` for `--kind hf`), it also
+checks that both runs return the same outputs; samples only have the same
+distribution.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+GOALS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "goals.jsonl")
+
+
+def load(args: argparse.Namespace) -> Any:
+    if args.kind == "hf":
+        from external_models import HFTacticGenerator
+
+        return HFTacticGenerator(
+            model=args.model,
+            draft_model=args.draft_model,
+            num_assistant_tokens=args.num_assistant_tokens,
+            temperature=0.6,
+            max_new_tokens=args.max_new_tokens,
+            stop=["```\n"],
+            top_p=0.9,
+            num_return_sequences=args.num_return_sequences,
+            do_sample=not args.greedy,
+            output_scores=True,
+            output_logits=False,
+            return_dict_in_generate=True,
+            device=args.device,
+            precision=args.precision,
+        )
+    from models import DecoderOnlyTransformer, PythiaTacticGenerator
+
+    # The draft model is only used for greedy search, i.e., one sequence.
+    if args.model == "wellecks/llmstep-mathlib4-pythia2.8b":
+        # Formats goals as in its training data.
+        cls, name = PythiaTacticGenerator, []
+    else:
+        cls, name = DecoderOnlyTransformer, [args.model]
+    return cls(
+        *name,
+        1,
+        max_new_tokens=args.max_new_tokens,
+        device=args.device,
+        precision=args.precision,
+        draft_model=args.draft_model,
+        num_assistant_tokens=args.num_assistant_tokens,
+    )
+
+
+def run(model: Any, goals: List[str], label: str) -> Dict[str, Any]:
+    import metrics
+
+    metrics.current_model.set(label)
+    start = time.perf_counter()
+    outputs = [model.generate(goal) for goal in goals]
+    return {
+        "seconds": time.perf_counter() - start,
+        "tokens": metrics.GENERATED_TOKENS.value(label),
+        "outputs": outputs,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--kind", choices=["hf", "decoder"], required=True)
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--draft-model", required=True)
+    parser.add_argument("--num-assistant-tokens", type=int, default=None)
+    parser.add_argument("--goals", default=GOALS)
+    parser.add_argument("--num-return-sequences", type=int, default=4)
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--greedy", action="store_true")
+    parser.add_argument("--device", default="auto")
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument("--json", action="store_true", help="Print a JSON report.")
+    args = parser.parse_args()
+    if args.greedy:
+        args.num_return_sequences = 1
+
+    with open(args.goals) as f:
+        goals = [json.loads(line)["goal"] for line in f if line.strip()]
+
+    import metrics
+
+    model = load(args)
+    draft = model.draft
+    model.draft = None
+    baseline = run(model, goals, "baseline")
+    model.draft = draft
+    assisted = run(model, goals, "assisted")
+
+    steps = metrics.ASSISTED_STEPS.value("assisted")
+    report = {
+        "goals": len(goals),
+        "baseline_tokens_per_second": baseline["tokens"] / baseline["seconds"],
+        "assisted_tokens_per_second": assisted["tokens"] / assisted["seconds"],
+        "speedup": baseline["seconds"] / assisted["seconds"],
+        "tokens_per_step": metrics.ASSISTED_TOKENS.value("assisted") / max(steps, 1),
+    }
+    if args.kind == "decoder" or args.greedy:
+        same = [
+            [o for o, _ in b] == [o for o, _ in a]
+            for b, a in zip(baseline["outputs"], assisted["outputs"])
+        ]
+        report["same_outputs"] = sum(same) / len(same)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{args.model} with {args.draft_model}, {len(goals)} goals")
+    print(f"  without draft: {report['baseline_tokens_per_second']:8.1f} tokens/s")
+    print(
+        f"  with draft:    {report['assisted_tokens_per_second']:8.1f} tokens/s "
+        f"({report['speedup']:.2f}x)"
+    )
+    print(f"  tokens accepted per forward pass: {report['tokens_per_step']:.2f}")
+    if "same_outputs" in report:
+        print(f"  goals with the same outputs: {report['same_outputs']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
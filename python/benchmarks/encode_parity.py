@@ -0,0 +1,93 @@
+"""Check that batched encoding matches encoding one input at a time.
+
+Run from the `python` folder:
+
+    python benchmarks/encode_parity.py --goals goals.txt --max-abs-diff 1e-4
+
+`EncoderOnlyTransformer.encode_batch` is compared with `encode` on each input and
+with the reference masked mean of `scripts/validate_retrieval.py`. Goals are read
+from a file with one goal per line (`\\n` stands for a line break), or a few built-in
+goals of different lengths are used. The script prints the largest absolute
+difference and the throughput of both paths, and exits with a non-zero status if
+the difference exceeds `--max-abs-diff`. `tests/test_encode_parity.py` runs the same
+comparison on a tiny randomly initialized encoder.
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import EncoderOnlyTransformer
+
+GOALS = [
+    "n : ℕ\n⊢ gcd n n = n",
+    "a b c : Nat\n⊢ a + b + c = a + c + b",
+    "⊢ True",
+    "α : Type u_1\ninst✝ : DecidableEq α\ns t : Finset α\nh : s ⊆ t\n⊢ s ∪ t = t",
+    "x y : ℝ\nhx : 0 < x\nhy : 0 < y\n⊢ Real.log (x * y) = Real.log x + Real.log y",
+    "f : ℕ → ℕ\nhf : StrictMono f\nn : ℕ\n⊢ n ≤ f n",
+]
+
+
+def reference(model: EncoderOnlyTransformer, goal: str) -> np.ndarray:
+    """The encoding of `scripts/validate_retrieval.py`."""
+    import torch
+
+    tokenized = model.tokenizer([goal], return_tensors="pt", padding=True)
+    with torch.no_grad():
+        hidden_state = model.model(tokenized.input_ids).last_hidden_state
+    lens = tokenized.attention_mask.sum(dim=1)
+    features = (hidden_state * tokenized.attention_mask.unsqueeze(2)).sum(
+        dim=1
+    ) / lens.unsqueeze(1)
+    return features.squeeze().numpy()
+
+
+def load_goals(path: str) -> List[str]:
+    with open(path) as f:
+        return [line.rstrip("\n").replace("\\n", "\n") for line in f if line.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="kaiyuy/leandojo-lean4-retriever-byt5-small")
+    parser.add_argument("--goals", default=None, help="One goal per line.")
+    parser.add_argument("--max-batch-tokens", type=int, default=16384)
+    parser.add_argument("--max-abs-diff", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    goals = load_goals(args.goals) if args.goals else GOALS
+    model = EncoderOnlyTransformer(args.model)
+
+    start = time.perf_counter()
+    batched = model.encode_batch(goals, max_batch_tokens=args.max_batch_tokens)
+    batched_seconds = time.perf_counter() - start
+    assert batched.dtype == np.float32 and batched.flags.c_contiguous
+    assert batched.shape[0] == len(goals)
+
+    start = time.perf_counter()
+    single = np.stack([model.encode(goal) for goal in goals])
+    single_seconds = time.perf_counter() - start
+
+    expected = np.stack([reference(model, goal) for goal in goals])
+
+    diff = max(
+        float(np.abs(batched - single).max()), float(np.abs(batched - expected).max())
+    )
+    print(f"{len(goals)} goals, max abs diff {diff:.2e}")
+    print(
+        f"  encode_batch: {len(goals) / batched_seconds:8.1f} goals/s\n"
+        f"  encode:       {len(goals) / single_seconds:8.1f} goals/s"
+    )
+    if diff > args.max_abs_diff:
+        print(f"FAIL: {diff:.2e} > {args.max_abs_diff:.2e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Measure how long `import server` takes.
+
+Run from the `python` folder:
+
+    python benchmarks/import_time.py --repeat 5 --max-seconds 1.0
+
+Each measurement runs in a fresh interpreter. The script prints the median wall
+time and the slowest modules reported by `python -X importtime`, and exits with a
+non-zero status if the median exceeds `--max-seconds`.
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import List, Tuple
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_once(module: str) -> Tuple[float, List[Tuple[int, str]]]:
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - t)"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=PYTHON_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    elapsed = float(proc.stdout.strip().splitlines()[-1])
+    # Lines look like `import time:   self [us] | cumulative | imported package`.
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not name.startswith(" " * 2):  # Only top-level imports.
+            modules.append((int(cumulative), name.strip()))
+    modules.sort(reverse=True)
+    return elapsed, modules
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="server")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--max-seconds", type=float, default=None)
+    parser.add_argument("--json", action="store_true", help="Print a JSON report.")
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(args.repeat):
+        elapsed, modules = measure_once(args.module)
+        timings.append(elapsed)
+    median = statistics.median(timings)
+
+    if args.json:
+        report = {
+            "module": args.module,
+            "median_seconds": median,
+            "timings": timings,
+            "slowest_imports": [
+                {"module": name, "cumulative_us": us}
+                for us, name in modules[: args.top]
+            ],
+        }
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"import {args.module}: median {median:.3f}s over {args.repeat} runs")
+        for us, name in modules[: args.top]:
+            print(f"  {us / 1e6:8.3f}s  {name}")
+
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f"FAIL: {median:.3f}s > {args.max_seconds:.3f}s", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Compare the memory, speed and accuracy of a model in each precision.
+
+Run from the `python` folder:
+
+    python benchmarks/precision_report.py --kind decoder \\
+        --model wellecks/llmstep-mathlib4-pythia2.8b --precisions fp32 bf16 int8
+
+For each precision (see `precision.py`), the model is loaded in a fresh process and
+run on a few goals (or those in `--goals`, one per line with `\\n` for line
+breaks). The script reports the memory of the weights (parameters, buffers and
+the packed weights of int8 linear layers), the growth of the resident memory while
+loading, the throughput in tokens/s (goals/s for encoders),
+and how close the outputs are to fp32: the overlap of the candidate sets and the
+top-1 agreement for generators, and the cosine similarity for encoders.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+GOALS = [
+    "n : ℕ\n⊢ gcd n n = n",
+    "a b c : Nat\n⊢ a + b + c = a + c + b",
+    "α : Type u_1\ninst✝ : DecidableEq α\ns t : Finset α\nh : s ⊆ t\n⊢ s ∪ t = t",
+    "x y : ℝ\nhx : 0 < x\nhy : 0 < y\n⊢ Real.log (x * y) = Real.log x + Real.log y",
+]
+
+
+def run(args: argparse.Namespace, precision: str, goals: List[str]) -> Dict[str, Any]:
+    """Load the model in `precision` and run it on `goals` in this process."""
+    import metrics
+    from registry import estimate_memory, process_memory
+    from models import (
+        DecoderOnlyTransformer,
+        EncoderDecoderTransformer,
+        EncoderOnlyTransformer,
+    )
+
+    before = process_memory()
+    kwargs = {"precision": precision, "compile": args.compile}
+    if args.kind == "encoder":
+        model = EncoderOnlyTransformer(args.model, **kwargs)
+    else:
+        if args.kind == "decoder":
+            cls = DecoderOnlyTransformer
+        else:
+            cls = EncoderDecoderTransformer
+        model = cls(args.model, args.num_return_sequences, args.max_length, **kwargs)
+    loaded = process_memory()
+
+    metrics.current_model.set(precision)
+    start = time.perf_counter()
+    if args.kind == "encoder":
+        outputs = [model.encode(goal).tolist() for goal in goals]
+    else:
+        outputs = [model.generate(goal) for goal in goals]
+    seconds = time.perf_counter() - start
+    tokens = metrics.GENERATED_TOKENS.value(precision)
+    return {
+        "precision": precision,
+        "weights_bytes": estimate_memory(model),
+        "load_rss_bytes": loaded - before,
+        "rss_bytes": process_memory(),
+        "seconds": seconds,
+        "tokens": tokens,
+        "outputs": outputs,
+    }
+
+
+def run_in_subprocess(args: argparse.Namespace, precision: str) -> Dict[str, Any]:
+    proc = subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            *sys.argv[1:],
+            "--child",
+            precision,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def accuracy(kind: str, reference: List[Any], outputs: List[Any]) -> Dict[str, float]:
+    if kind == "encoder":
+        cosines = [
+            float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+            for a, b in zip(np.array(reference), np.array(outputs))
+        ]
+        return {"min_cosine": min(cosines)}
+    overlap = [
+        len({o for o, _ in r} & {o for o, _ in x}) / max(len(r), 1)
+        for r, x in zip(reference, outputs)
+    ]
+    top1 = [bool(r and x and r[0][0] == x[0][0]) for r, x in zip(reference, outputs)]
+    return {"overlap": float(np.mean(overlap)), "top1": float(np.mean(top1))}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--kind", choices=["decoder", "encoder-decoder", "encoder"], required=True
+    )
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "bf16", "int8"])
+    parser.add_argument("--compile", action="store_true")
+    parser.add_argument("--goals", default=None, help="One goal per line.")
+    parser.add_argument("--num-return-sequences", type=int, default=8)
+    parser.add_argument("--max-length", type=int, default=256)
+    parser.add_argument("--json", action="store_true", help="Print a JSON report.")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.goals:
+        with open(args.goals) as f:
+            goals = [l.rstrip("\n").replace("\\n", "\n") for l in f if l.strip()]
+    else:
+        goals = GOALS
+
+    if args.child is not None:
+        print(json.dumps(run(args, args.child, goals)))
+        return
+
+    # fp32 is the reference for accuracy, so it always runs first.
+    precisions = ["fp32"] + [p for p in args.precisions if p != "fp32"]
+    results = [run_in_subprocess(args, p) for p in precisions]
+    reference = results[0]["outputs"]
+    for result in results:
+        result.update(accuracy(args.kind, reference, result.pop("outputs")))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    unit = "goals/s" if args.kind == "encoder" else "tokens/s"
+    print(f"{args.model}, {len(goals)} goals")
+    for r in results:
+        rate = (len(goals) if args.kind == "encoder" else r["tokens"]) / r["seconds"]
+        quality = (
+            f"min cosine {r['min_cosine']:.4f}"
+            if args.kind == "encoder"
+            else f"overlap {r['overlap']:.2f}, top-1 {r['top1']:.2f}"
+        )
+        print(
+            f"  {r['precision']:>5}: weights {r['weights_bytes'] / 2**20:8.1f} MiB, "
+            f"load RSS {r['load_rss_bytes'] / 2**20:8.1f} MiB, "
+            f"{rate:8.1f} {unit}, {quality}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""Compare the quality, speed and memory of the premise retrieval configurations.
+
+Run from the `python` folder:
+
+    python benchmarks/retrieval_report.py --premises <corpus> \\
+        --model kaiyuy/leandojo-lean4-retriever-byt5-small --output report.json
+    # Without an encoder: the embeddings of random premises are the queries.
+    python benchmarks/retrieval_report.py --premises <corpus> --random-queries 1000
+
+`--premises` is a corpus (`corpus.py`) or a directory with the `embeddings.npy` and
+`dictionary.json` of the C++ FFI. The goals of `--goals` (one `{"goal": ...}` per
+line, by default `benchmarks/goals.jsonl`) are encoded one at a time and in batches,
+and their embeddings are searched with:
+- exact search over the corpus, the reference for recall;
+- exact search over copies of the corpus in the other `--dtypes`;
+- the IVF indexes of `--ann` (by default, the `ivf` directory of the corpus, see
+  `scripts/build_premise_ann.py`), with each of `--nprobe`.
+
+For each configuration, the report has the recall@k against the reference, the
+queries/s when searching in batches of `--batch-size`, the p50 and p99 latency of
+one query at a time, and the peak memory allocated while searching (memory-mapped
+files are not counted; their size is in `disk_bytes`). Goals with their ground truth
+(`"premises": [<full_name>, ...]`) also get the recall@k of those premises.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+GOALS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "goals.jsonl")
+
+
+class Rows:
+    """The embeddings of a corpus in float32, sliceable like an array."""
+
+    def __init__(self, corpus: Any) -> None:
+        self.corpus = corpus
+        self.shape = (len(corpus), corpus.dim)
+
+    def __getitem__(self, rows: slice) -> np.ndarray:
+        return self.corpus.vectors(rows.start, rows.stop)
+
+
+def size(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(size(os.path.join(path, f)) for f in os.listdir(path))
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def embeddings_size(corpus: Any) -> int:
+    return sum(
+        size(os.path.join(corpus.directory, f))
+        for f in ["embeddings.npy", "scales.npy"]
+    )
+
+
+def percentiles(seconds: List[float]) -> Dict[str, float]:
+    ms = np.array(seconds) * 1000
+    return {
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def encode(args: argparse.Namespace, goals: List[str]) -> Tuple[np.ndarray, Dict]:
+    """The embeddings of `goals`, and the speed of encoding them one at a time and
+    in batches."""
+    from models import EncoderOnlyTransformer
+
+    model = EncoderOnlyTransformer(args.model, args.device, args.precision)
+    model.encode(goals[0])  # Warm up.
+    latencies = []
+    for goal in goals:
+        start = time.perf_counter()
+        model.encode(goal)
+        latencies.append(time.perf_counter() - start)
+    unbatched = np.stack([model.encode(goal) for goal in goals])
+
+    start = time.perf_counter()
+    batched = np.concatenate(
+        [
+            model.encode_batch(goals[i : i + args.batch_size])
+            for i in range(0, len(goals), args.batch_size)
+        ]
+    )
+    seconds = time.perf_counter() - start
+    report = {
+        "unbatched": {
+            "goals_per_second": len(goals) / sum(latencies),
+            **percentiles(latencies),
+        },
+        "batched": {
+            "goals_per_second": len(goals) / seconds,
+            "batch_size": args.batch_size,
+        },
+        "max_abs_diff": float(np.abs(batched - unbatched).max()),
+    }
+    return batched, report
+
+
+def search(index: Any, queries: np.ndarray, k: int, batch_size: int, **kwargs) -> Dict:
+    """The results of `index` on `queries` and its speed and memory."""
+    run = lambda q: index.search(q, k, **kwargs)
+    run(queries[:1])  # Warm up, e.g., the page cache.
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        run(query[None])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    ids = np.concatenate(
+        [
+            run(queries[i : i + batch_size])[0]
+            for i in range(0, len(queries), batch_size)
+        ]
+    )
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    for i in range(0, len(queries), batch_size):
+        run(queries[i : i + batch_size])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "ids": ids,
+        "queries_per_second": len(queries) / seconds,
+        **percentiles(latencies),
+        "peak_alloc_bytes": peak,
+    }
+
+
+def recall(expected: np.ndarray, actual: np.ndarray) -> float:
+    return float(
+        np.mean(
+            [len(set(e) & set(a)) / max(len(e), 1) for e, a in zip(expected, actual)]
+        )
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--premises", required=True)
+    queries = parser.add_mutually_exclusive_group()
+    queries.add_argument(
+        "--model", default="kaiyuy/leandojo-lean4-retriever-byt5-small"
+    )
+    queries.add_argument("--random-queries", type=int, default=None)
+    parser.add_argument("--goals", default=GOALS)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument("--k", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--dtypes", nargs="*", default=["float16", "int8"])
+    parser.add_argument("--ann", nargs="*", default=None, help="IVF index directories.")
+    parser.add_argument("--nprobe", nargs="+", type=int, default=[1, 4, 8, 16, 32])
+    parser.add_argument("--rerank", type=int, default=None)
+    parser.add_argument(
+        "--work-dir", default=None, help="For the copies of the corpus."
+    )
+    parser.add_argument("--output", default=None, help="Write the JSON report here.")
+    parser.add_argument("--json", action="store_true", help="Print a JSON report.")
+    args = parser.parse_args()
+
+    from ann import IVFIndex
+    from corpus import Corpus, load_premises, write_corpus
+    from registry import process_memory
+    from retrieval import PremiseIndex
+
+    corpus = load_premises(args.premises)
+    report: Dict[str, Any] = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "corpus": {k: corpus.meta[k] for k in ["count", "dim", "dtype"]},
+        "k": args.k,
+    }
+
+    truth: Optional[List[List[str]]] = None
+    if args.random_queries is not None:
+        rng = np.random.default_rng(0)
+        rows = rng.choice(len(corpus), size=min(args.random_queries, len(corpus)))
+        queries = corpus.take(np.sort(rows))
+    else:
+        with open(args.goals) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        queries, report["encoding"] = encode(args, [r["goal"] for r in records])
+        if all("premises" in r for r in records):
+            truth = [r["premises"] for r in records]
+    report["queries"] = len(queries)
+
+    # The name, index, search options and size on disk of each configuration.
+    configurations: List[Tuple[str, Any, Dict[str, Any], int]] = [
+        (
+            f"exact-{corpus.meta['dtype']}",
+            PremiseIndex(corpus),
+            {},
+            embeddings_size(corpus),
+        )
+    ]
+    work_dir = args.work_dir or tempfile.mkdtemp()
+    for dtype in args.dtypes:
+        if dtype == corpus.meta["dtype"]:
+            continue
+        directory = os.path.join(work_dir, dtype)
+        # Only the embeddings: the records are read from the original corpus.
+        write_corpus(directory, Rows(corpus), (), dtype, columns=())
+        index = PremiseIndex(Corpus(directory))
+        configurations.append(
+            (f"exact-{dtype}", index, {}, embeddings_size(index.corpus))
+        )
+    ann_dirs = args.ann
+    if ann_dirs is None:
+        ann_dirs = [os.path.join(corpus.directory, "ivf")]
+        ann_dirs = [d for d in ann_dirs if os.path.exists(d)]
+    for directory in ann_dirs:
+        index = IVFIndex.load(directory, corpus)
+        name = f"ivf{index.meta['nlist']}"
+        if index.meta["pq_m"] is not None:
+            name += f"-pq{index.meta['pq_m']}"
+        for nprobe in args.nprobe:
+            kwargs = {"nprobe": nprobe, "rerank": args.rerank}
+            configurations.append(
+                (f"{name}-nprobe{nprobe}", index, kwargs, size(directory))
+            )
+
+    reference = None
+    report["configurations"] = []
+    for name, index, kwargs, disk_bytes in configurations:
+        result = search(index, queries, args.k, args.batch_size, **kwargs)
+        ids = result.pop("ids")
+        if reference is None:
+            reference = ids
+        result = {"name": name, "recall": recall(reference, ids), **result}
+        if truth is not None:
+            names = [
+                [corpus.string("full_name", i) for i in row if i >= 0] for row in ids
+            ]
+            result["ground_truth_recall"] = recall(truth, names)
+        result["disk_bytes"] = disk_bytes
+        report["configurations"].append(result)
+    report["max_rss_bytes"] = process_memory()
+    if args.work_dir is None:
+        shutil.rmtree(work_dir)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['corpus']['count']} premises, {len(queries)} queries, k={args.k}")
+    if "encoding" in report:
+        e = report["encoding"]
+        print(
+            f"  encoding: {e['unbatched']['goals_per_second']:.1f} goals/s unbatched "
+            f"(p50 {e['unbatched']['p50_ms']:.1f} ms), "
+            f"{e['batched']['goals_per_second']:.1f} goals/s batched, "
+            f"max abs diff {e['max_abs_diff']:.2e}"
+        )
+    for r in report["configurations"]:
+        truth_recall = (
+            f", ground truth {r['ground_truth_recall']:.3f}"
+            if "ground_truth_recall" in r
+            else ""
+        )
+        print(
+            f"  {r['name']:>22}: recall {r['recall']:.3f}{truth_recall}, "
+            f"{r['queries_per_second']:9.1f} q/s, p50 {r['p50_ms']:7.2f} ms, "
+            f"p99 {r['p99_ms']:7.2f} ms, peak {r['peak_alloc_bytes'] / 2**20:7.1f} MiB, "
+            f"disk {r['disk_bytes'] / 2**20:8.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
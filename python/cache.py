@@ -0,0 +1,266 @@
+import re
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from loguru import logger
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from admission import Rejected
+
+_MISSING = object()
+_SPACES = re.compile(r"[ \t\f\v]+")
+
+
+def canonicalize(text: str) -> str:
+    """Normalize whitespace in a goal without changing its line structure."""
+    lines = []
+    for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+        stripped = line.lstrip(" \t")
+        if not stripped.strip():
+            continue
+        indent = len(line) - len(stripped)
+        lines.append(" " * indent + _SPACES.sub(" ", stripped).rstrip())
+    return "\n".join(lines)
+
+
+def cache_key(name: str, config: Any, method: str, *args: str) -> str:
+    """Key for the result of `method` of model `name` on `args`.
+
+    The first argument (the model input) is canonicalized; the remaining ones
+    (e.g., the target prefix) are kept verbatim since they appear in the outputs.
+    """
+    if args:
+        args = (canonicalize(args[0]),) + args[1:]
+    payload = json.dumps([name, config, method, *args], sort_keys=True, default=repr)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _serialize(value: Any) -> bytes:
+    if isinstance(value, np.ndarray):
+        return b"N" + value.astype(np.float32).tobytes()
+    return b"J" + json.dumps(value).encode("utf-8")
+
+
+def _deserialize(data: bytes) -> Any:
+    if data[:1] == b"N":
+        return np.frombuffer(data[1:], dtype=np.float32)
+    return json.loads(data[1:].decode("utf-8"))
+
+
+class SqliteStore:
+    """Persistent cache entries in a local sqlite file."""
+
+    def __init__(self, path: str, max_entries: Optional[int] = None) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, expires REAL, accessed REAL, value BLOB)"
+        )
+        self._writes = 0
+
+    def get(self, key: str) -> Any:
+        """Return `(expires, value)` or `_MISSING`."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires, value FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return _MISSING
+            expires, value = row
+            if expires is not None and expires < now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return _MISSING
+            self._conn.execute(
+                "UPDATE cache SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+        return expires, _deserialize(value)
+
+    def put(self, key: str, value: Any, expires: Optional[float]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                (key, expires, time.time(), _serialize(value)),
+            )
+            self._writes += 1
+            if self.max_entries is not None and self._writes % 100 == 0:
+                self._prune()
+            self._conn.commit()
+
+    def _prune(self) -> None:
+        self._conn.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY accessed LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _log_error(future: Future) -> None:
+    if future.exception() is not None:
+        logger.opt(exception=future.exception()).warning("Cannot write the cache")
+
+
+class ResultCache:
+    """LRU cache of model results with optional TTL and persistence.
+
+    Concurrent requests for the same key share a single computation, unless it is
+    cancelled, rejected or not cacheable, e.g., cut short to meet the deadline of
+    the request that started it. The other requests then compute for themselves.
+
+    The persistent store is read and written by a thread of its own, in the order
+    of the calls, so that its I/O does not block the event loop.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        ttl: Optional[float] = None,
+        path: Optional[str] = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.store = SqliteStore(path, max_entries) if path else None
+        self._io = (
+            ThreadPoolExecutor(1, thread_name_prefix="result-cache") if path else None
+        )
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get(self, key: str, default: Any = _MISSING) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires is None or expires >= time.time():
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+        if self.store is not None:
+            entry = await asyncio.get_running_loop().run_in_executor(
+                self._io, self.store.get, key
+            )
+            if entry is not _MISSING:
+                expires, value = entry
+                self._remember(key, value, expires)
+                return value
+        return default
+
+    def put(self, key: str, value: Any) -> None:
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        self._remember(key, value, expires)
+        if self.store is not None:
+            self._io.submit(self.store.put, key, value, expires).add_done_callback(
+                _log_error
+            )
+
+    def _remember(self, key: str, value: Any, expires: Optional[float]) -> None:
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False  # Shared by all requests that hit it.
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        cacheable: Callable[[Any], bool] = lambda value: True,
+    ) -> Any:
+        value = await self.get(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            value = await asyncio.shield(inflight)
+            if value is not _MISSING:
+                return value
+            return await self.get_or_compute(key, compute, cacheable)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except (asyncio.CancelledError, Rejected):
+            future.set_result(_MISSING)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark as retrieved when nobody else is waiting.
+            raise
+        else:
+            shared = cacheable(value)
+            if shared:
+                self.put(key, value)
+            future.set_result(value if shared else _MISSING)
+            return value
+        finally:
+            del self._inflight[key]
+
+    async def get_or_stream(
+        self,
+        key: str,
+        stream: Callable[[], AsyncIterator[Any]],
+        cacheable: Callable[[List[Any]], bool] = lambda items: True,
+        collect: Callable[[List[Any]], Any] = list,
+    ) -> AsyncIterator[Any]:
+        """Like `get_or_compute` for a result yielded item by item: the items of
+        `stream` are yielded as they come and, once it ends, cached as
+        `collect(items)`, which a hit yields instead. Concurrent streams for the
+        same key are not shared."""
+        value = await self.get(key)
+        if value is not _MISSING:
+            self.hits += 1
+            for item in value:
+                yield item
+            return
+        self.misses += 1
+        items = []
+        async for item in stream():
+            items.append(item)
+            yield item
+        if cacheable(items):
+            self.put(key, collect(items))
+
+    def close(self) -> None:
+        """Finish the pending writes and close the persistent store."""
+        if self.store is not None:
+            self._io.shutdown()
+            self.store.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self._entries),
+            "persistent_entries": len(self.store) if self.store is not None else 0,
+        }
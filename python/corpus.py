@@ -0,0 +1,252 @@
+import os
+import json
+import shutil
+import numpy as np
+from loguru import logger
+from typing import Any, Dict, Iterable, List, Optional
+
+# A premise corpus is a directory of memory-mappable files:
+# - meta.json: the version of the format, the number of premises, the dimension
+#   and type of the embeddings, and the string columns.
+# - embeddings.npy: one row per premise, in float32, float16 or int8. Rows of int8
+#   embeddings are scaled by scales.npy (float32): row i is embeddings[i] * scales[i].
+# - <column>.bin and <column>.offsets.npy for each string column: the UTF-8 strings
+#   of all premises, concatenated, and the offsets (uint64) at which each one starts,
+#   followed by the total length.
+# - digests.npy (corpora of `embed_corpus.py`): the digest of the text encoded for
+#   each premise, so that the premises that did not change are not encoded again.
+FORMAT_VERSION = 1
+DTYPES = ("float32", "float16", "int8")
+COLUMNS = ("full_name", "path", "code")
+# Rows converted at once when writing a corpus.
+CHUNK_ROWS = 1 << 16
+
+
+def is_corpus(directory: str) -> bool:
+    return os.path.exists(os.path.join(directory, "meta.json"))
+
+
+def write_corpus(
+    directory: str,
+    embeddings: np.ndarray,
+    premises: Iterable[Dict[str, str]],
+    dtype: str = "float32",
+    columns: Iterable[str] = COLUMNS,
+    arrays: Optional[Dict[str, np.ndarray]] = None,
+    info: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Write `embeddings` (one row per premise, e.g., memory-mapped) and the
+    `columns` of `premises` as a corpus in `directory`, replacing it if it exists.
+
+    `arrays` are saved as `<name>.npy` and `info` is added to `meta.json`. The
+    indexes built in a replaced corpus (its subdirectories, e.g., `ivf`) are kept,
+    with a warning, since they may no longer match its premises.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown dtype: {dtype}")
+    columns = list(columns)
+    count, dim = embeddings.shape
+    # Written next to `directory` and moved in place once complete.
+    tmp = f"{directory.rstrip(os.sep)}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    out = np.lib.format.open_memmap(
+        os.path.join(tmp, "embeddings.npy"), mode="w+", dtype=dtype, shape=(count, dim)
+    )
+    if dtype == "int8":
+        scales = np.lib.format.open_memmap(
+            os.path.join(tmp, "scales.npy"), mode="w+", dtype=np.float32, shape=(count,)
+        )
+    for start in range(0, count, CHUNK_ROWS):
+        chunk = np.asarray(embeddings[start : start + CHUNK_ROWS], dtype=np.float32)
+        if dtype == "int8":
+            scale = np.abs(chunk).max(axis=1) / 127
+            scale[scale == 0] = 1.0
+            out[start : start + len(chunk)] = np.rint(chunk / scale[:, None])
+            scales[start : start + len(chunk)] = scale
+        else:
+            out[start : start + len(chunk)] = chunk
+    out.flush()
+    del out
+    if dtype == "int8":
+        scales.flush()
+        del scales
+
+    blobs = {c: open(os.path.join(tmp, f"{c}.bin"), "wb") for c in columns}
+    offsets: Dict[str, List[int]] = {c: [0] for c in columns}
+    try:
+        for premise in premises:
+            for c in columns:
+                data = premise[c].encode("utf-8")
+                blobs[c].write(data)
+                offsets[c].append(offsets[c][-1] + len(data))
+    finally:
+        for blob in blobs.values():
+            blob.close()
+    for c in columns:
+        if len(offsets[c]) != count + 1:
+            raise ValueError(f"{len(offsets[c]) - 1} premises for {count} embeddings")
+        np.save(
+            os.path.join(tmp, f"{c}.offsets.npy"), np.array(offsets[c], dtype=np.uint64)
+        )
+
+    for name, array in (arrays or {}).items():
+        np.save(os.path.join(tmp, f"{name}.npy"), array)
+    meta = {
+        **(info or {}),
+        "version": FORMAT_VERSION,
+        "count": count,
+        "dim": dim,
+        "dtype": dtype,
+        "columns": columns,
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    _swap(tmp, directory)
+
+
+def _swap(tmp: str, directory: str) -> None:
+    """Replace `directory` by `tmp`, moving the subdirectories of `directory` into
+    it."""
+    if not os.path.exists(directory):
+        os.replace(tmp, directory)
+        return
+    indexes = sorted(
+        e.name
+        for e in os.scandir(directory)
+        if e.is_dir() and not os.path.exists(os.path.join(tmp, e.name))
+    )
+    for name in indexes:
+        os.replace(os.path.join(directory, name), os.path.join(tmp, name))
+    if indexes:
+        logger.warning(
+            f"Kept the indexes {', '.join(indexes)} of {directory}, which are stale "
+            "if its premises changed; build them again with the scripts in `scripts`"
+        )
+    old = f"{tmp}.old"
+    shutil.rmtree(old, ignore_errors=True)
+    os.replace(directory, old)
+    os.replace(tmp, directory)
+    shutil.rmtree(old)
+
+
+def migrate(
+    embeddings_path: str,
+    dictionary_path: str,
+    directory: str,
+    dtype: str = "float32",
+) -> None:
+    """Convert the `embeddings.npy` and `dictionary.json` of the C++ FFI (see
+    `scripts/unpickle_premises.py`) to a corpus in `directory`."""
+    logger.info(f"Converting {embeddings_path} and {dictionary_path} to {directory}")
+    embeddings = np.load(embeddings_path, mmap_mode="r")
+    with open(dictionary_path) as f:
+        dictionary = json.load(f)
+    write_corpus(
+        directory,
+        embeddings,
+        (dictionary[str(i)] for i in range(len(dictionary))),
+        dtype,
+    )
+
+
+class Corpus:
+    """A premise corpus written by `write_corpus`, memory-mapped.
+
+    Opening it reads no more than `meta.json`, and any premise or row of embeddings
+    is read in constant time.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta: Dict[str, Any] = json.load(f)
+        if self.meta["version"] > FORMAT_VERSION:
+            raise ValueError(
+                f"{directory} has version {self.meta['version']} of the corpus format"
+            )
+        self.embeddings = self._load("embeddings.npy")
+        self.scales: Optional[np.ndarray] = (
+            self._load("scales.npy") if self.meta["dtype"] == "int8" else None
+        )
+        self.columns: List[str] = self.meta["columns"]
+        self._offsets = {c: self._load(f"{c}.offsets.npy") for c in self.columns}
+        self._blobs = {c: self._blob(f"{c}.bin") for c in self.columns}
+
+    def _load(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.directory, name), mmap_mode="r")
+
+    def _blob(self, name: str) -> np.ndarray:
+        path = os.path.join(self.directory, name)
+        if os.path.getsize(path) == 0:  # Empty files cannot be memory-mapped.
+            return np.empty(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode="r")
+
+    def __len__(self) -> int:
+        return self.meta["count"]
+
+    @property
+    def dim(self) -> int:
+        return self.meta["dim"]
+
+    def vectors(self, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        """Rows `start` to `end` of the embeddings, in float32 (without copying if
+        they are stored in float32)."""
+        rows = self.embeddings[start:end]
+        if self.scales is not None:
+            return rows.astype(np.float32) * self.scales[start:end, None]
+        return rows.astype(np.float32, copy=False)
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """The embeddings of the premises `rows`, in float32."""
+        vectors = self.embeddings[rows].astype(np.float32, copy=False)
+        if self.scales is not None:
+            vectors *= self.scales[rows, None]
+        return vectors
+
+    def string(self, column: str, i: int) -> str:
+        offsets = self._offsets[column]
+        return bytes(self._blobs[column][offsets[i] : offsets[i + 1]]).decode("utf-8")
+
+    def __getitem__(self, i: int) -> Dict[str, str]:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return {c: self.string(c, i) for c in self.columns}
+
+
+def needs_conversion(root: str, dtype: str = "float32") -> bool:
+    """Whether the files of the C++ FFI in `root` have no up-to-date corpus in
+    `root/corpus` with embeddings in `dtype`."""
+    if is_corpus(root):
+        return False
+    directory = os.path.join(root, "corpus")
+    if not is_corpus(directory):
+        return True
+    converted = os.path.getmtime(os.path.join(directory, "meta.json"))
+    changed = max(
+        os.path.getmtime(os.path.join(root, "embeddings.npy")),
+        os.path.getmtime(os.path.join(root, "dictionary.json")),
+    )
+    return converted < changed or Corpus(directory).meta["dtype"] != dtype
+
+
+def load_premises(root: str, dtype: str = "float32", convert: bool = True) -> Corpus:
+    """The premises in `root`: a corpus, or the `embeddings.npy` and
+    `dictionary.json` of the C++ FFI, which are converted to a corpus in
+    `root/corpus` when they change (or raise FileNotFoundError unless `convert`)."""
+    if is_corpus(root):
+        return Corpus(root)
+    directory = os.path.join(root, "corpus")
+    if needs_conversion(root, dtype):
+        if not convert:
+            raise FileNotFoundError(
+                f"The premises in {root} are not converted to a {dtype} corpus"
+            )
+        migrate(
+            os.path.join(root, "embeddings.npy"),
+            os.path.join(root, "dictionary.json"),
+            directory,
+            dtype,
+        )
+    return Corpus(directory)
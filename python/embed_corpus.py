@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import numpy as np
+from loguru import logger
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+
+from corpus import CHUNK_ROWS, Corpus, is_corpus, write_corpus
+
+DIGEST_SIZE = 16
+
+
+def serialize(premise: Dict[str, str]) -> str:
+    """The text of a premise that is encoded, as in ReProver (`Premise.serialize`):
+    its code with its name annotated as `<a>full_name</a>`."""
+    full_name = premise["full_name"]
+    annot_full_name = f"<a>{full_name}</a>"
+    code = premise["code"].replace(f"_root_.{full_name}", annot_full_name)
+    fields = full_name.split(".")
+    for i in range(len(fields)):
+        prefix = ".".join(fields[i:])
+        new_code = re.sub(f"(?<=\\s)«?{re.escape(prefix)}»?", annot_full_name, code)
+        if new_code != code:
+            code = new_code
+            break
+    return code
+
+
+def digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=DIGEST_SIZE).digest()
+
+
+def load_premise_list(path: str) -> List[Dict[str, str]]:
+    """Premises with their `full_name`, `path` and `code`, from a corpus, the
+    `dictionary.json` of the C++ FFI or a JSON Lines file."""
+    if os.path.isdir(path):
+        corpus = Corpus(path)
+        return [corpus[i] for i in range(len(corpus))]
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        dictionary = json.load(f)
+    if isinstance(dictionary, list):
+        return dictionary
+    return [dictionary[str(i)] for i in range(len(dictionary))]
+
+
+class InlinePool:
+    """Runs the calls of a `workers.WorkerPool` in the current process."""
+
+    def __init__(self, model: Any) -> None:
+        self.model = model
+
+    def submit(self, method: str, args: tuple) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(getattr(self.model, method)(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self) -> None:
+        pass
+
+
+def embed_premises(
+    premises: List[Dict[str, str]],
+    directory: str,
+    pool: Any,
+    encoder: str,
+    dtype: str = "float32",
+    normalize: bool = True,
+    batch_size: int = 64,
+    chunk_rows: int = 4096,
+) -> Dict[str, int]:
+    """Encode `premises` with the `encode_batch` of the models in `pool` (a
+    `workers.WorkerPool` or an `InlinePool`) and write them as a corpus in
+    `directory`, in the same order.
+
+    If `directory` already has a corpus of the same `encoder`, the premises whose
+    text did not change reuse its embeddings. The others are encoded in chunks of
+    `chunk_rows`, each saved in `<directory>.work` once complete, so an interrupted
+    run resumes from the last one. Batches of `batch_size` are spread over the pool.
+    """
+    if not premises:
+        raise ValueError("No premises to embed")
+    texts = [serialize(p) for p in premises]
+    digests = np.frombuffer(b"".join(digest(t) for t in texts), dtype=np.uint8)
+    digests = digests.reshape(len(texts), DIGEST_SIZE)
+
+    existing: Optional[Corpus] = None
+    rows: Dict[bytes, int] = {}
+    if is_corpus(directory):
+        corpus = Corpus(directory)
+        if (
+            corpus.meta.get("encoder") == encoder
+            and corpus.meta.get("normalized") == normalize
+            and os.path.exists(os.path.join(directory, "digests.npy"))
+        ):
+            existing = corpus
+            old = np.load(os.path.join(directory, "digests.npy"))
+            rows = {d.tobytes(): i for i, d in enumerate(old)}
+
+    # Distinct texts that are not in the existing corpus, in order.
+    todo: Dict[bytes, int] = {}
+    for i, d in enumerate(digests):
+        key = d.tobytes()
+        if key not in rows and key not in todo:
+            todo[key] = i
+    todo_rows = list(todo.values())
+    todo_index = {key: j for j, key in enumerate(todo)}
+    logger.info(
+        f"{len(premises)} premises: {len(premises) - len(todo_rows)} unchanged, "
+        f"{len(todo_rows)} to encode"
+    )
+
+    # Chunks of a previous run are only valid for the same texts to encode.
+    work = f"{directory.rstrip(os.sep)}.work"
+    job = {
+        "encoder": encoder,
+        "normalized": normalize,
+        "chunk_rows": chunk_rows,
+        "todo": hashlib.blake2b(b"".join(todo), digest_size=DIGEST_SIZE).hexdigest(),
+    }
+    job_path = os.path.join(work, "job.json")
+    if os.path.exists(job_path):
+        with open(job_path) as f:
+            if json.load(f) != job:
+                logger.info(f"Discarding the chunks in {work} of another job")
+                shutil.rmtree(work)
+    os.makedirs(work, exist_ok=True)
+    with open(job_path, "w") as f:
+        json.dump(job, f)
+
+    chunks = []
+    for c, start in enumerate(range(0, len(todo_rows), chunk_rows)):
+        path = os.path.join(work, f"chunk-{c:06d}.npy")
+        chunks.append(path)
+        if os.path.exists(path):
+            continue
+        batch = [texts[i] for i in todo_rows[start : start + chunk_rows]]
+        futures = [
+            pool.submit("encode_batch", (batch[b : b + batch_size],))
+            for b in range(0, len(batch), batch_size)
+        ]
+        vectors = np.concatenate([f.result() for f in futures]).astype(np.float32)
+        if normalize:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.maximum(norms, 1e-12)
+        np.save(f"{path}.tmp.npy", vectors)
+        os.replace(f"{path}.tmp.npy", path)
+        logger.info(f"Encoded {start + len(batch)}/{len(todo_rows)} premises")
+
+    # The embeddings of all premises, from the chunks or the existing corpus.
+    dim = np.load(chunks[0], mmap_mode="r").shape[1] if chunks else existing.dim
+    merged = np.lib.format.open_memmap(
+        os.path.join(work, "embeddings.npy"),
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(premises), dim),
+    )
+    keys = [d.tobytes() for d in digests]
+    old_rows = np.array([rows.get(key, -1) for key in keys])
+    new_rows = np.array([todo_index.get(key, -1) for key in keys])
+    for start in range(0, len(premises), CHUNK_ROWS):
+        block = old_rows[start : start + CHUNK_ROWS]
+        (positions,) = np.nonzero(block >= 0)
+        if len(positions):
+            merged[start + positions] = existing.take(block[positions])
+    for c, path in enumerate(chunks):
+        (positions,) = np.nonzero(new_rows // chunk_rows == c)
+        merged[positions] = np.load(path)[new_rows[positions] % chunk_rows]
+    merged.flush()
+
+    write_corpus(
+        directory,
+        merged,
+        premises,
+        dtype,
+        arrays={"digests": digests},
+        info={"encoder": encoder, "normalized": normalize},
+    )
+    del merged
+    shutil.rmtree(work)
+    return {"premises": len(premises), "encoded": len(todo_rows)}
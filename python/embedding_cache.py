@@ -0,0 +1,341 @@
+import os
+import re
+import json
+import fcntl
+import struct
+import threading
+import numpy as np
+from loguru import logger
+from typing import Dict, List, Optional
+
+# One record of the index log: the digest of an input and the row of its vector.
+DIGEST_SIZE = 16
+RECORD_SIZE = DIGEST_SIZE + 8
+# Rows are added to the vector file in chunks of this many.
+GROWTH = 1024
+
+
+def digest(key: str) -> bytes:
+    """16-byte digest of a hex `cache.cache_key`."""
+    return bytes.fromhex(key)[:DIGEST_SIZE]
+
+
+class EmbeddingCache:
+    """Embeddings of one model in a memory-mapped float32 file.
+
+    The directory holds `vectors.f32`, a `(rows, dim)` float32 matrix that grows in
+    chunks up to `capacity` rows, `digests.bin`, the digest of the input of each
+    row, and `index.bin`, an append-only log of `(digest, row)` records. Once
+    `capacity` vectors are stored, `eviction="fifo"` overwrites the oldest ones and
+    `eviction="none"` stops adding new ones. The digest of a row is cleared while
+    its vector is written and set before its record is appended, so a lookup whose
+    index is out of date sees that the row no longer holds its vector.
+
+    Lookups in the writer return read-only views of the memory map, so warm reads
+    copy nothing; copy a vector to keep it after it may have been evicted. Any
+    number of processes may open the cache with `readonly=True`; they pick up
+    changes made by the single writer, and their lookups return copies checked
+    against the digest of the row.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dim: Optional[int] = None,
+        capacity: Optional[int] = None,
+        eviction: str = "fifo",
+        readonly: bool = False,
+    ) -> None:
+        if eviction not in ("fifo", "none"):
+            raise ValueError(f"Unknown eviction policy: {eviction}")
+        self.path = path
+        self.readonly = readonly
+        self.eviction = eviction
+        self._lock = threading.Lock()
+        self._meta_path = os.path.join(path, "meta.json")
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._index_path = os.path.join(path, "index.bin")
+        self._digests_path = os.path.join(path, "digests.bin")
+
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            if dim is not None and dim != meta["dim"]:
+                raise ValueError(
+                    f"{path} holds {meta['dim']}-dimensional vectors, not {dim}"
+                )
+            if capacity is not None and capacity != meta["capacity"]:
+                logger.warning(
+                    f"Keeping the capacity of {path} at {meta['capacity']} vectors"
+                )
+            self.dim, self.capacity = meta["dim"], meta["capacity"]
+        elif readonly:
+            raise FileNotFoundError(f"No embedding cache at {path}")
+        else:
+            if dim is None:
+                raise ValueError("`dim` is needed to create an embedding cache")
+            os.makedirs(path, exist_ok=True)
+            self.dim = dim
+            self.capacity = capacity if capacity is not None else 1_000_000
+            with open(self._meta_path, "w") as f:
+                json.dump(
+                    {"dim": dim, "capacity": self.capacity, "dtype": "float32"}, f
+                )
+
+        if readonly and not os.path.exists(self._digests_path):
+            raise FileNotFoundError(
+                f"{path} has no digests.bin; open it for writing once to add it"
+            )
+        if not readonly:
+            # Only one process may append to the files.
+            self._writer_lock = open(os.path.join(path, "writer.lock"), "w")
+            try:
+                fcntl.flock(self._writer_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise RuntimeError(f"{path} is already open for writing") from None
+            open(self._vectors_path, "ab").close()
+            open(self._index_path, "ab").close()
+            self._index_file = open(self._index_path, "ab")
+            new_digests = not os.path.exists(self._digests_path)
+            open(self._digests_path, "ab").close()
+
+        self._vectors: Optional[np.memmap] = None
+        self._digests: Optional[np.memmap] = None
+        self._rows = 0
+        self._digest_rows = 0
+        if not readonly:
+            self._resize(os.path.getsize(self._vectors_path) // (self.dim * 4))
+        self._map_vectors()
+        self._load_index()
+        if not readonly and new_digests:
+            # A cache written before the digests of rows were stored.
+            for slot, d in self._owners.items():
+                if slot < self._rows:
+                    self._digests[slot] = np.frombuffer(d, dtype=np.uint8)
+        self.hits = 0
+        self.misses = 0
+
+    def _map_vectors(self) -> None:
+        mode = "r" if self.readonly else "r+"
+        # The digests grow first, so every mapped row has one.
+        digest_rows = os.path.getsize(self._digests_path) // DIGEST_SIZE
+        if digest_rows != self._digest_rows:
+            self._digest_rows = digest_rows
+            self._digests = (
+                np.memmap(
+                    self._digests_path,
+                    dtype=np.uint8,
+                    mode=mode,
+                    shape=(digest_rows, DIGEST_SIZE),
+                )
+                if digest_rows > 0
+                else None
+            )
+        rows = min(os.path.getsize(self._vectors_path) // (self.dim * 4), digest_rows)
+        if rows == self._rows:
+            return
+        self._rows = rows
+        self._vectors = (
+            np.memmap(
+                self._vectors_path, dtype=np.float32, mode=mode, shape=(rows, self.dim)
+            )
+            if rows > 0
+            else None
+        )
+
+    def _resize(self, rows: int) -> None:
+        with open(self._digests_path, "r+b") as f:
+            f.truncate(rows * DIGEST_SIZE)
+        with open(self._vectors_path, "r+b") as f:
+            f.truncate(rows * self.dim * 4)
+
+    def _load_index(self) -> None:
+        self._slots: Dict[bytes, int] = {}
+        self._owners: Dict[int, bytes] = {}
+        self._next = 0
+        self._records = 0
+        self._index_offset = 0
+        self._index_inode = os.stat(self._index_path).st_ino
+        self._read_index()
+
+    def _read_index(self) -> None:
+        """Apply the records appended to the index since it was last read."""
+        with open(self._index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        # Ignore a partially written record at the end.
+        count = len(data) // RECORD_SIZE
+        self._index_offset += count * RECORD_SIZE
+        for i in range(count):
+            record = data[i * RECORD_SIZE : (i + 1) * RECORD_SIZE]
+            (slot,) = struct.unpack("<Q", record[DIGEST_SIZE:])
+            self._assign(record[:DIGEST_SIZE], slot)
+
+    def _assign(self, d: bytes, slot: int) -> None:
+        previous = self._owners.get(slot)
+        if previous is not None:
+            del self._slots[previous]
+        self._slots[d] = slot
+        self._owners[slot] = d
+        self._next = (slot + 1) % self.capacity
+        self._records += 1
+
+    def _refresh(self) -> None:
+        """Pick up vectors added by the writer."""
+        try:
+            stat = os.stat(self._index_path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._index_inode:  # The writer compacted the index.
+            self._load_index()
+        elif stat.st_size > self._index_offset:
+            self._read_index()
+        self._map_vectors()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, key: str) -> bool:
+        return digest(key) in self._slots
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """The vector of `key` as a read-only view, or None."""
+        d = digest(key)
+        with self._lock:
+            if self.readonly:
+                # A stat call; the index is only re-read when the writer changed it.
+                self._refresh()
+            slot = self._slots.get(d)
+            if slot is None or slot >= self._rows:
+                self.misses += 1
+                return None
+            if self.readonly:
+                # The writer may reuse the row at any time: check its digest before
+                # and after copying the vector.
+                if self._digests[slot].tobytes() != d:
+                    self.misses += 1
+                    return None
+                vector = np.array(self._vectors[slot])
+                if self._digests[slot].tobytes() != d:
+                    self.misses += 1
+                    return None
+            else:
+                vector = self._vectors[slot]
+            self.hits += 1
+        vector = vector.view(np.ndarray)
+        vector.flags.writeable = False
+        return vector
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        return [self.get(key) for key in keys]
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        if self.readonly:
+            raise RuntimeError(f"{self.path} is open read-only")
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(
+                f"Expected a vector of size {self.dim}, got {vector.shape}"
+            )
+        d = digest(key)
+        with self._lock:
+            if d in self._slots:
+                return
+            if self.eviction == "none" and len(self._slots) >= self.capacity:
+                return
+            slot = self._next
+            if slot >= self._rows:
+                self._resize(min(self.capacity, max(slot + 1, self._rows + GROWTH)))
+                self._map_vectors()
+            self._digests[slot] = 0
+            self._vectors[slot] = vector
+            self._digests[slot] = np.frombuffer(d, dtype=np.uint8)
+            self._index_file.write(d + struct.pack("<Q", slot))
+            self._index_file.flush()
+            self._assign(d, slot)
+            self._index_offset = self._index_file.tell()
+            if self._records > 2 * self.capacity:
+                self._compact()
+
+    def _compact(self) -> None:
+        """Rewrite the index with one record per stored vector, oldest first."""
+        slots = sorted(self._owners, key=lambda s: (s - self._next) % self.capacity)
+        records = b"".join(self._owners[s] + struct.pack("<Q", s) for s in slots)
+        tmp = self._index_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(records)
+            f.flush()
+            os.fsync(f.fileno())
+        self._vectors.flush()
+        self._digests.flush()
+        os.replace(tmp, self._index_path)
+        self._index_file.close()
+        self._index_file = open(self._index_path, "ab")
+        self._records = len(slots)
+        self._index_offset = self._index_file.tell()
+        self._index_inode = os.stat(self._index_path).st_ino
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._slots),
+            "capacity": self.capacity,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._vectors is not None and not self.readonly:
+                self._vectors.flush()
+                self._digests.flush()
+            self._vectors = None
+            self._digests = None
+            self._rows = 0
+            self._digest_rows = 0
+            if not self.readonly:
+                self._index_file.close()
+                self._writer_lock.close()
+
+
+class EmbeddingCaches:
+    """One `EmbeddingCache` per model under a common directory, created when the
+    model's first vector is stored (or, read-only, when it is first looked up)."""
+
+    def __init__(
+        self,
+        root: str,
+        capacity: int = 1_000_000,
+        eviction: str = "fifo",
+        readonly: bool = False,
+    ) -> None:
+        self.root = root
+        self.capacity = capacity
+        self.eviction = eviction
+        self.readonly = readonly
+        self._caches: Dict[str, EmbeddingCache] = {}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, re.sub(r"[^\w.-]", "_", name))
+
+    def get(self, name: str, dim: Optional[int] = None) -> Optional[EmbeddingCache]:
+        cache = self._caches.get(name)
+        if cache is None:
+            path = self._path(name)
+            if dim is None and not os.path.exists(os.path.join(path, "meta.json")):
+                return None
+            cache = self._caches[name] = EmbeddingCache(
+                path,
+                dim=dim,
+                capacity=self.capacity,
+                eviction=self.eviction,
+                readonly=self.readonly,
+            )
+        return cache
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: cache.stats() for name, cache in self._caches.items()}
+
+    def close(self) -> None:
+        for cache in self._caches.values():
+            cache.close()
+        self._caches.clear()
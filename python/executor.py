@@ -0,0 +1,264 @@
+import time
+import asyncio
+import threading
+import contextvars
+from contextlib import asynccontextmanager
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Union
+
+import metrics
+from admission import AdmissionQueue, Budget, Rejected, current_budget
+from tracing import profiled, span
+from registry import ModelRegistry
+from workers import WorkerPool
+
+
+@dataclass
+class ExecutorConfig:
+    # "thread" runs models in the server process; "process" gives each worker
+    # process its own copy of the model, which avoids the GIL. "worker" also
+    # uses one process per worker, but they are passed the model loaded in the
+    # server, so that they share its weights.
+    kind: str = "thread"
+    max_workers: int = 1
+    # Maximum number of requests a model is working on at the same time.
+    max_concurrency: Optional[int] = None
+    # Maximum number of requests waiting for one of those slots; more are rejected.
+    max_queue: Optional[int] = 256
+    # Intra-op threads of each "worker" process (default: cores / max_workers).
+    num_threads: Optional[int] = None
+    # How "worker" processes are started (see `workers.START_METHODS`).
+    start_method: str = "spawn"
+
+
+# The model owned by a process-pool worker.
+_worker_model = None
+
+
+def _init_process_worker(factory: Callable[[], Any]) -> None:
+    global _worker_model
+    _worker_model = factory()
+
+
+def _call_in_process(method: str, args: tuple) -> Any:
+    return getattr(_worker_model, method)(*args)
+
+
+class InferenceExecutor:
+    """Dispatches blocking model calls off the event loop.
+
+    Each model gets its own pool, so a slow model never holds up the others.
+    """
+
+    def __init__(
+        self, registry: ModelRegistry, default: Optional[ExecutorConfig] = None
+    ) -> None:
+        self.registry = registry
+        self.default = default if default is not None else ExecutorConfig()
+        self._configs: Dict[str, ExecutorConfig] = {}
+        self._pools: Dict[str, Union[Executor, WorkerPool]] = {}
+        self._queues: Dict[str, AdmissionQueue] = {}
+        registry.on_evict(self._evicted)
+
+    def _evicted(self, name: str) -> None:
+        # Worker processes keep the weights of an evicted model alive; they are
+        # stopped once they have served the requests sent to them.
+        pool = self._pools.get(name)
+        if isinstance(pool, WorkerPool):
+            del self._pools[name]
+            threading.Thread(
+                target=pool.shutdown, name=f"{name}-shutdown", daemon=True
+            ).start()
+
+    def configure(self, name: str, **kwargs) -> None:
+        if name in self._pools:
+            raise RuntimeError(f"Executor for {name} has already been started")
+        self._configs[name] = ExecutorConfig(**kwargs)
+
+    def config(self, name: str) -> ExecutorConfig:
+        return self._configs.get(name, self.default)
+
+    def _pool(self, name: str) -> Union[Executor, WorkerPool]:
+        pool = self._pools.get(name)
+        if pool is None:
+            config = self.config(name)
+            if config.kind == "thread":
+                pool = ThreadPoolExecutor(
+                    max_workers=config.max_workers, thread_name_prefix=name
+                )
+            elif config.kind == "process":
+                pool = ProcessPoolExecutor(
+                    max_workers=config.max_workers,
+                    initializer=_init_process_worker,
+                    initargs=(self.registry.factory(name),),
+                )
+            elif config.kind == "worker":
+                pool = WorkerPool(
+                    name,
+                    self.registry[name],
+                    replicas=config.max_workers,
+                    num_threads=config.num_threads,
+                    start_method=config.start_method,
+                )
+            else:
+                raise ValueError(f"Unknown executor kind: {config.kind}")
+            self._pools[name] = pool
+        return pool
+
+    def start(self, name: str) -> None:
+        """Start the pool of model `name` now rather than on its first request.
+
+        Worker pools load the model when they start, so starting them before the
+        server accepts requests keeps the load off the event loop.
+        """
+        self._pool(name)
+
+    def queue(self, name: str) -> AdmissionQueue:
+        queue = self._queues.get(name)
+        if queue is None:
+            config = self.config(name)
+            limit = config.max_concurrency or config.max_workers
+            queue = self._queues[name] = AdmissionQueue(name, limit, config.max_queue)
+        return queue
+
+    @asynccontextmanager
+    async def _slot(self, name: str):
+        """Wait for a free slot of the model, then scale the request to the time
+        left before its deadline.
+
+        Yields a function that takes the future of the model call. If the request
+        is cancelled, e.g., its client went away, while that call is running, the
+        slot stays taken until the call is done.
+        """
+        budget = current_budget.get() or Budget()
+        queue = self.queue(name)
+        metrics.QUEUED.inc(name)
+        try:
+            with span("queue"):
+                await queue.acquire(budget)
+            try:
+                budget.scale = queue.scale(budget)
+            except Rejected:
+                queue.release()
+                raise
+        except Rejected as e:
+            metrics.REJECTED.inc(name, type(e).__name__)
+            raise
+        finally:
+            metrics.QUEUED.dec(name)
+        metrics.IN_FLIGHT.inc(name)
+        start = time.monotonic()
+        calls: List[Future] = []
+
+        def release() -> None:
+            metrics.IN_FLIGHT.dec(name)
+            queue.release()
+            queue.service_time.observe(time.monotonic() - start)
+
+        try:
+            yield calls.append
+        finally:
+            running = [call for call in calls if not call.done()]
+            if running:
+                loop = asyncio.get_running_loop()
+                running[0].add_done_callback(
+                    lambda _: loop.call_soon_threadsafe(release)
+                )
+            else:
+                release()
+
+    def _call(self, name: str, method: str, args: tuple) -> Any:
+        return self._with_model(name, lambda model: getattr(model, method)(*args))
+
+    def _with_model(self, name: str, fn: Callable[[Any], Any]) -> Any:
+        """Call `fn` with model `name`, loading it if needed, in a pool thread."""
+        metrics.current_model.set(name)
+        with span("load_model"):
+            model = self.registry[name]
+        return profiled(fn, model)
+
+    def _submit(
+        self, name: str, pool: Union[Executor, WorkerPool], method: str, args: tuple
+    ) -> Future:
+        if isinstance(pool, WorkerPool):
+            return pool.submit(method, args)
+        if isinstance(pool, ProcessPoolExecutor):
+            return pool.submit(_call_in_process, method, args)
+        # Run in a copy of the current context so that the request's trace and
+        # model name are visible in the pool's thread.
+        context = contextvars.copy_context()
+        return pool.submit(context.run, self._call, name, method, args)
+
+    async def run(self, name: str, method: str, *args) -> Any:
+        """Call `method` of model `name` with `args` in the model's pool."""
+        if name not in self.registry:
+            raise KeyError(name)
+        pool = self._pool(name)
+        async with self._slot(name) as hold:
+            call = self._submit(name, pool, method, args)
+            hold(call)
+            # Cancelling the wrapper cancels the call if it has not started.
+            return await asyncio.wrap_future(call)
+
+    async def stream(self, name: str, method: str, *args) -> AsyncIterator[Any]:
+        """Iterate over the generator returned by `method` in the model's pool."""
+        if name not in self.registry:
+            raise KeyError(name)
+        pool = self._pool(name)
+        loop = asyncio.get_running_loop()
+        async with self._slot(name) as hold:
+            if isinstance(pool, (ProcessPoolExecutor, WorkerPool)):
+                # Generators cannot cross process boundaries; stream the full result.
+                call = self._submit(name, pool, method.replace("_stream", ""), args)
+                hold(call)
+                items = await asyncio.wrap_future(call)
+                for item in items:
+                    yield item
+                return
+
+            queue: asyncio.Queue = asyncio.Queue()
+            stopped = threading.Event()
+            done = object()
+
+            def produce(model: Any) -> None:
+                for item in getattr(model, method)(*args):
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+
+            def run() -> None:
+                try:
+                    self._with_model(name, produce)
+                except Exception as e:
+                    loop.call_soon_threadsafe(queue.put_nowait, (done, e))
+                else:
+                    loop.call_soon_threadsafe(queue.put_nowait, (done, None))
+
+            call = pool.submit(contextvars.copy_context().run, run)
+            hold(call)
+            future = asyncio.wrap_future(call)
+            try:
+                while True:
+                    item, error = await queue.get()
+                    if error is not None:
+                        raise error
+                    if item is done:
+                        break
+                    yield item
+            finally:
+                # Stop producing if the consumer has gone away, e.g., the client
+                # closed the connection.
+                stopped.set()
+                await future
+
+    def shutdown(self) -> None:
+        for pool in self._pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._pools.clear()
+        self._queues.clear()
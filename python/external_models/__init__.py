@@ -1,5 +1,20 @@
-from .oai_runner import OpenAIRunner
-from .hf_runner import HFTacticGenerator
-from .vllm_runner import VLLMTacticGenerator
-from .claude_runner import ClaudeRunner
-from .gemini_runner import GeminiRunner
+from importlib import import_module
+
+# Runners are imported on first access so that unused backends cost nothing.
+_RUNNERS = {
+    "OpenAIRunner": ".oai_runner",
+    "HFTacticGenerator": ".hf_runner",
+    "VLLMTacticGenerator": ".vllm_runner",
+    "ClaudeRunner": ".claude_runner",
+    "GeminiRunner": ".gemini_runner",
+}
+
+__all__ = list(_RUNNERS)
+
+
+def __getattr__(name):
+    if name not in _RUNNERS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    runner = getattr(import_module(_RUNNERS[name], __name__), name)
+    globals()[name] = runner
+    return runner
@@ -1,17 +1,15 @@
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 import os
 
-try:
-    from anthropic import Anthropic
-except ImportError as e:
-    pass
+from tracing import span
 from .external_parser import *
 
 
 class ClaudeRunner(Generator, Transformer):
-    client = Anthropic(api_key=os.getenv("ANTHROPIC_KEY"))
-
     def __init__(self, **args):
+        from anthropic import Anthropic
+
+        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_KEY"))
         self.client_kwargs: dict[str | str] = {
             "model": args["model"],
             "temperature": args["temperature"],
@@ -23,10 +21,11 @@ class ClaudeRunner(Generator, Transformer):
     def generate(self, input: str, target_prefix: str = "") -> List[Tuple[str, float]]:
         prompt = pre_process_input(self.name, input + target_prefix)
 
-        response = self.client.completions.create(
-            prompt=prompt,
-            **self.client_kwargs,
-        )
+        with span("api_call"):
+            response = self.client.completions.create(
+                prompt=prompt,
+                **self.client_kwargs,
+            )
         content = response.completion
 
         results = [
@@ -34,6 +33,24 @@ class ClaudeRunner(Generator, Transformer):
         ]  # Currently Claude only supports one output.
         return choices_dedup(results)
 
+    def generate_stream(
+        self, input: str, target_prefix: str = ""
+    ) -> Iterator[Tuple[str, float]]:
+        prompt = pre_process_input(self.name, input + target_prefix)
+
+        stream = self.client.completions.create(
+            prompt=prompt,
+            stream=True,
+            **self.client_kwargs,
+        )
+        content = ""
+        for event in stream:
+            content += event.completion
+            # Stop reading as soon as the tactic is complete.
+            if is_complete_output(self.name, content):
+                break
+        yield (post_process_output(self.name, content), 1.0)
+
 
 if __name__ == "__main__":
     generation_kwargs = {
@@ -1,15 +1,24 @@
-import torch
 import numpy as np
-from typing import List, Tuple
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple
 from abc import ABC, abstractmethod
+from metrics import record_dedup
+from tracing import traced
+
+if TYPE_CHECKING:
+    import torch
 
 
 def get_cuda_if_available():
+    import torch
+
     return torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
+@traced("pre_process_input")
 def pre_process_input(model_name, input):
-    if model_name == "internlm/internlm2-math-plus-1_8b" or model_name == "AI-MO/Kimina-Prover-Preview-Distill-7B":    
+    if model_name.startswith(
+        ("internlm/internlm2-math-plus", "AI-MO/Kimina-Prover-Preview-Distill")
+    ):
         prompt = (
             "My LEAN 4 state is:\n```lean\n"
             + input
@@ -33,15 +42,16 @@ def pre_process_input(model_name, input):
     return prompt
 
 
+@traced("post_process_output")
 def post_process_output(model_name, output):
-    if model_name == "internlm/internlm2-math-plus-1_8b":
+    if model_name.startswith("internlm/internlm2-math-plus"):
         result = (
             output.split("assistant")[-1]
             .split("lean")[-1]
             .split("```")[0]
             .split("\n")[1]
         )
-    elif model_name == "AI-MO/Kimina-Prover-Preview-Distill-7B":
+    elif model_name.startswith("AI-MO/Kimina-Prover-Preview-Distill"):
         result = (
             output.split("assistant")[-1]
             .split("lean")[-1]
@@ -58,26 +68,61 @@ def post_process_output(model_name, output):
     return result
 
 
+@traced("dedup")
 def choices_dedup(output_list: List[tuple[str, float]]) -> List[tuple[str, float]]:
     unique_data = {}
     for item in output_list:
         if item[0] not in unique_data or item[1] > unique_data[item[0]]:
             unique_data[item[0]] = item[1]
     sorted_data = sorted(unique_data.items(), key=lambda x: x[1], reverse=True)
+    record_dedup(len(output_list), len(sorted_data))
     return sorted_data
 
 
+def choices_dedup_stream(
+    outputs: Iterable[Tuple[str, float]],
+) -> Iterator[Tuple[str, float]]:
+    """Like `choices_dedup`, but yields each output the first time it is seen."""
+    seen = set()
+    for output in outputs:
+        if output[0] not in seen:
+            seen.add(output[0])
+            yield output
+
+
+def is_complete_output(model_name, output) -> bool:
+    """Whether `output` already contains what `post_process_output` extracts."""
+    # All chat models answer with the tactic in a ```lean code block.
+    return "```" in output.split("lean")[-1]
+
+
 class Generator(ABC):
     @abstractmethod
     def generate(self, input: str, target_prefix: str = "") -> List[Tuple[str, float]]:
         pass
 
+    def generate_batch(
+        self, inputs: List[str], target_prefixes: Optional[List[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        if target_prefixes is None:
+            target_prefixes = [""] * len(inputs)
+        return [self.generate(x, p) for x, p in zip(inputs, target_prefixes)]
+
+    def generate_stream(
+        self, input: str, target_prefix: str = ""
+    ) -> Iterator[Tuple[str, float]]:
+        """Yield outputs as they become available (by default, all at the end)."""
+        yield from self.generate(input, target_prefix)
+
 
 class Encoder(ABC):
     @abstractmethod
     def encode(self, input: str) -> np.ndarray:
         pass
 
+    def encode_batch(self, inputs: List[str]) -> np.ndarray:
+        return np.stack([self.encode(x) for x in inputs])
+
 
 class Transformer:
     def cuda(self) -> None:
@@ -87,5 +132,5 @@ class Transformer:
         self.model.cpu()
 
     @property
-    def device(self) -> torch.device:
+    def device(self) -> "torch.device":
         return self.model.device
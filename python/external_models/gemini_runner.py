@@ -1,16 +1,11 @@
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 import os
 
-try:
-    import google.generativeai as genai
-    from google.generativeai import GenerationConfig
-except ImportError as e:
-    pass
+from tracing import span
 from .external_parser import *
 
 
 class GeminiRunner(Generator, Transformer):
-    client = genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
     safety_settings = [
         {
             "category": "HARM_CATEGORY_HARASSMENT",
@@ -31,6 +26,10 @@ class GeminiRunner(Generator, Transformer):
     ]
 
     def __init__(self, **args):
+        import google.generativeai as genai
+        from google.generativeai import GenerationConfig
+
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
         self.client_kwargs: dict[str | str] = {
             "model": args["model"],
             "temperature": args["temperature"],
@@ -49,17 +48,37 @@ class GeminiRunner(Generator, Transformer):
     def generate(self, input: str, target_prefix: str = "") -> List[Tuple[str, float]]:
         prompt = pre_process_input(self.name, input + target_prefix)
 
-        response = self.client.generate_content(
-            prompt,
-            generation_config=self.generation_config,
-            safety_settings=GeminiRunner.safety_settings,
-        )
+        with span("api_call"):
+            response = self.client.generate_content(
+                prompt,
+                generation_config=self.generation_config,
+                safety_settings=GeminiRunner.safety_settings,
+            )
 
         results = [
             (post_process_output(self.name, response.text), 1.0)
         ]  # Currently Gemini only supports one output.
         return choices_dedup(results)
 
+    def generate_stream(
+        self, input: str, target_prefix: str = ""
+    ) -> Iterator[Tuple[str, float]]:
+        prompt = pre_process_input(self.name, input + target_prefix)
+
+        response = self.client.generate_content(
+            prompt,
+            generation_config=self.generation_config,
+            safety_settings=GeminiRunner.safety_settings,
+            stream=True,
+        )
+        content = ""
+        for chunk in response:
+            content += chunk.text
+            # Stop reading as soon as the tactic is complete.
+            if is_complete_output(self.name, content):
+                break
+        yield (post_process_output(self.name, content), 1.0)
+
 
 if __name__ == "__main__":
     generation_kwargs = {
@@ -1,15 +1,24 @@
-import torch
 from loguru import logger
-from typing import List, Tuple
-from transformers import (
-    AutoModelForCausalLM,
-    AutoTokenizer,
-)
+import threading
+from typing import Iterator, List, Optional, Tuple
+from admission import scaled
+from assisted import DraftModel
+from metrics import record_tokens
+from precision import autocast, prepare, warmup
+from kv_cache import PrefixKVCache
+from stopping import stopping_kwargs
+from tracing import span
 from .external_parser import *
 
 
 class HFTacticGenerator(Generator, Transformer):
     def __init__(self, **args) -> None:
+        import torch
+        from transformers import (
+            AutoModelForCausalLM,
+            AutoTokenizer,
+        )
+
         self.name = args["model"]
         self.tokenizer = AutoTokenizer.from_pretrained(
             self.name, trust_remote_code=True
@@ -23,6 +32,11 @@ class HFTacticGenerator(Generator, Transformer):
         self.model = AutoModelForCausalLM.from_pretrained(
             self.name, trust_remote_code=True
         ).to(device)
+        self.precision = args.get("precision", "fp32")
+        self.model = prepare(self.model, self.precision, args.get("compile", False))
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
 
         self.generation_args: dict[str | str] = {
             "do_sample": args["do_sample"],
@@ -34,38 +48,229 @@ class HFTacticGenerator(Generator, Transformer):
             "output_logits": args["output_logits"],
             "return_dict_in_generate": args["return_dict_in_generate"],
         }
+        # Samples end as soon as they contain one of `stop` (the turn of the
+        # assistant, `<|im_end|>`, already ends them as an EOS token).
+        self.stop = args.get("stop")
+        prefix_cache_tokens = args.get("prefix_cache_tokens", 0)
+        self.prefix_cache = (
+            PrefixKVCache(prefix_cache_tokens) if prefix_cache_tokens > 0 else None
+        )
+        # A smaller model with the same tokenizer, proposing tokens for this one.
+        # Samples are then drawn one at a time.
+        draft_model = args.get("draft_model")
+        self.draft = (
+            DraftModel(
+                draft_model,
+                self.model,
+                args.get("num_assistant_tokens"),
+                self.precision,
+            )
+            if draft_model is not None
+            else None
+        )
+        if args.get("compile", False):
+            warmup(self.generate, "⊢ True")
 
     def generate(self, input: str, target_prefix: str = "") -> List[Tuple[str, float]]:
-        prompt = input + target_prefix
-        '''prompt= 'Here is a theorom you need to prove in Lean:\n'+prompt+'\nNow you should suggest one line tactic in lean code:'
-        prompt = f"""<|im_start|>user\n{prompt}<|im_end|>\n<|im_start|>assistant\n"""
-        '''
-        prompt = pre_process_input(self.name, prompt)
+        return self.generate_batch([input], [target_prefix])[0]
+
+    def generate_batch(
+        self, inputs: List[str], target_prefixes: Optional[List[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        if target_prefixes is None:
+            target_prefixes = [""] * len(inputs)
+        prompts = [
+            pre_process_input(self.name, x + p) for x, p in zip(inputs, target_prefixes)
+        ]
 
         self.model = self.model.eval()
+        n = scaled(self.generation_args["num_return_sequences"])
+        if self.draft is not None:
+            return [
+                choices_dedup(list(self._assisted_samples(prompt, n)))
+                for prompt in prompts
+            ]
+        generation_args = dict(self.generation_args, num_return_sequences=n)
 
-        tokenized_input = self.tokenizer(prompt, return_tensors="pt")
+        with span("tokenize"):
+            tokenized_input = self.tokenizer(prompts, return_tensors="pt", padding=True)
         eos_token_id = [
             self.tokenizer.eos_token_id,
             self.tokenizer.convert_tokens_to_ids(["<|im_end|>"])[0],
         ]
-        outputs = self.model.generate(
-            tokenized_input.input_ids.to(self.device),
-            eos_token_id=eos_token_id,
-            **self.generation_args,
-        )
-        response = self.tokenizer.batch_decode(
-            outputs["sequences"], skip_special_tokens=True
+        input_ids = tokenized_input.input_ids.to(self.device)
+        if self.prefix_cache is not None and len(prompts) == 1:
+            with autocast(self.model, self.precision):
+                generation_args["past_key_values"] = self.prefix_cache.prefill(
+                    self.model, input_ids, n
+                )
+        with span("model.generate"), autocast(self.model, self.precision):
+            outputs = self.model.generate(
+                input_ids,
+                attention_mask=tokenized_input.attention_mask.to(self.device),
+                pad_token_id=self.tokenizer.pad_token_id,
+                eos_token_id=eos_token_id,
+                **generation_args,
+                **stopping_kwargs(
+                    self.tokenizer,
+                    self.stop,
+                    input_ids.shape[1],
+                    generation_args.get("num_beams", 1),
+                    self.tokenizer.eos_token_id,
+                ),
+            )
+        with span("batch_decode"):
+            response = self.tokenizer.batch_decode(
+                outputs["sequences"], skip_special_tokens=True
+            )
+        generated = outputs["sequences"][:, tokenized_input.input_ids.shape[1] :]
+        record_tokens((generated != self.tokenizer.pad_token_id).sum().item())
+
+        results = []
+        for i in range(len(prompts)):
+            result = []
+            # The j-th candidate of each input is scored with the logits of step j
+            # (or of the last step, when all samples stopped earlier).
+            for j, out in enumerate(response[i * n : (i + 1) * n]):
+                score = outputs.scores[min(j, len(outputs.scores) - 1)][i * n + j]
+                out = post_process_output(self.name, out)
+                result.append((out, score.exp().sum().log().cpu().item()))
+            results.append(choices_dedup(result))
+        return results
+
+    def _assisted_samples(self, prompt: str, n: int) -> Iterator[Tuple[str, float]]:
+        """Draw `n` samples for `prompt` one at a time, with the draft model."""
+        with span("tokenize"):
+            tokenized_input = self.tokenizer(prompt, return_tensors="pt")
+        input_ids = tokenized_input.input_ids.to(self.device)
+        eos_token_id = [
+            self.tokenizer.eos_token_id,
+            self.tokenizer.convert_tokens_to_ids(["<|im_end|>"])[0],
+        ]
+        generation_args = dict(self.generation_args, num_return_sequences=1)
+        for j in range(n):
+            with span("model.generate"), autocast(self.model, self.precision):
+                outputs = self.model.generate(
+                    input_ids,
+                    attention_mask=tokenized_input.attention_mask.to(self.device),
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    eos_token_id=eos_token_id,
+                    **generation_args,
+                    **self.draft.generate_kwargs(),
+                    **stopping_kwargs(self.tokenizer, self.stop, input_ids.shape[1]),
+                )
+            with span("batch_decode"):
+                response = self.tokenizer.batch_decode(
+                    outputs["sequences"], skip_special_tokens=True
+                )[0]
+            num_tokens = outputs["sequences"].shape[1] - input_ids.shape[1]
+            record_tokens(num_tokens)
+            self.draft.record(num_tokens)
+            # Scored with the logits of step j, as in `generate_batch`.
+            scores = outputs.scores
+            score = scores[min(j, len(scores) - 1)][0]
+            yield (
+                post_process_output(self.name, response),
+                score.exp().sum().log().cpu().item(),
+            )
+
+    def generate_stream(
+        self, input: str, target_prefix: str = ""
+    ) -> Iterator[Tuple[str, float]]:
+        if not self.generation_args["do_sample"]:
+            yield from super().generate_stream(input, target_prefix)
+            return
+        yield from choices_dedup_stream(self._sample_stream(input, target_prefix))
+
+    def _sample_stream(
+        self, input: str, target_prefix: str
+    ) -> Iterator[Tuple[str, float]]:
+        from transformers import (
+            StoppingCriteria,
+            StoppingCriteriaList,
+            TextIteratorStreamer,
         )
 
-        result = []
-        index = 0
-        for out, score in zip(response, outputs.scores):
-            out = post_process_output(self.name, out)
-            result.append((out, score[index].exp().sum().log().cpu().item()))
-            index += 1
-        result = choices_dedup(result)
-        return result
+        class StopWhenSet(StoppingCriteria):
+            def __init__(self, event: threading.Event) -> None:
+                self.event = event
+
+            def __call__(self, input_ids, scores, **kwargs) -> bool:
+                return self.event.is_set()
+
+        prompt = pre_process_input(self.name, input + target_prefix)
+
+        self.model = self.model.eval()
+
+        with span("tokenize"):
+            tokenized_input = self.tokenizer(prompt, return_tensors="pt")
+        eos_token_id = [
+            self.tokenizer.eos_token_id,
+            self.tokenizer.convert_tokens_to_ids(["<|im_end|>"])[0],
+        ]
+        generation_args = dict(self.generation_args, num_return_sequences=1)
+
+        # Samples are drawn one at a time, and each is yielded as soon as the
+        # streamed text contains a complete tactic.
+        for j in range(scaled(self.generation_args["num_return_sequences"])):
+            streamer = TextIteratorStreamer(
+                self.tokenizer, skip_prompt=True, skip_special_tokens=True
+            )
+            done = threading.Event()
+            result = {}
+            sample_args = dict(generation_args)
+            # Assisted generation manages the caches of both models itself.
+            if self.prefix_cache is not None and self.draft is None:
+                # After the first sample, the whole prompt is cached.
+                with autocast(self.model, self.precision):
+                    sample_args["past_key_values"] = self.prefix_cache.prefill(
+                        self.model, tokenized_input.input_ids.to(self.device), 1
+                    )
+
+            def run() -> None:
+                try:
+                    if self.draft is not None:
+                        # Forward passes are counted in the generating thread.
+                        sample_args.update(self.draft.generate_kwargs())
+                    # Autocast is per thread, so it is entered in this one.
+                    with autocast(self.model, self.precision):
+                        result["outputs"] = self.model.generate(
+                            tokenized_input.input_ids.to(self.device),
+                            attention_mask=tokenized_input.attention_mask.to(
+                                self.device
+                            ),
+                            eos_token_id=eos_token_id,
+                            streamer=streamer,
+                            stopping_criteria=StoppingCriteriaList([StopWhenSet(done)]),
+                            **sample_args,
+                        )
+                    if self.draft is not None:
+                        result["steps"] = self.draft.steps()
+                except Exception as e:
+                    result["error"] = e
+                    streamer.end()
+
+            thread = threading.Thread(target=run)
+            thread.start()
+            content = ""
+            for text in streamer:
+                content += text
+                if is_complete_output(self.name, content):
+                    done.set()
+            thread.join()
+            if "error" in result:
+                raise result["error"]
+
+            record_tokens(len(result["outputs"].scores))
+            if self.draft is not None:
+                self.draft.record(len(result["outputs"].scores), result["steps"])
+            # Scored with the logits of step j, as in `generate_batch`.
+            scores = result["outputs"].scores
+            score = scores[min(j, len(scores) - 1)][0]
+            yield (
+                post_process_output(self.name, content),
+                score.exp().sum().log().cpu().item(),
+            )
 
 
 if __name__ == "__main__":
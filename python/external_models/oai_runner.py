@@ -1,18 +1,20 @@
-import numpy as np
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 import os
 import numpy as np
-import openai
-from openai import OpenAI
+from loguru import logger
+from admission import scaled
+from metrics import record_retry, record_tokens
+from tracing import span
 from .external_parser import *
 
 
 class OpenAIRunner(Generator, Transformer):
-    client = OpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-    )
-
     def __init__(self, **args):
+        from openai import OpenAI
+
+        self.client = OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+        )
         self.client_kwargs: dict[str | str] = {
             "model": args["model"],
             "temperature": args["temperature"],
@@ -22,21 +24,26 @@ class OpenAIRunner(Generator, Transformer):
             "presence_penalty": 0,
             "n": args["num_return_sequences"],
             "timeout": args["openai_timeout"],
-            # "stop": args.stop,  # stop is only used for base models currently
         }
+        if args.get("stop"):
+            # At most 4 stop sequences, which are cut from the completions.
+            self.client_kwargs["stop"] = args["stop"]
         self.name = self.client_kwargs["model"]
 
     def generate(self, input: str, target_prefix: str = "") -> List[Tuple[str, float]]:
+        import openai
+
         prompt = pre_process_input(self.name, input + target_prefix)
         prompt = [
             {"role": "user", "content": f"{prompt}"},
         ]
         try:
-            response = OpenAIRunner.client.chat.completions.create(
-                messages=prompt,
-                logprobs=True,
-                **self.client_kwargs,
-            )
+            with span("api_call"):
+                response = self.client.chat.completions.create(
+                    messages=prompt,
+                    logprobs=True,
+                    **dict(self.client_kwargs, n=scaled(self.client_kwargs["n"])),
+                )
         except (
             openai.APIError,
             openai.RateLimitError,
@@ -47,14 +54,18 @@ class OpenAIRunner(Generator, Transformer):
             openai.InternalServerError,
             openai.APIConnectionError,
         ) as e:
-            print("Exception: ", repr(e))
-            print("Consider reducing the number of parallel processes.")
+            logger.warning(
+                f"Retrying after {e!r}. Consider reducing the number of parallel processes."
+            )
+            record_retry()
             return OpenAIRunner.generate(self, input, target_prefix)
         except Exception as e:
-            print(f"Failed to run the model for {prompt}!")
-            print("Exception: ", repr(e))
+            logger.error(f"Failed to run the model for {prompt}: {e!r}")
             raise e
 
+        if response.usage is not None:
+            record_tokens(response.usage.completion_tokens)
+
         results = [
             (
                 post_process_output(self.name, c.message.content),
@@ -64,6 +75,40 @@ class OpenAIRunner(Generator, Transformer):
         ]
         return choices_dedup(results)
 
+    def generate_stream(
+        self, input: str, target_prefix: str = ""
+    ) -> Iterator[Tuple[str, float]]:
+        yield from choices_dedup_stream(self._choice_stream(input, target_prefix))
+
+    def _choice_stream(
+        self, input: str, target_prefix: str
+    ) -> Iterator[Tuple[str, float]]:
+        prompt = pre_process_input(self.name, input + target_prefix)
+        prompt = [
+            {"role": "user", "content": f"{prompt}"},
+        ]
+        stream = self.client.chat.completions.create(
+            messages=prompt,
+            logprobs=True,
+            stream=True,
+            **dict(self.client_kwargs, n=scaled(self.client_kwargs["n"])),
+        )
+        # Choices are decoded in parallel; each is yielded once it has finished.
+        contents = {}
+        logprobs = {}
+        for chunk in stream:
+            for c in chunk.choices:
+                contents.setdefault(c.index, []).append(c.delta.content or "")
+                if c.logprobs is not None and c.logprobs.content:
+                    logprobs.setdefault(c.index, []).extend(
+                        token.logprob for token in c.logprobs.content
+                    )
+                if c.finish_reason is not None:
+                    yield (
+                        post_process_output(self.name, "".join(contents[c.index])),
+                        np.exp(-np.mean(logprobs.get(c.index, [0.0]))),
+                    )
+
 
 if __name__ == "__main__":
     generation_kwargs = {
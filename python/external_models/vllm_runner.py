@@ -1,20 +1,24 @@
-import torch
 import numpy as np
 from loguru import logger
-from typing import List, Tuple
-from transformers import AutoTokenizer
-
-try:
-    from vllm import LLM, SamplingParams
-except ImportError as e:
-    print("Cannot import vllm")
-    pass
+from typing import List, Optional, Tuple
+from admission import scaled
+from metrics import record_tokens
+from tracing import span
 from .external_parser import *
 
 
 class VLLMTacticGenerator(Generator, Transformer):
     def __init__(self, **args) -> None:
+        import torch
+        from transformers import AutoTokenizer
+        from vllm import LLM, SamplingParams
+
         self.name = args["model"]
+        self.tokenizer = AutoTokenizer.from_pretrained(
+            self.name, trust_remote_code=True
+        )
+        stop = args.get("stop") or []
+        special_tokens = self.tokenizer.added_tokens_encoder
         self.llm = LLM(
             model=self.name,
             tokenizer=self.name,
@@ -33,10 +37,10 @@ class VLLMTacticGenerator(Generator, Transformer):
             presence_penalty=0,
             logprobs=0,
             prompt_logprobs=0,
-        )
-
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            self.name, trust_remote_code=True
+            # Samples end at the first of `stop`, which is cut from their text.
+            # vLLM matches text without special tokens, so those end samples by id.
+            stop=[s for s in stop if s not in special_tokens],
+            stop_token_ids=[special_tokens[s] for s in stop if s in special_tokens],
         )
         device = args["device"]
         if device == "auto":
@@ -46,22 +50,38 @@ class VLLMTacticGenerator(Generator, Transformer):
         logger.info(f"Loading {self.name} on {device}")
 
     def generate(self, input: str, target_prefix: str = "") -> List[Tuple[str, float]]:
-        prompt = input + target_prefix
-        '''prompt= 'Here is a theorom you need to prove in Lean:\n'+prompt+'\nNow you should suggest one line tactic in lean code:'
-        prompt = f"""<|im_start|>user\n{prompt}<|im_end|>\n<|im_start|>assistant\n"""
-        '''
-        prompt = pre_process_input(self.name, prompt)
+        return self.generate_batch([input], [target_prefix])[0]
 
-        vllm_outputs = self.llm.generate(prompt, self.sampling_params)
-        result = []
-        for output in vllm_outputs[0].outputs:  # bsz=1 for now
-            out = output.text.split("<|im_end|>")[0]
-            result.append(
-                (post_process_output(self.name, out), np.exp(output.cumulative_logprob))
-            )
+    def generate_batch(
+        self, inputs: List[str], target_prefixes: Optional[List[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        if target_prefixes is None:
+            target_prefixes = [""] * len(inputs)
+        prompts = [
+            pre_process_input(self.name, x + p) for x, p in zip(inputs, target_prefixes)
+        ]
 
-        result = choices_dedup(result)
-        return result
+        sampling_params = self.sampling_params
+        n = scaled(sampling_params.n)
+        if n != sampling_params.n:
+            sampling_params = sampling_params.clone()
+            sampling_params.n = n
+        with span("model.generate"):
+            vllm_outputs = self.llm.generate(prompts, sampling_params)
+        results = []
+        for vllm_output in vllm_outputs:
+            result = []
+            for output in vllm_output.outputs:
+                record_tokens(len(output.token_ids))
+                out = output.text.split("<|im_end|>")[0]
+                result.append(
+                    (
+                        post_process_output(self.name, out),
+                        np.exp(output.cumulative_logprob),
+                    )
+                )
+            results.append(choices_dedup(result))
+        return results
 
 
 if __name__ == "__main__":
@@ -70,6 +90,7 @@ if __name__ == "__main__":
         "tensor_parallel_size": 1,
         "temperature": 0.6,
         "max_tokens": 1024,
+        "stop": ["<|im_end|>"],
         "top_p": 0.9,
         "length_penalty": 0,
         "n": 32,
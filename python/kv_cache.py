@@ -0,0 +1,108 @@
+import copy
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Optional, Tuple
+
+import metrics
+from tracing import span
+
+if TYPE_CHECKING:
+    import torch
+
+
+class PrefixKVCache:
+    """LRU of the KV caches of recent prompts of a decoder-only model.
+
+    Prompts that share a prefix with a cached one (e.g., the same goal with another
+    target prefix, or a goal revisited by proof search) only run the model on the
+    tokens after the longest shared prefix. The cache is bounded by the total
+    number of tokens of its entries, since the memory of a KV cache is proportional
+    to its length.
+    """
+
+    def __init__(self, max_tokens: int, min_reuse_tokens: int = 8) -> None:
+        self.max_tokens = max_tokens
+        # Shorter shared prefixes are not worth copying a cache for.
+        self.min_reuse_tokens = min_reuse_tokens
+        self._entries: "OrderedDict[bytes, Tuple[np.ndarray, Any]]" = OrderedDict()
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _longest_prefix(self, ids: np.ndarray) -> Tuple[int, Optional[bytes]]:
+        best, best_key = 0, None
+        for key, (prefix, _) in self._entries.items():
+            m = min(len(prefix), len(ids))
+            mismatch = np.flatnonzero(prefix[:m] != ids[:m])
+            length = int(mismatch[0]) if len(mismatch) else m
+            if length > best:
+                best, best_key = length, key
+        return best, best_key
+
+    def lookup(self, ids: np.ndarray) -> Tuple[int, Any]:
+        """The length of the longest cached prefix of `ids` and a copy of its cache
+        cropped to that length, or `(0, None)`."""
+        with self._lock:
+            length, key = self._longest_prefix(ids)
+            if key is None or length < self.min_reuse_tokens:
+                return 0, None
+            self._entries.move_to_end(key)
+            cache = self._entries[key][1]
+        cache = copy.deepcopy(cache)
+        cache.crop(length)
+        return length, cache
+
+    def put(self, ids: np.ndarray, cache: Any) -> None:
+        if len(ids) > self.max_tokens:
+            return
+        key = ids.tobytes()
+        with self._lock:
+            # Drop the entries this one extends; their prefixes are still cached.
+            for other, (prefix, _) in list(self._entries.items()):
+                if len(prefix) <= len(ids) and np.array_equal(
+                    prefix, ids[: len(prefix)]
+                ):
+                    del self._entries[other]
+                    self._tokens -= len(prefix)
+            self._entries[key] = (ids, cache)
+            self._tokens += len(ids)
+            while self._tokens > self.max_tokens:
+                _, (prefix, _) = self._entries.popitem(last=False)
+                self._tokens -= len(prefix)
+
+    def prefill(self, model: Any, input_ids: "torch.Tensor", num_sequences: int) -> Any:
+        """A KV cache for `generate` to produce `num_sequences` beams or samples of
+        the prompt `input_ids` (of shape `(1, L)`), or None for one-token prompts.
+        It covers all the tokens of the prompt but the last one, which `generate`
+        needs to run itself.
+
+        Only the tokens after the longest cached prefix are run through the model.
+        """
+        import torch
+        from transformers import DynamicCache
+
+        ids = input_ids[0, :-1]
+        prefix = ids.cpu().numpy()
+        length, cache = self.lookup(prefix)
+        name = metrics.current_model.get()
+        metrics.PREFILL_REUSED_TOKENS.inc(name, amount=length)
+        metrics.PREFILL_TOKENS.inc(name, amount=len(prefix) - length)
+        if length < len(prefix):
+            # Not `inference_mode`: `generate` extends these tensors outside of it.
+            with span("prefill"), torch.no_grad():
+                cache = model(
+                    ids[None, length:],
+                    past_key_values=cache if cache is not None else DynamicCache(),
+                    use_cache=True,
+                ).past_key_values
+            if isinstance(cache, tuple):  # Older models return the legacy format.
+                cache = DynamicCache.from_legacy_cache(cache)
+            self.put(prefix, cache)
+            # `generate` appends to the cache, so it gets a copy of the cached one.
+            cache = copy.deepcopy(cache)
+        if cache is not None and num_sequences > 1:
+            cache.batch_repeat_interleave(num_sequences)
+        return cache
@@ -0,0 +1,181 @@
+import os
+import re
+import json
+import array
+import shutil
+import hashlib
+import numpy as np
+from loguru import logger
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from corpus import Corpus
+from retrieval import top_k
+
+# The lexical index of a corpus is a directory with:
+# - meta.json: the version of the format, the number of premises and terms, the
+#   average number of tokens per premise and the BM25 parameters.
+# - terms.npy: the 64-bit hash of each term, sorted.
+# - offsets.npy, docs.npy and tfs.npy: the postings of the i-th term are the premises
+#   docs[offsets[i]:offsets[i + 1]] (ascending), where it occurs tfs[...] times.
+# - lengths.npy: the number of tokens of each premise.
+FORMAT_VERSION = 1
+
+# Lean identifiers, e.g., `Nat.gcd_comm`, `Finset.sum_le_sum'` or `α`.
+IDENTIFIER = re.compile(r"[^\W\d][\w.'!?₀-₉ₐ-ₜ]*")
+
+
+def tokenize(text: str) -> List[str]:
+    """The terms of `text`: each identifier, lowercased, with its components
+    (`nat`, `gcd_comm`), their words (`gcd`, `comm`) and its prefixes that end
+    before an underscore (`nat.gcd`), so that `Nat.gcd` in a goal matches the
+    `Nat.gcd_*` lemmas."""
+    terms = []
+    for match in IDENTIFIER.finditer(text):
+        identifier = match.group().strip(".").lower()
+        if not identifier:
+            continue
+        terms.append(identifier)
+        parts = identifier.split(".")
+        if len(parts) > 1:
+            terms.extend(p for p in parts if p)
+        for part in parts:
+            words = [w for w in part.split("_") if w]
+            if len(words) > 1:
+                terms.extend(words)
+        for i, c in enumerate(identifier):
+            if c == "_" and i > 0 and identifier[i - 1] not in "._":
+                terms.append(identifier[:i])
+    return terms
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+def build_lexical(corpus: Corpus, directory: Optional[str] = None) -> None:
+    """Index the terms of the `full_name` and `code` of the premises of `corpus` in
+    `directory` (by default, the `lexical` directory of the corpus)."""
+    if directory is None:
+        directory = os.path.join(corpus.directory, "lexical")
+    vocabulary: Dict[str, int] = {}
+    term_ids, docs, tfs = array.array("q"), array.array("I"), array.array("H")
+    lengths = np.empty(len(corpus), dtype=np.uint32)
+    for i in range(len(corpus)):
+        terms = tokenize(f"{corpus.string('full_name', i)} {corpus.string('code', i)}")
+        lengths[i] = len(terms)
+        for term, tf in Counter(terms).items():
+            term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+            docs.append(i)
+            tfs.append(min(tf, 0xFFFF))
+        if (i + 1) % 100_000 == 0:
+            logger.info(f"Tokenized {i + 1}/{len(corpus)} premises")
+
+    # Terms are sorted by hash and their postings by premise.
+    hashes = np.array([term_hash(t) for t in vocabulary], dtype=np.uint64)
+    rank = np.empty(len(hashes), dtype=np.int64)
+    rank[np.argsort(hashes)] = np.arange(len(hashes))
+    term_ids = rank[np.frombuffer(term_ids, dtype=np.int64)]
+    order = np.argsort(term_ids, kind="stable")
+    offsets = np.zeros(len(hashes) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(term_ids, minlength=len(hashes)))
+
+    tmp = f"{directory.rstrip(os.sep)}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    arrays = {
+        "terms": np.sort(hashes),
+        "offsets": offsets,
+        "docs": np.frombuffer(docs, dtype=np.uint32)[order],
+        "tfs": np.frombuffer(tfs, dtype=np.uint16)[order],
+        "lengths": lengths,
+    }
+    for name, a in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), a)
+    meta = {
+        "version": FORMAT_VERSION,
+        "count": len(corpus),
+        "terms": len(hashes),
+        "average_length": float(lengths.mean()) if len(corpus) else 0.0,
+        "k1": 1.2,
+        "b": 0.75,
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp, directory)
+
+
+class LexicalIndex:
+    """BM25 over the terms of the premises, from an index of `build_lexical`.
+
+    Only the postings of the terms of a query are read, so a query costs time in
+    the number of premises that share a term with it rather than in the size of
+    the corpus.
+    """
+
+    def __init__(self, directory: str) -> None:
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["version"] > FORMAT_VERSION:
+            raise ValueError(f"{directory} has version {self.meta['version']}")
+        load = lambda name: np.load(
+            os.path.join(directory, f"{name}.npy"), mmap_mode="r"
+        )
+        self.terms = load("terms")
+        self.offsets = load("offsets")
+        self.docs = load("docs")
+        self.tfs = load("tfs")
+        # The length normalization of BM25 for each premise.
+        k1, b = self.meta["k1"], self.meta["b"]
+        average = max(self.meta["average_length"], 1.0)
+        self.norms = k1 * (1 - b + b * load("lengths").astype(np.float32) / average)
+
+    def __len__(self) -> int:
+        return self.meta["count"]
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        h = np.uint64(term_hash(term))
+        i = int(np.searchsorted(self.terms, h))
+        if i == len(self.terms) or self.terms[i] != h:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint16)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.docs[start:end], self.tfs[start:end]
+
+    def search(
+        self, queries: List[str], k: int, rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The indices and BM25 scores of the `k` best premises (among `rows`, if
+        given) for each of `queries`, best first. Rows with fewer than `k` premises
+        sharing a term with the query are padded with index -1 and score -inf."""
+        allowed = None
+        if rows is not None:
+            allowed = np.zeros(len(self), dtype=bool)
+            allowed[rows] = True
+        k1 = self.meta["k1"]
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        totals = np.zeros(len(self), dtype=np.float32)
+        for q, query in enumerate(queries):
+            matched = []
+            for term in set(tokenize(query)):
+                docs, tfs = self._postings(term)
+                if len(docs) == 0:
+                    continue
+                idf = np.log(1 + (len(self) - len(docs) + 0.5) / (len(docs) + 0.5))
+                tfs = tfs.astype(np.float32)
+                # Postings have one entry per premise, so `+=` does not lose any.
+                totals[docs] += idf * tfs * (k1 + 1) / (tfs + self.norms[docs])
+                matched.append(docs)
+            if not matched:
+                continue
+            candidates = np.unique(np.concatenate(matched)).astype(np.int64)
+            if allowed is not None:
+                candidates = candidates[allowed[candidates]]
+            best, best_scores = top_k(totals[candidates][None], k)
+            ids[q, : best.shape[1]] = candidates[best[0]]
+            scores[q, : best.shape[1]] = best_scores[0]
+            totals[np.concatenate(matched)] = 0
+        return ids, scores
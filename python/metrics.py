@@ -0,0 +1,285 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+# The model whose request is being served, so that runners can record metrics
+# without knowing the name they are registered under in the server.
+current_model: ContextVar[str] = ContextVar("current_model", default="")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = (
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            values = list(self._values.items())
+        return [("", _format_labels(self.labels, k), v) for k, v in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class CallbackGauge(Metric):
+    """A gauge whose samples are computed when the metrics are scraped."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str],
+        callback: Callable[[], Dict[tuple, float]],
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        return [
+            ("", _format_labels(self.labels, k), v) for k, v in self.callback().items()
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # Per label values: [count per bucket..., count in +Inf, sum].
+        self._values: Dict[tuple, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            values = [(k, list(v)) for k, v in self._values.items()]
+        samples = []
+        names = self.labels + ("le",)
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket_labels = _format_labels(names, labels + (bound,))
+                samples.append(("_bucket", bucket_labels, cumulative))
+            samples.append(("_count", _format_labels(self.labels, labels), cumulative))
+            samples.append(("_sum", _format_labels(self.labels, labels), counts[-1]))
+        return samples
+
+
+REGISTRY: List[Metric] = []
+
+REQUESTS = Counter(
+    "lean_copilot_requests_total",
+    "Requests by model, endpoint and status code.",
+    ["model", "endpoint", "status"],
+)
+LATENCY = Histogram(
+    "lean_copilot_request_latency_seconds",
+    "Request latency by model and endpoint.",
+    ["model", "endpoint"],
+)
+IN_FLIGHT = Gauge(
+    "lean_copilot_requests_in_flight",
+    "Model calls currently running.",
+    ["model"],
+)
+QUEUED = Gauge(
+    "lean_copilot_requests_queued",
+    "Model calls waiting for a free slot in the model's pool.",
+    ["model"],
+)
+REJECTED = Counter(
+    "lean_copilot_requests_rejected_total",
+    "Requests rejected because the model's queue was full or their deadline could not be met.",
+    ["model", "reason"],
+)
+CANDIDATES = Counter(
+    "lean_copilot_generated_candidates_total",
+    "Candidates returned to clients.",
+    ["model"],
+)
+GENERATED_TOKENS = Counter(
+    "lean_copilot_generated_tokens_total",
+    "Tokens generated by the models.",
+    ["model"],
+)
+DEDUP_INPUTS = Counter(
+    "lean_copilot_dedup_inputs_total",
+    "Candidates passed to choices_dedup.",
+    ["model"],
+)
+DEDUP_OUTPUTS = Counter(
+    "lean_copilot_dedup_outputs_total",
+    "Unique candidates kept by choices_dedup.",
+    ["model"],
+)
+PREFILL_TOKENS = Counter(
+    "lean_copilot_prefill_tokens_total",
+    "Prompt tokens run through decoder-only models with a prefix KV cache.",
+    ["model"],
+)
+PREFILL_REUSED_TOKENS = Counter(
+    "lean_copilot_prefill_reused_tokens_total",
+    "Prompt tokens whose keys and values were reused from the prefix KV cache.",
+    ["model"],
+)
+ASSISTED_TOKENS = Counter(
+    "lean_copilot_assisted_tokens_total",
+    "Tokens generated with a draft model (assisted decoding).",
+    ["model"],
+)
+ASSISTED_STEPS = Counter(
+    "lean_copilot_assisted_steps_total",
+    "Forward passes of the target model during assisted decoding.",
+    ["model"],
+)
+API_RETRIES = Counter(
+    "lean_copilot_api_retries_total",
+    "Retries of remote API calls.",
+    ["model"],
+)
+
+
+def record_tokens(count: int) -> None:
+    GENERATED_TOKENS.inc(current_model.get(), amount=count)
+
+
+def record_assisted(tokens: int, steps: int) -> None:
+    model = current_model.get()
+    ASSISTED_TOKENS.inc(model, amount=tokens)
+    ASSISTED_STEPS.inc(model, amount=steps)
+
+
+def record_dedup(before: int, after: int) -> None:
+    model = current_model.get()
+    DEDUP_INPUTS.inc(model, amount=before)
+    DEDUP_OUTPUTS.inc(model, amount=after)
+
+
+def record_retry() -> None:
+    API_RETRIES.inc(current_model.get())
+
+
+@contextmanager
+def track(model: str, endpoint: str) -> Iterator[None]:
+    """Count a request and observe its latency."""
+    start = time.perf_counter()
+    status = "500"
+    try:
+        yield
+        status = "200"
+    except Exception as e:
+        status = str(getattr(e, "status_code", 500))
+        raise
+    finally:
+        REQUESTS.inc(model, endpoint, status)
+        LATENCY.observe(time.perf_counter() - start, model, endpoint)
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+def drain() -> Dict[str, Dict[tuple, Any]]:
+    """The values of the counters and histograms recorded since the last call, which
+    are reset, e.g., in a worker process to send them to the server (see `merge`).
+    Gauges are left out."""
+    values = {}
+    for metric in REGISTRY:
+        if isinstance(metric, (Counter, Histogram)) and not isinstance(metric, Gauge):
+            with metric._lock:
+                if metric._values:
+                    values[metric.name] = metric._values
+                    metric._values = {}
+    return values
+
+
+def merge(values: Dict[str, Dict[tuple, Any]]) -> None:
+    """Add the `drain`ed values of another process to the metrics."""
+    metrics = {metric.name: metric for metric in REGISTRY}
+    for name, samples in values.items():
+        metric = metrics.get(name)
+        if metric is None:
+            continue
+        with metric._lock:
+            for labels, value in samples.items():
+                if isinstance(metric, Histogram):
+                    counts = metric._values.setdefault(labels, [0] * len(value))
+                    for i, v in enumerate(value):
+                        counts[i] += v
+                else:
+                    metric._values[labels] = metric._values.get(labels, 0) + value
@@ -1,14 +1,19 @@
-import torch
 import numpy as np
 from loguru import logger
-from typing import List, Tuple
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
 from abc import ABC, abstractmethod
-from transformers import (
-    AutoModelForCausalLM,
-    AutoModelForSeq2SeqLM,
-    AutoTokenizer,
-    AutoModelForTextEncoding,
-)
+from admission import scaled
+from assisted import DraftModel
+from metrics import record_tokens
+from precision import autocast, prepare, warmup
+from kv_cache import PrefixKVCache
+from stopping import stopping_kwargs, truncate
+from tracing import span
+
+# torch and transformers are imported when a model is created, so that importing
+# this module (and the server) stays cheap.
+if TYPE_CHECKING:
+    import torch
 
 
 class Generator(ABC):
@@ -16,12 +21,28 @@ class Generator(ABC):
     def generate(self, input: str, target_prefix: str = "") -> List[Tuple[str, float]]:
         pass
 
+    def generate_batch(
+        self, inputs: List[str], target_prefixes: Optional[List[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        if target_prefixes is None:
+            target_prefixes = [""] * len(inputs)
+        return [self.generate(x, p) for x, p in zip(inputs, target_prefixes)]
+
+    def generate_stream(
+        self, input: str, target_prefix: str = ""
+    ) -> Iterator[Tuple[str, float]]:
+        """Yield outputs as they become available (by default, all at the end)."""
+        yield from self.generate(input, target_prefix)
+
 
 class Encoder(ABC):
     @abstractmethod
     def encode(self, input: str) -> np.ndarray:
         pass
 
+    def encode_batch(self, inputs: List[str]) -> np.ndarray:
+        return np.stack([self.encode(x) for x in inputs])
+
 
 class Transformer:
     def cuda(self) -> None:
@@ -31,23 +52,82 @@ class Transformer:
         self.model.cpu()
 
     @property
-    def device(self) -> torch.device:
+    def device(self) -> "torch.device":
         return self.model.device
 
 
 def get_cuda_if_available():
+    import torch
+
     return torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
+def length_buckets(lengths: List[int], max_batch_tokens: int) -> List[List[int]]:
+    """Group the indices of inputs with `lengths` into batches of similar lengths
+    with at most `max_batch_tokens` tokens each, counting padding."""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    buckets = []
+    start = 0
+    while start < len(order):
+        # `order` is sorted, so the last input of a bucket is its longest.
+        end = start + 1
+        while (
+            end < len(order)
+            and lengths[order[end]] * (end + 1 - start) <= max_batch_tokens
+        ):
+            end += 1
+        buckets.append(order[start:end])
+        start = end
+    return buckets
+
+
+def length_budget(
+    max_length: Optional[int], max_new_tokens: Optional[int]
+) -> Dict[str, int]:
+    """The arguments of `generate` bounding the length of the outputs.
+    `max_new_tokens` does not count the prompt, unlike `max_length` for decoder-only
+    models, and takes precedence over it."""
+    if max_new_tokens is not None:
+        return {"max_new_tokens": max_new_tokens}
+    if max_length is None:
+        raise ValueError("Either max_length or max_new_tokens is required")
+    return {"max_length": max_length}
+
+
+def sequence_scores(model: Any, output: Any, eos_token_id: int) -> List[float]:
+    """The probabilities of the sequences generated by `model.generate`."""
+    if getattr(output, "sequences_scores", None) is not None:
+        return output.sequences_scores.exp().tolist()
+    # Greedy search does not score sequences: sum the log-probabilities of their
+    # tokens up to EOS, as beam search does without length penalty.
+    logprobs = model.compute_transition_scores(
+        output.sequences, output.scores, normalize_logits=True
+    )
+    is_eos = output.sequences[:, -logprobs.shape[1] :] == eos_token_id
+    after_eos = is_eos.cumsum(-1) - is_eos.int() > 0
+    return logprobs.masked_fill(after_eos, 0.0).sum(-1).exp().tolist()
+
+
 class DecoderOnlyTransformer(Generator, Transformer):
     def __init__(
         self,
         name: str,
         num_return_sequences: int,
-        max_length: int,
+        max_length: Optional[int] = None,
         length_penalty: float = 0.0,
         device: str = "cpu",
+        precision: str = "fp32",
+        compile: bool = False,
+        prefix_cache_tokens: int = 0,
+        max_new_tokens: Optional[int] = None,
+        max_input_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        draft_model: Optional[str] = None,
+        num_assistant_tokens: Optional[int] = None,
     ) -> None:
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
         self.tokenizer = AutoTokenizer.from_pretrained(name)
         if device == "auto":
             device = get_cuda_if_available()
@@ -55,42 +135,138 @@ class DecoderOnlyTransformer(Generator, Transformer):
             device = torch.device(device)
         logger.info(f"Loading {name} on {device}")
         self.model = AutoModelForCausalLM.from_pretrained(name).to(device)
+        self.precision = precision
+        self.model = prepare(self.model, precision, compile)
+        self.tokenizer.padding_side = "left"
+        # Long prompts lose their beginning rather than the end they are continued from.
+        self.tokenizer.truncation_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
         self.max_length = max_length
+        self.length_budget = length_budget(max_length, max_new_tokens)
+        self.max_input_tokens = max_input_tokens
+        # Each beam ends as soon as its generated text contains one of `stop`, which
+        # is cut from the outputs.
+        self.stop = stop
         self.num_return_sequences = num_return_sequences
         self.length_penalty = length_penalty
-
-    def generate(self, input: str, target_prefix: str = "") -> List[Tuple[str, float]]:
-        tokenized_input = self.tokenizer(input + target_prefix, return_tensors="pt")
-        output = self.model.generate(
-            tokenized_input.input_ids.to(self.device),
-            max_length=self.max_length,
-            num_beams=self.num_return_sequences,
-            length_penalty=self.length_penalty,
-            do_sample=False,
-            num_return_sequences=self.num_return_sequences,
-            early_stopping=False,
-            return_dict_in_generate=True,
-            output_scores=True,
+        # Keys and values of recent prompts, reused by prompts that share a prefix
+        # with them (up to `prefix_cache_tokens` tokens in total).
+        self.prefix_cache = (
+            PrefixKVCache(prefix_cache_tokens) if prefix_cache_tokens > 0 else None
         )
-        raw_outputs = self.tokenizer.batch_decode(
-            output.sequences, skip_special_tokens=True
+        # Proposes tokens for greedy search, i.e., when one sequence is returned.
+        self.draft = (
+            DraftModel(draft_model, self.model, num_assistant_tokens, precision)
+            if draft_model is not None
+            else None
         )
-        outputs = []
+        if self.draft is not None and num_return_sequences > 1:
+            logger.warning(
+                f"{name} uses beam search, which does not use the draft model "
+                "unless requests are scaled down to one sequence"
+            )
+        if compile:
+            warmup(self.generate, "⊢ True")
 
-        for out, score in zip(raw_outputs, output.sequences_scores.exp()):
-            assert out.startswith(input + target_prefix)
-            outputs.append((out[len(input) :], score.item()))
+    def generate(self, input: str, target_prefix: str = "") -> List[Tuple[str, float]]:
+        return self.generate_batch([input], [target_prefix])[0]
 
-        return outputs
+    def generate_batch(
+        self, inputs: List[str], target_prefixes: Optional[List[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        if target_prefixes is None:
+            target_prefixes = [""] * len(inputs)
+        n = scaled(self.num_return_sequences)
+        assisted = self.draft is not None and n == 1
+        if assisted and len(inputs) > 1:
+            # Assisted generation takes one prompt at a time.
+            return [
+                self.generate_batch([x], [p])[0]
+                for x, p in zip(inputs, target_prefixes)
+            ]
+        prompts = [x + p for x, p in zip(inputs, target_prefixes)]
+        # Prompts are padded on the left so that generation continues right after them.
+        with span("tokenize"):
+            tokenized_input = self.tokenizer(
+                prompts,
+                return_tensors="pt",
+                padding=True,
+                truncation=self.max_input_tokens is not None,
+                max_length=self.max_input_tokens,
+            )
+        input_ids = tokenized_input.input_ids.to(self.device)
+        cache_kwargs = {}
+        # Prompts in a batch are padded differently, so only single prompts reuse
+        # cached prefixes.
+        if self.prefix_cache is not None and len(prompts) == 1 and not assisted:
+            with autocast(self.model, self.precision):
+                cache_kwargs["past_key_values"] = self.prefix_cache.prefill(
+                    self.model, input_ids, n
+                )
+        if assisted:
+            cache_kwargs.update(self.draft.generate_kwargs())
+        with span("model.generate"), autocast(self.model, self.precision):
+            output = self.model.generate(
+                input_ids,
+                attention_mask=tokenized_input.attention_mask.to(self.device),
+                pad_token_id=self.tokenizer.pad_token_id,
+                num_beams=n,
+                length_penalty=self.length_penalty,
+                do_sample=False,
+                num_return_sequences=n,
+                early_stopping=False,
+                return_dict_in_generate=True,
+                output_scores=True,
+                **self.length_budget,
+                **stopping_kwargs(self.tokenizer, self.stop, input_ids.shape[1], n),
+                **cache_kwargs,
+            )
+        with span("batch_decode"):
+            raw_outputs = self.tokenizer.batch_decode(
+                output.sequences, skip_special_tokens=True
+            )
+            # The same as `prompts`, unless they were truncated.
+            decoded_prompts = self.tokenizer.batch_decode(
+                tokenized_input.input_ids, skip_special_tokens=True
+            )
+        generated = output.sequences[:, tokenized_input.input_ids.shape[1] :]
+        num_tokens = (generated != self.tokenizer.pad_token_id).sum().item()
+        record_tokens(num_tokens)
+        if assisted:
+            self.draft.record(num_tokens)
+        scores = sequence_scores(self.model, output, self.tokenizer.eos_token_id)
+        results = []
+
+        for i, (prefix, prompt) in enumerate(zip(target_prefixes, decoded_prompts)):
+            outputs = []
+            for out, score in zip(
+                raw_outputs[i * n : (i + 1) * n], scores[i * n : (i + 1) * n]
+            ):
+                assert out.startswith(prompt)
+                outputs.append(
+                    (prefix + truncate(out[len(prompt) :], self.stop), score)
+                )
+            results.append(outputs)
+
+        return results
 
 
 class PythiaTacticGenerator(DecoderOnlyTransformer):
     def __init__(
         self,
         num_return_sequences: int,
-        max_length: int,
+        max_length: Optional[int] = None,
         length_penalty: float = 0.0,
         device: str = "cpu",
+        precision: str = "fp32",
+        compile: bool = False,
+        prefix_cache_tokens: int = 0,
+        max_new_tokens: Optional[int] = None,
+        max_input_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        draft_model: Optional[str] = None,
+        num_assistant_tokens: Optional[int] = None,
     ) -> None:
         super().__init__(
             "wellecks/llmstep-mathlib4-pythia2.8b",
@@ -98,10 +274,24 @@ class PythiaTacticGenerator(DecoderOnlyTransformer):
             max_length,
             length_penalty,
             device,
+            precision,
+            compile,
+            prefix_cache_tokens,
+            max_new_tokens,
+            max_input_tokens,
+            stop,
+            draft_model,
+            num_assistant_tokens,
         )
 
-    def generate(self, input: str, target_prefix: str = "") -> List[Tuple[str, float]]:
-        return super().generate(f"[GOAL]{input}[PROOFSTEP]{target_prefix}")
+    def generate_batch(
+        self, inputs: List[str], target_prefixes: Optional[List[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        if target_prefixes is None:
+            target_prefixes = [""] * len(inputs)
+        return super().generate_batch(
+            [f"[GOAL]{x}[PROOFSTEP]{p}" for x, p in zip(inputs, target_prefixes)]
+        )
 
 
 class EncoderDecoderTransformer(Generator, Transformer):
@@ -109,61 +299,392 @@ class EncoderDecoderTransformer(Generator, Transformer):
         self,
         name: str,
         num_return_sequences: int,
-        max_length: int,
+        max_length: Optional[int] = None,
         length_penalty: float = 0.0,
         device: str = "cpu",
+        precision: str = "fp32",
+        compile: bool = False,
+        max_new_tokens: Optional[int] = None,
+        max_input_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
     ) -> None:
+        import torch
+        from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
         self.tokenizer = AutoTokenizer.from_pretrained(name)
         if device == "auto":
             device = get_cuda_if_available()
         else:
             device = torch.device(device)
         logger.info(f"Loading {name} on {device}")
-        self.model = AutoModelForSeq2SeqLM.from_pretrained(name)
+        self.model = AutoModelForSeq2SeqLM.from_pretrained(name).to(device)
+        self.precision = precision
+        self.model = prepare(self.model, precision, compile)
         self.max_length = max_length
+        self.length_budget = length_budget(max_length, max_new_tokens)
+        self.max_input_tokens = max_input_tokens
+        self.stop = stop
         self.num_return_sequences = num_return_sequences
         self.length_penalty = length_penalty
+        if compile:
+            warmup(self.generate, "⊢ True")
 
     def generate(self, input: str, target_prefix: str = "") -> List[Tuple[str, float]]:
-        assert (
-            target_prefix == ""
+        return self.generate_batch([input], [target_prefix])[0]
+
+    def generate_batch(
+        self, inputs: List[str], target_prefixes: Optional[List[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        assert target_prefixes is None or all(
+            p == "" for p in target_prefixes
         ), "target_prefix is not supported by encoder-decoder Transformer"
-        tokenized_input = self.tokenizer(input, return_tensors="pt")
-        output = self.model.generate(
-            tokenized_input.input_ids.to(self.device),
-            max_length=self.max_length,
-            num_beams=self.num_return_sequences,
-            length_penalty=self.length_penalty,
-            do_sample=False,
-            num_return_sequences=self.num_return_sequences,
-            early_stopping=False,
-            return_dict_in_generate=True,
-            output_scores=True,
-        )
-        raw_outputs = self.tokenizer.batch_decode(
-            output.sequences, skip_special_tokens=True
-        )
-        return list(zip(raw_outputs, output.sequences_scores.exp().tolist()))
+        n = scaled(self.num_return_sequences)
+        with span("tokenize"):
+            tokenized_input = self.tokenizer(
+                inputs,
+                return_tensors="pt",
+                padding=True,
+                truncation=self.max_input_tokens is not None,
+                max_length=self.max_input_tokens,
+            )
+        with span("model.generate"), autocast(self.model, self.precision):
+            output = self.model.generate(
+                tokenized_input.input_ids.to(self.device),
+                attention_mask=tokenized_input.attention_mask.to(self.device),
+                num_beams=n,
+                length_penalty=self.length_penalty,
+                do_sample=False,
+                num_return_sequences=n,
+                early_stopping=False,
+                return_dict_in_generate=True,
+                output_scores=True,
+                **self.length_budget,
+                # Decoder sequences only start with the decoder start token.
+                **stopping_kwargs(self.tokenizer, self.stop, 0, n),
+            )
+        with span("batch_decode"):
+            raw_outputs = self.tokenizer.batch_decode(
+                output.sequences, skip_special_tokens=True
+            )
+        record_tokens((output.sequences != self.tokenizer.pad_token_id).sum().item())
+        scores = sequence_scores(self.model, output, self.tokenizer.eos_token_id)
+        raw_outputs = [truncate(out, self.stop) for out in raw_outputs]
+        return [
+            list(zip(raw_outputs[i * n : (i + 1) * n], scores[i * n : (i + 1) * n]))
+            for i in range(len(inputs))
+        ]
 
 
 class EncoderOnlyTransformer(Encoder, Transformer):
-    def __init__(self, name: str, device: str = "cpu") -> None:
+    def __init__(
+        self,
+        name: str,
+        device: str = "cpu",
+        precision: str = "fp32",
+        compile: bool = False,
+    ) -> None:
+        import torch
+        from transformers import AutoModelForTextEncoding, AutoTokenizer
+
         self.tokenizer = AutoTokenizer.from_pretrained(name)
         if device == "auto":
             device = get_cuda_if_available()
         else:
             device = torch.device(device)
         logger.info(f"Loading {name} on {device}")
-        self.model = AutoModelForTextEncoding.from_pretrained(name)
+        self.model = AutoModelForTextEncoding.from_pretrained(name).to(device)
+        self.precision = precision
+        self.model = prepare(self.model, precision, compile)
+        if compile:
+            warmup(self.encode, "⊢ True")
+
+    def encode(self, input: str) -> np.ndarray:
+        return self.encode_batch([input])[0]
+
+    def encode_batch(
+        self, inputs: List[str], max_batch_tokens: int = 16384
+    ) -> np.ndarray:
+        """Encode `inputs` into a contiguous float32 matrix, one row per input.
+
+        Inputs are sorted by length and encoded in buckets of similar lengths with
+        at most `max_batch_tokens` tokens (including padding) each, so that short
+        goals are not padded to the length of the longest one. Features are the
+        mean of the hidden states over the non-padding positions, as in training.
+        """
+        import torch
+
+        with span("tokenize"):
+            input_ids = self.tokenizer(inputs).input_ids
+        features = None
+        for bucket in length_buckets([len(ids) for ids in input_ids], max_batch_tokens):
+            with span("tokenize"):
+                batch = self.tokenizer.pad(
+                    {"input_ids": [input_ids[i] for i in bucket]}, return_tensors="pt"
+                )
+            attention_mask = batch.attention_mask.to(self.device)
+            with span("model.forward"), torch.inference_mode(), autocast(
+                self.model, self.precision
+            ):
+                hidden_state = self.model(
+                    batch.input_ids.to(self.device), attention_mask=attention_mask
+                ).last_hidden_state
+                lens = attention_mask.sum(dim=1, keepdim=True)
+                pooled = (hidden_state * attention_mask.unsqueeze(2)).sum(dim=1) / lens
+            if features is None:
+                features = np.empty((len(inputs), pooled.shape[1]), dtype=np.float32)
+            features[bucket] = pooled.float().cpu().numpy()
+        if features is None:
+            features = np.empty((0, self.model.config.hidden_size), dtype=np.float32)
+        return features
+
+
+class CTranslate2Model:
+    """A model converted with `scripts/convert_to_ct2.py`, run by CTranslate2.
+
+    `compute_type` is the type used for computation (e.g., "int8", "int8_float32",
+    "float32"); the weights are converted to it when loaded. `inter_threads` is the
+    number of batches processed in parallel and `intra_threads` the number of
+    threads used by each of them (0 for the CTranslate2 default).
+    """
+
+    def _load(
+        self,
+        cls_name: str,
+        path: str,
+        tokenizer: str,
+        device: str,
+        compute_type: str,
+        inter_threads: int,
+        intra_threads: int,
+    ) -> None:
+        import ctranslate2
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer)
+        logger.info(f"Loading {path} on {device} ({compute_type})")
+        self.model = getattr(ctranslate2, cls_name)(
+            path,
+            device=device,
+            compute_type=compute_type,
+            inter_threads=inter_threads,
+            intra_threads=intra_threads,
+        )
+
+    def cuda(self) -> None:
+        logger.info(f"CTranslate2 models stay on {self.device}, chosen when loaded")
+
+    def cpu(self) -> None:
+        logger.info(f"CTranslate2 models stay on {self.device}, chosen when loaded")
+
+    @property
+    def device(self) -> str:
+        return self.model.device
+
+    def _tokens(self, text: str, add_special_tokens: bool = True) -> List[str]:
+        return self.tokenizer.convert_ids_to_tokens(
+            self.tokenizer.encode(text, add_special_tokens=add_special_tokens)
+        )
+
+    def _text(self, tokens: List[str]) -> str:
+        return self.tokenizer.decode(
+            self.tokenizer.convert_tokens_to_ids(tokens), skip_special_tokens=True
+        )
+
+
+class CT2EncoderDecoder(Generator, CTranslate2Model):
+    """CTranslate2 counterpart of `EncoderDecoderTransformer`."""
+
+    def __init__(
+        self,
+        path: str,
+        tokenizer: str,
+        num_return_sequences: int,
+        max_length: int,
+        length_penalty: float = 0.0,
+        device: str = "cpu",
+        compute_type: str = "int8",
+        inter_threads: int = 1,
+        intra_threads: int = 0,
+    ) -> None:
+        self._load(
+            "Translator",
+            path,
+            tokenizer,
+            device,
+            compute_type,
+            inter_threads,
+            intra_threads,
+        )
+        self.num_return_sequences = num_return_sequences
+        self.max_length = max_length
+        self.length_penalty = length_penalty
+
+    def generate(self, input: str, target_prefix: str = "") -> List[Tuple[str, float]]:
+        return self.generate_batch([input], [target_prefix])[0]
+
+    def generate_batch(
+        self, inputs: List[str], target_prefixes: Optional[List[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        if target_prefixes is None:
+            target_prefixes = [""] * len(inputs)
+        n = scaled(self.num_return_sequences)
+        with span("tokenize"):
+            tokens = [self._tokens(x) for x in inputs]
+            prefixes = [
+                self._tokens(p, add_special_tokens=False) for p in target_prefixes
+            ]
+        with span("model.generate"):
+            results = self.model.translate_batch(
+                tokens,
+                target_prefix=prefixes if any(prefixes) else None,
+                beam_size=n,
+                num_hypotheses=n,
+                length_penalty=self.length_penalty,
+                max_decoding_length=self.max_length,
+                disable_unk=True,
+                return_scores=True,
+            )
+        outputs = []
+        with span("batch_decode"):
+            for result in results:
+                record_tokens(sum(len(h) for h in result.hypotheses))
+                outputs.append(
+                    [
+                        (self._text(h), float(np.exp(score)))
+                        for h, score in zip(result.hypotheses, result.scores)
+                    ]
+                )
+        return outputs
+
+
+class CT2DecoderOnly(Generator, CTranslate2Model):
+    """CTranslate2 counterpart of `DecoderOnlyTransformer`.
+
+    As there, `max_length` counts the prompt (the longest one of a batch) and
+    `max_new_tokens` does not.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        tokenizer: str,
+        num_return_sequences: int,
+        max_length: Optional[int] = None,
+        length_penalty: float = 0.0,
+        device: str = "cpu",
+        compute_type: str = "int8",
+        inter_threads: int = 1,
+        intra_threads: int = 0,
+        max_new_tokens: Optional[int] = None,
+    ) -> None:
+        self._load(
+            "Generator",
+            path,
+            tokenizer,
+            device,
+            compute_type,
+            inter_threads,
+            intra_threads,
+        )
+        self.num_return_sequences = num_return_sequences
+        self.max_length = max_length
+        self.length_budget = length_budget(max_length, max_new_tokens)
+        self.length_penalty = length_penalty
+
+    def generate(self, input: str, target_prefix: str = "") -> List[Tuple[str, float]]:
+        return self.generate_batch([input], [target_prefix])[0]
+
+    def generate_batch(
+        self, inputs: List[str], target_prefixes: Optional[List[str]] = None
+    ) -> List[List[Tuple[str, float]]]:
+        if target_prefixes is None:
+            target_prefixes = [""] * len(inputs)
+        n = scaled(self.num_return_sequences)
+        with span("tokenize"):
+            prompts = [self._tokens(x + p) for x, p in zip(inputs, target_prefixes)]
+        # CTranslate2 does not count the prompt, which the padded prompts of
+        # `DecoderOnlyTransformer` all take up to the longest one.
+        max_new_tokens = self.length_budget.get("max_new_tokens")
+        if max_new_tokens is None:
+            max_new_tokens = max(self.max_length - max(map(len, prompts)), 1)
+        with span("model.generate"):
+            results = self.model.generate_batch(
+                prompts,
+                beam_size=n,
+                num_hypotheses=n,
+                length_penalty=self.length_penalty,
+                max_length=max_new_tokens,
+                include_prompt_in_result=False,
+                return_scores=True,
+            )
+        outputs = []
+        with span("batch_decode"):
+            for p, result in zip(target_prefixes, results):
+                record_tokens(sum(len(ids) for ids in result.sequences_ids))
+                # Like `DecoderOnlyTransformer`, outputs start with the target prefix.
+                outputs.append(
+                    [
+                        (p + self._text(tokens), float(np.exp(score)))
+                        for tokens, score in zip(result.sequences, result.scores)
+                    ]
+                )
+        return outputs
+
+
+class CT2EncoderOnly(Encoder, CTranslate2Model):
+    """CTranslate2 counterpart of `EncoderOnlyTransformer`."""
+
+    def __init__(
+        self,
+        path: str,
+        tokenizer: str,
+        device: str = "cpu",
+        compute_type: str = "int8",
+        inter_threads: int = 1,
+        intra_threads: int = 0,
+    ) -> None:
+        from transformers import AutoConfig
+
+        self._load(
+            "Encoder",
+            path,
+            tokenizer,
+            device,
+            compute_type,
+            inter_threads,
+            intra_threads,
+        )
+        self.hidden_size = AutoConfig.from_pretrained(tokenizer).hidden_size
 
-    @torch.no_grad()
     def encode(self, input: str) -> np.ndarray:
-        tokenized_input = self.tokenizer(input, return_tensors="pt")
-        hidden_state = self.model(
-            tokenized_input.input_ids.to(self.device)
-        ).last_hidden_state
-        feature = hidden_state.mean(dim=1).squeeze()
-        return feature.cpu().numpy()
+        return self.encode_batch([input])[0]
+
+    def encode_batch(
+        self, inputs: List[str], max_batch_tokens: int = 16384
+    ) -> np.ndarray:
+        """Same as `EncoderOnlyTransformer.encode_batch`."""
+        with span("tokenize"):
+            tokens = [self._tokens(x) for x in inputs]
+        features = None
+        for bucket in length_buckets([len(t) for t in tokens], max_batch_tokens):
+            with span("model.forward"):
+                output = self.model.forward_batch([tokens[i] for i in bucket])
+            hidden_state = output.last_hidden_state
+            if self.device == "cuda":
+                import torch
+
+                hidden_state = torch.as_tensor(hidden_state).cpu()
+            hidden_state = np.asarray(hidden_state, dtype=np.float32)
+            # Mean over the non-padding positions only.
+            lens = np.array([len(tokens[i]) for i in bucket])
+            mask = np.arange(hidden_state.shape[1])[None, :] < lens[:, None]
+            pooled = (hidden_state * mask[:, :, None]).sum(axis=1) / lens[:, None]
+            if features is None:
+                features = np.empty((len(inputs), pooled.shape[1]), dtype=np.float32)
+            features[bucket] = pooled
+        if features is None:
+            features = np.empty((0, self.hidden_size), dtype=np.float32)
+        return features
 
 
 if __name__ == "__main__":
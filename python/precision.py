@@ -0,0 +1,55 @@
+from contextlib import nullcontext
+from loguru import logger
+from typing import TYPE_CHECKING, Any, Callable, ContextManager
+
+if TYPE_CHECKING:
+    import torch
+
+# - "fp32": full precision.
+# - "bf16": bfloat16 weights, with matmuls under CPU/CUDA autocast. Halves the
+#   memory of the weights; fast on CPUs with AVX512-BF16 or AMX.
+# - "int8": dynamic int8 quantization of the linear layers (CPU only). Weights of
+#   linear layers take a quarter of the memory; activations stay in fp32.
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def prepare(
+    model: "torch.nn.Module", precision: str = "fp32", compile: bool = False
+) -> "torch.nn.Module":
+    """Convert `model` for inference in `precision`, optionally with `torch.compile`.
+
+    Models using `compile` should be warmed up (see `warmup`) before serving, since
+    the first calls are compiled.
+    """
+    import torch
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}")
+    model = model.eval()
+    if precision == "bf16":
+        model = model.to(torch.bfloat16)
+    elif precision == "int8":
+        if model.device.type != "cpu":
+            raise ValueError("int8 dynamic quantization is only supported on CPUs")
+        model = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    if compile:
+        model.forward = torch.compile(model.forward, dynamic=True)
+    return model
+
+
+def autocast(model: "torch.nn.Module", precision: str) -> ContextManager:
+    """The context in which to run a model prepared for `precision`."""
+    if precision != "bf16":
+        return nullcontext()
+    import torch
+
+    return torch.autocast(model.device.type, dtype=torch.bfloat16)
+
+
+def warmup(fn: Callable[..., Any], *args) -> None:
+    """Call `fn` once so that compilation happens at load rather than on the first
+    request."""
+    logger.info("Warming up the compiled model")
+    fn(*args)
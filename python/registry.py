@@ -0,0 +1,173 @@
+import gc
+import os
+import threading
+from collections import OrderedDict
+from functools import partial
+from loguru import logger
+from typing import Any, Callable, Dict, List, Optional
+
+
+def estimate_memory(model: Any) -> int:
+    """Estimate the number of bytes held by a model's weights (including those of
+    its draft model, if any)."""
+    total = 0
+    draft = getattr(model, "draft", None)
+    if draft is not None:
+        total += estimate_memory(draft)
+    module = getattr(model, "model", None)
+    if module is None or not hasattr(module, "parameters"):
+        return total
+    tensors = list(module.parameters()) + list(module.buffers())
+    for submodule in module.modules():
+        # The weights of dynamically quantized (int8) linear layers are packed, and
+        # are neither parameters nor buffers.
+        packed = getattr(submodule, "_packed_params", None)
+        if hasattr(packed, "_weight_bias"):
+            tensors.extend(t for t in packed._weight_bias() if t is not None)
+    for tensor in tensors:
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def process_memory() -> int:
+    """Resident set size of the current process in bytes (0 if unknown)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def free_memory() -> None:
+    gc.collect()
+    try:
+        import torch
+    except ImportError:
+        return
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class ModelRegistry:
+    """Models that are created on first use and evicted in LRU order.
+
+    `max_memory` is the budget (in bytes) for the weights of all resident models.
+    Before a model is loaded again, the least recently used models are evicted
+    until it fits next to the others, by its size when it was last loaded. If
+    loading a model still exceeds the budget (e.g., on its first load), models
+    are evicted after it is loaded. The model being requested is never evicted,
+    so a single model larger than the budget is still served.
+    """
+
+    def __init__(self, max_memory: Optional[int] = None) -> None:
+        self.max_memory = max_memory
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._resident: "OrderedDict[str, Any]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        # The size of each model when it was last loaded, resident or not.
+        self._last_sizes: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._evict_callbacks: List[Callable[[str], None]] = []
+
+    def on_evict(self, callback: Callable[[str], None]) -> None:
+        """Call `callback` with the name of each evicted model, e.g., to stop the
+        processes serving it."""
+        self._evict_callbacks.append(callback)
+
+    def _evicted(self, names: List[str]) -> None:
+        for name in names:
+            for callback in self._evict_callbacks:
+                callback(name)
+
+    def register(self, name: str, cls: Callable[..., Any], *args, **kwargs) -> None:
+        self._factories[name] = partial(cls, *args, **kwargs)
+
+    def factory(self, name: str) -> Callable[[], Any]:
+        return self._factories[name]
+
+    def config(self, name: str) -> Dict[str, Any]:
+        """The class and arguments that model `name` is created with."""
+        factory = self._factories[name]
+        return {
+            "class": f"{factory.func.__module__}.{factory.func.__qualname__}",
+            "args": list(factory.args),
+            "kwargs": dict(factory.keywords),
+        }
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._factories
+
+    def __getitem__(self, name: str) -> Any:
+        return self.get(name)
+
+    def names(self) -> List[str]:
+        return list(self._factories)
+
+    def get(self, name: str) -> Any:
+        with self._lock:
+            if name in self._resident:
+                self._resident.move_to_end(name)
+                return self._resident[name]
+            factory = self._factories[name]
+            loading = self._loading.setdefault(name, threading.Lock())
+
+        # Load outside of the registry lock so that other models stay available.
+        with loading:
+            with self._lock:
+                if name in self._resident:
+                    self._resident.move_to_end(name)
+                    return self._resident[name]
+            with self._lock:
+                # Make room first, so that memory does not peak above the budget.
+                evicted = self._evict(keep=name, reserve=self._last_sizes.get(name, 0))
+            self._evicted(evicted)
+            logger.info(f"Loading model {name}")
+            rss = process_memory()
+            model = factory()
+            # Models without torch weights in `self.model` (e.g., vLLM) are
+            # accounted for by the growth of the process.
+            size = estimate_memory(model) or max(process_memory() - rss, 0)
+            with self._lock:
+                self._resident[name] = model
+                self._sizes[name] = self._last_sizes[name] = size
+                evicted = self._evict(keep=name)
+            self._evicted(evicted)
+            return model
+
+    def evict(self, name: str) -> bool:
+        with self._lock:
+            if name not in self._resident:
+                return False
+            del self._resident[name]
+            del self._sizes[name]
+        logger.info(f"Evicted model {name}")
+        free_memory()
+        self._evicted([name])
+        return True
+
+    def _evict(self, keep: str, reserve: int = 0) -> List[str]:
+        """Evict models other than `keep` until `reserve` more bytes fit."""
+        if self.max_memory is None:
+            return []
+        evicted = []
+        while self.memory_usage() + reserve > self.max_memory:
+            victim = next((n for n in self._resident if n != keep), None)
+            if victim is None:
+                break
+            del self._resident[victim]
+            del self._sizes[victim]
+            evicted.append(victim)
+        if evicted:
+            logger.info(f"Evicted models {evicted} to stay within the memory budget")
+            free_memory()
+        return evicted
+
+    def memory_usage(self) -> int:
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def resident(self) -> Dict[str, int]:
+        """Resident models in LRU order (least recently used first) and their sizes."""
+        with self._lock:
+            return {name: self._sizes[name] for name in self._resident}
@@ -0,0 +1,182 @@
+import numpy as np
+from loguru import logger
+from typing import Any, Dict, List, Optional, Tuple
+
+from corpus import Corpus
+
+# How premises are retrieved (see `PremiseIndex.retrieve`).
+MODES = ("dense", "lexical", "rerank", "fusion")
+# The constant of reciprocal rank fusion.
+RRF_K = 60
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """The indices and values of the `k` largest scores in each row of `scores`, in
+    decreasing order. Only those `k` are sorted."""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k < n:
+        indices = np.argpartition(scores, n - k, axis=1)[:, n - k :]
+    else:
+        indices = np.broadcast_to(np.arange(n), scores.shape)
+    values = np.take_along_axis(scores, indices, axis=1)
+    order = np.argsort(-values, axis=1, kind="stable")
+    return (
+        np.take_along_axis(indices, order, axis=1),
+        np.take_along_axis(values, order, axis=1),
+    )
+
+
+class PremiseIndex:
+    """Premises of a corpus (see `corpus.py`), scored by the dot product of their
+    embeddings with those of goals.
+
+    The corpus is memory-mapped, so server processes share one copy of it in the
+    page cache, and only the records of the premises returned are read. With an
+    approximate index (`ann.IVFIndex`), only some of the premises are scored. With
+    a lexical index (`lexical.LexicalIndex`), premises can also be found by the
+    identifiers they share with goals.
+    """
+
+    def __init__(
+        self,
+        corpus: Corpus,
+        block_size: int = 1 << 16,
+        ann: Optional[Any] = None,
+        access: Optional[Any] = None,
+        lexical: Optional[Any] = None,
+        shortlist: int = 256,
+    ) -> None:
+        self.corpus = corpus
+        # Premises are scored in blocks of rows, which bounds the memory of the
+        # scores for large batches of goals.
+        self.block_size = block_size
+        self.ann = ann
+        # Which premises each file can use (`accessibility.Accessibility`).
+        self.access = access
+        self.lexical = lexical
+        # Candidates of each method that are re-ranked or fused.
+        self.shortlist = shortlist
+        logger.info(f"Loaded {len(self)} premises from {corpus.directory}")
+
+    def __len__(self) -> int:
+        return len(self.corpus)
+
+    @property
+    def dim(self) -> int:
+        return self.corpus.dim
+
+    def search(
+        self, queries: np.ndarray, k: int, rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The indices and scores of the `k` best premises (among `rows`, sorted,
+        if given) for each row of `queries`, best first."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if queries.shape[1] != self.dim:
+            raise ValueError(
+                f"Queries have dimension {queries.shape[1]} instead of {self.dim}"
+            )
+        if self.ann is not None:
+            return self.ann.search(queries, k, rows=rows)
+        indices = np.empty((len(queries), 0), dtype=np.int64)
+        scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(
+            0, len(self) if rows is None else len(rows), self.block_size
+        ):
+            if rows is None:
+                ids = np.arange(start, min(start + self.block_size, len(self)))
+                block = self.corpus.vectors(start, start + self.block_size)
+            else:
+                ids = rows[start : start + self.block_size]
+                block = self.corpus.take(ids)
+            block_indices, block_scores = top_k(queries @ block.T, k)
+            # Keep the best `k` among those of the previous blocks and this one.
+            candidates = np.concatenate([indices, ids[block_indices]], axis=1)
+            best, scores = top_k(np.concatenate([scores, block_scores], axis=1), k)
+            indices = np.take_along_axis(candidates, best, axis=1)
+        return indices, scores
+
+    def hybrid_search(
+        self,
+        queries: Optional[np.ndarray],
+        texts: List[str],
+        k: int,
+        mode: str,
+        rows: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The indices and scores of the `k` best premises for each goal of `texts`
+        (with embeddings `queries`, unless `mode` is "lexical"):
+        - "lexical": by BM25 alone;
+        - "rerank": by the dot product of embeddings, among the `shortlist` best
+          premises by BM25 and, with an approximate index, by that index;
+        - "fusion": by the reciprocal rank fusion of the `shortlist` best premises
+          by BM25 and by the dot product of embeddings.
+        Rows with fewer than `k` premises are padded with index -1 and score -inf.
+        """
+        if self.lexical is None:
+            raise ValueError("The premises have no lexical index")
+        if mode == "lexical":
+            return self.lexical.search(texts, k, rows)
+        lexical_ids, _ = self.lexical.search(texts, max(self.shortlist, k), rows)
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        ids = np.full((len(texts), k), -1, dtype=np.int64)
+        scores = np.full((len(texts), k), -np.inf, dtype=np.float32)
+        if mode == "rerank":
+            dense_ids = None
+            if self.ann is not None:
+                dense_ids, _ = self.ann.search(queries, self.shortlist, rows=rows)
+            for b, query in enumerate(queries):
+                candidates = lexical_ids[b]
+                if dense_ids is not None:
+                    candidates = np.concatenate([candidates, dense_ids[b]])
+                # Sorted ids read the memory-mapped corpus in order.
+                candidates = np.unique(candidates[candidates >= 0])
+                best, best_scores = top_k(
+                    (self.corpus.take(candidates) @ query)[None], k
+                )
+                ids[b, : best.shape[1]] = candidates[best[0]]
+                scores[b, : best.shape[1]] = best_scores[0]
+        elif mode == "fusion":
+            dense_ids, _ = self.search(queries, max(self.shortlist, k), rows)
+            for b in range(len(texts)):
+                fused: Dict[int, float] = {}
+                for ranking in [lexical_ids[b], dense_ids[b]]:
+                    for rank, i in enumerate(ranking[ranking >= 0].tolist()):
+                        fused[i] = fused.get(i, 0.0) + 1 / (RRF_K + rank + 1)
+                best = sorted(fused.items(), key=lambda x: -x[1])[:k]
+                ids[b, : len(best)] = [i for i, _ in best]
+                scores[b, : len(best)] = [s for _, s in best]
+        else:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        return ids, scores
+
+    def retrieve(
+        self,
+        queries: Optional[np.ndarray],
+        k: int,
+        file: Optional[str] = None,
+        imports: Optional[List[str]] = None,
+        texts: Optional[List[str]] = None,
+        mode: str = "dense",
+    ) -> List[List[Dict[str, Any]]]:
+        """The records of the `k` best premises for each row of `queries` (the
+        embeddings of the goals `texts`), with their `score`, retrieved by `mode`
+        (see `hybrid_search`). With a `file` or `imports`, only the premises
+        accessible from that file (or a file with those imports) are scored."""
+        rows = None
+        if file is not None or imports is not None:
+            if self.access is None:
+                raise ValueError("The premises have no accessibility index")
+            rows = self.access.premises(file, imports)
+        if mode == "dense":
+            indices, scores = self.search(queries, k, rows)
+        else:
+            indices, scores = self.hybrid_search(queries, texts, k, mode, rows)
+        return [
+            [
+                dict(self.corpus[i], score=float(s))
+                for i, s in zip(row, row_scores)
+                if i >= 0  # Padding of approximate searches with fewer candidates.
+            ]
+            for row, row_scores in zip(indices.tolist(), scores.tolist())
+        ]
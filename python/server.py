@@ -1,66 +1,271 @@
-from typing import Optional
-from fastapi import FastAPI
+import os
+import time
+import asyncio
+import threading
+from typing import Any, Dict, Optional, Union
+import json
+import numpy as np
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
 from models import *
 from external_models import *
+from registry import ModelRegistry
+from executor import InferenceExecutor
+from batching import BatchScheduler
+from cache import ResultCache, cache_key
+from embedding_cache import EmbeddingCaches
+from accessibility import Accessibility
+from ann import IVFIndex
+from corpus import is_corpus, load_premises, needs_conversion
+from lexical import LexicalIndex
+from retrieval import MODES, PremiseIndex
+from transport import NegotiatedRoute, vector_response
+import metrics
+import tracing
+from admission import PRIORITIES, Budget, Rejected, current_budget
+from registry import process_memory
 
 app = FastAPI()
+# Requests and responses may be msgpack instead of JSON (see `transport.py`).
+app.router.route_class = NegotiatedRoute
 
-models = {
-    "gpt4": OpenAIRunner(
-        model="gpt-4-turbo-preview",
-        temperature=0.9,
-        max_tokens=1024,
-        top_p=0.9,
-        frequency_penalty=0,
-        presence_penalty=0,
-        num_return_sequences=16,
-        openai_timeout=45,
-    ),
-    "InternLM": VLLMTacticGenerator(
-        model="internlm/internlm2-math-plus-1_8b",
-        tensor_parallel_size=2,
-        temperature=0.6,
-        max_tokens=1024,
-        top_p=0.9,
-        length_penalty=0,
-        n=32,
-        do_sample=True,
-        output_scores=True,
-        output_logits=False,
-        return_dict_in_generate=True,
-        device="auto",
-    ),
-    "kimina": VLLMTacticGenerator(
-        model="AI-MO/Kimina-Prover-Preview-Distill-7B",
-        tensor_parallel_size=1,
-        temperature=0.6,
-        max_tokens=1024,
-        top_p=0.9,
-        length_penalty=0,
-        n=32,
-        do_sample=True,
-        output_scores=True,
-        output_logits=False,
-        return_dict_in_generate=True,
-        device="auto",
-    ),
-    "wellecks/llmstep-mathlib4-pythia2.8b": PythiaTacticGenerator(
-        num_return_sequences=32, max_length=1024, device="auto"
-    ),
-    "t5-small": EncoderDecoderTransformer(
-        "t5-small", num_return_sequences=3, max_length=1024
-    ),
-    "kaiyuy/leandojo-lean4-tacgen-byt5-small": EncoderDecoderTransformer(
-        "kaiyuy/leandojo-lean4-tacgen-byt5-small",
-        num_return_sequences=32,
-        max_length=1024,
-    ),
-    "kaiyuy/leandojo-lean4-retriever-byt5-small": EncoderOnlyTransformer(
-        "kaiyuy/leandojo-lean4-retriever-byt5-small"
-    ),
-}
+if os.getenv("LEAN_COPILOT_TRACE_FILE"):
+    tracing.exporters.append(
+        tracing.JsonLinesExporter(os.getenv("LEAN_COPILOT_TRACE_FILE"))
+    )
+
+
+@app.middleware("http")
+async def admit_requests(request: Request, call_next) -> Response:
+    """Read the priority (`X-Priority: interactive|batch`) and the deadline
+    (`X-Deadline-Ms`, relative to now) of a request."""
+    priority = request.headers.get("x-priority", "interactive")
+    deadline_ms = request.headers.get("x-deadline-ms")
+    if priority not in PRIORITIES:
+        return JSONResponse(
+            {"detail": f"Unknown priority: {priority}"}, status_code=400
+        )
+    try:
+        deadline = (
+            time.monotonic() + float(deadline_ms) / 1000
+            if deadline_ms is not None
+            else None
+        )
+    except ValueError:
+        return JSONResponse(
+            {"detail": f"Invalid X-Deadline-Ms: {deadline_ms}"}, status_code=400
+        )
+    current_budget.set(Budget(priority=PRIORITIES[priority], deadline=deadline))
+    return await call_next(request)
+
+
+@app.exception_handler(Rejected)
+async def rejected(request: Request, e: Rejected) -> Response:
+    return JSONResponse(
+        {"detail": str(e)},
+        status_code=e.status_code,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next) -> Response:
+    """Time the stages of requests with `X-Trace: 1` (or all requests when a trace
+    file is configured) and report them in the `Server-Timing` header. Requests with
+    `X-Profile: 1` are also run under cProfile."""
+    profile = request.headers.get("x-profile") == "1"
+    if not (profile or request.headers.get("x-trace") == "1" or tracing.exporters):
+        return await call_next(request)
+    trace = tracing.Trace(request.url.path, profile=profile)
+    token = tracing.current_trace.set(trace)
+    try:
+        response = await call_next(request)
+    finally:
+        tracing.current_trace.reset(token)
+    trace.finish()
+    timings = trace.server_timing()
+    total = f"total;dur={trace.duration * 1000:.2f}"
+    response.headers["Server-Timing"] = f"{timings}, {total}" if timings else total
+    response.headers["X-Trace-Id"] = trace.id
+    tracing.export(trace)
+    return response
+
+
+def _max_memory() -> Optional[int]:
+    # Memory budget (in GB) for the weights of all resident models.
+    budget = os.getenv("LEAN_COPILOT_MAX_MEMORY_GB")
+    return int(float(budget) * 2**30) if budget else None
+
+
+def _result_cache() -> Optional[ResultCache]:
+    if os.getenv("LEAN_COPILOT_CACHE", "1") == "0":
+        return None
+    ttl = os.getenv("LEAN_COPILOT_CACHE_TTL")
+    return ResultCache(
+        max_entries=int(os.getenv("LEAN_COPILOT_CACHE_SIZE", "10000")),
+        ttl=float(ttl) if ttl else None,
+        path=os.getenv("LEAN_COPILOT_CACHE_PATH"),
+    )
+
+
+def _embedding_caches() -> Optional[EmbeddingCaches]:
+    root = os.getenv("LEAN_COPILOT_EMBEDDING_CACHE")
+    if not root:
+        return None
+    return EmbeddingCaches(
+        root,
+        capacity=int(os.getenv("LEAN_COPILOT_EMBEDDING_CACHE_SIZE", "1000000")),
+        eviction=os.getenv("LEAN_COPILOT_EMBEDDING_CACHE_EVICTION", "fifo"),
+        readonly=os.getenv("LEAN_COPILOT_EMBEDDING_CACHE_READONLY", "0") == "1",
+    )
+
+
+def _premises_dtype() -> str:
+    return os.getenv("LEAN_COPILOT_PREMISES_DTYPE", "float32")
+
+
+def _premises_dir() -> str:
+    # Where `lake exe LeanCopilot/download` puts the premise embeddings.
+    cache_dir = os.getenv(
+        "LEAN_COPILOT_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache/lean_copilot/models"),
+    )
+    return os.getenv(
+        "LEAN_COPILOT_PREMISES",
+        os.path.join(
+            cache_dir,
+            "huggingface.co/kaiyuy/premise-embeddings-leandojo-lean4-retriever-byt5-small",
+        ),
+    )
+
+
+# Models are only loaded when they are first requested.
+models = ModelRegistry(max_memory=_max_memory())
+
+models.register(
+    "gpt4",
+    OpenAIRunner,
+    model="gpt-4-turbo-preview",
+    temperature=0.9,
+    max_tokens=1024,
+    top_p=0.9,
+    frequency_penalty=0,
+    presence_penalty=0,
+    num_return_sequences=16,
+    openai_timeout=45,
+)
+models.register(
+    "InternLM",
+    VLLMTacticGenerator,
+    model="internlm/internlm2-math-plus-1_8b",
+    tensor_parallel_size=2,
+    temperature=0.6,
+    max_tokens=1024,
+    # `post_process_output` keeps the last lean block, so samples only end with
+    # the turn of the assistant.
+    stop=["<|im_end|>"],
+    top_p=0.9,
+    length_penalty=0,
+    n=32,
+    do_sample=True,
+    output_scores=True,
+    output_logits=False,
+    return_dict_in_generate=True,
+    device="auto",
+)
+models.register(
+    "kimina",
+    VLLMTacticGenerator,
+    model="AI-MO/Kimina-Prover-Preview-Distill-7B",
+    tensor_parallel_size=1,
+    temperature=0.6,
+    max_tokens=1024,
+    # A reasoning model: its thinking may hold lean blocks before the final one.
+    stop=["<|im_end|>"],
+    top_p=0.9,
+    length_penalty=0,
+    n=32,
+    do_sample=True,
+    output_scores=True,
+    output_logits=False,
+    return_dict_in_generate=True,
+    device="auto",
+)
+models.register(
+    "wellecks/llmstep-mathlib4-pythia2.8b",
+    PythiaTacticGenerator,
+    num_return_sequences=32,
+    max_input_tokens=768,
+    max_new_tokens=256,
+    # llmstep generates one tactic, which ends with its line.
+    stop=["\n"],
+    device="auto",
+    prefix_cache_tokens=2048,
+)
+models.register(
+    "internlm-7b-assisted",
+    HFTacticGenerator,
+    model="internlm/internlm2-math-plus-7b",
+    # Proposes tokens that the 7B model checks in one forward pass; samples follow
+    # the distribution of the 7B model.
+    draft_model="internlm/internlm2-math-plus-1_8b",
+    temperature=0.6,
+    max_new_tokens=1024,
+    top_p=0.9,
+    num_return_sequences=16,
+    do_sample=True,
+    output_scores=True,
+    output_logits=False,
+    return_dict_in_generate=True,
+    device="auto",
+)
+models.register(
+    "t5-small",
+    EncoderDecoderTransformer,
+    "t5-small",
+    num_return_sequences=3,
+    max_length=1024,
+)
+models.register(
+    "kaiyuy/leandojo-lean4-tacgen-byt5-small",
+    EncoderDecoderTransformer,
+    "kaiyuy/leandojo-lean4-tacgen-byt5-small",
+    num_return_sequences=32,
+    max_length=1024,
+)
+models.register(
+    "kaiyuy/leandojo-lean4-retriever-byt5-small",
+    EncoderOnlyTransformer,
+    "kaiyuy/leandojo-lean4-retriever-byt5-small",
+)
+
+# Blocking inference runs in per-model pools. Remote APIs are I/O-bound and can
+# serve several requests at once; local models default to one at a time.
+executor = InferenceExecutor(models)
+executor.configure("gpt4", max_workers=8)
+
+# Concurrent requests to local models are served as padded batches.
+scheduler = BatchScheduler(executor)
+for name in [
+    "InternLM",
+    "kimina",
+    "wellecks/llmstep-mathlib4-pythia2.8b",
+    "t5-small",
+    "kaiyuy/leandojo-lean4-tacgen-byt5-small",
+    "kaiyuy/leandojo-lean4-retriever-byt5-small",
+]:
+    scheduler.configure(name, max_batch_size=8, max_wait_ms=5.0)
+
+# Results of /generate and /encode, keyed on the model, its configuration and the
+# whitespace-normalized input.
+cache = _result_cache()
+# Vectors of /encode and /encode_batch, persisted in memory-mapped files.
+embeddings = _embedding_caches()
+# Premises of /retrieve, loaded on the first request.
+premise_index: Optional[PremiseIndex] = None
+premise_index_lock = threading.Lock()
 
 
 class GeneratorRequest(BaseModel):
@@ -81,24 +286,427 @@ class GeneratorResponse(BaseModel):
 class EncoderRequest(BaseModel):
     name: str
     input: str
+    # "base64" returns the vector as base64-encoded little-endian float32.
+    encoding: Optional[str] = None
 
 
 class EncoderResponse(BaseModel):
-    outputs: List[float]
+    outputs: Optional[List[float]] = None
+    data: Optional[str] = None
+    dtype: Optional[str] = None
+    shape: Optional[List[int]] = None
+
+
+class GeneratorBatchRequest(BaseModel):
+    name: str
+    inputs: List[str]
+    prefixes: Optional[List[str]] = None
+
+
+class GeneratorBatchResponse(BaseModel):
+    outputs: List[List[Generation]]
+
+
+class EncoderBatchRequest(BaseModel):
+    name: str
+    inputs: List[str]
+    encoding: Optional[str] = None
+
+
+class EncoderBatchResponse(BaseModel):
+    outputs: Optional[List[List[float]]] = None
+    data: Optional[str] = None
+    dtype: Optional[str] = None
+    shape: Optional[List[int]] = None
+
+
+class RetrieverRequest(BaseModel):
+    # The encoder whose embeddings the premise embeddings were computed with.
+    name: str
+    input: str
+    k: int = 16
+    # Only retrieve premises accessible from this file (path or module name), or
+    # from a file with these imports.
+    file: Optional[str] = None
+    imports: Optional[List[str]] = None
+    # "dense", "lexical" (BM25), "rerank" (BM25 candidates re-ranked by their
+    # embeddings) or "fusion" (of the rankings of both); see `retrieval.py`.
+    mode: str = "dense"
+
+
+class Premise(BaseModel):
+    full_name: str
+    path: str
+    code: str
+    score: float
+
+
+class RetrieverResponse(BaseModel):
+    outputs: List[Premise]
+
+
+class RetrieverBatchRequest(BaseModel):
+    name: str
+    inputs: List[str]
+    k: int = 16
+    file: Optional[str] = None
+    imports: Optional[List[str]] = None
+    mode: str = "dense"
+
+
+class RetrieverBatchResponse(BaseModel):
+    outputs: List[List[Premise]]
+
+
+class CacheResponse(BaseModel):
+    enabled: bool
+    stats: Dict[str, int]
+    embeddings: Dict[str, Dict[str, int]] = {}
+
+
+class ModelsResponse(BaseModel):
+    available: List[str]
+    resident: Dict[str, int]
+    memory_usage: int
+    max_memory: Optional[int]
+
+
+def _check_model(name: str) -> None:
+    if name not in models:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {name}")
+
+
+async def _run_cached(name: str, method: str, *args) -> Any:
+    if cache is None:
+        return await scheduler.run(name, method, *args)
+    key = cache_key(name, models.config(name), method, *args)
+    budget = current_budget.get()
+    return await cache.get_or_compute(
+        key,
+        lambda: scheduler.run(name, method, *args),
+        # Results cut short to meet a deadline are not reused for other requests.
+        cacheable=lambda _: budget is None or budget.scale >= 1.0,
+    )
+
+
+async def _encode_cached(name: str, inputs: List[str]) -> np.ndarray:
+    """Encode `inputs`, reusing the vectors in the embedding cache."""
+    if embeddings is None:
+        if len(inputs) == 1:
+            return (await _run_cached(name, "encode", inputs[0]))[None]
+        return await executor.run(name, "encode_batch", inputs)
+
+    config = models.config(name)
+    keys = [cache_key(name, config, "encode", x) for x in inputs]
+    store = embeddings.get(name)
+    # Hits are views of the cache, whose rows the puts below may evict and reuse.
+    vectors = [store.get(key) if store is not None else None for key in keys]
+    vectors = [np.array(v) if v is not None else None for v in vectors]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if len(missing) == 1:
+        computed = [await _run_cached(name, "encode", inputs[missing[0]])]
+    elif missing:
+        computed = await executor.run(
+            name, "encode_batch", [inputs[i] for i in missing]
+        )
+    if missing:
+        if not embeddings.readonly:
+            store = embeddings.get(name, dim=computed[0].shape[-1])
+            for i, vector in zip(missing, computed):
+                store.put(keys[i], vector)
+        for i, vector in zip(missing, computed):
+            vectors[i] = vector
+    if len(vectors) == 1:
+        return vectors[0][None]
+    return np.stack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
 
 
 @app.post("/generate")
 async def generate(req: GeneratorRequest) -> GeneratorResponse:
-    model = models[req.name]
+    _check_model(req.name)
     target_prefix = req.prefix if req.prefix is not None else ""
-    outputs = model.generate(req.input, target_prefix)
+    with metrics.track(req.name, "/generate"):
+        outputs = await _run_cached(req.name, "generate", req.input, target_prefix)
+    metrics.CANDIDATES.inc(req.name, amount=len(outputs))
     return GeneratorResponse(
         outputs=[Generation(output=out[0], score=out[1]) for out in outputs]
     )
 
 
-@app.post("/encode")
-async def encode(req: EncoderRequest) -> EncoderResponse:
-    model = models[req.name]
-    feature = model.encode(req.input)
-    return EncoderResponse(outputs=feature.tolist())
+@app.post("/encode", response_model=EncoderResponse)
+async def encode(req: EncoderRequest, request: Request) -> Response:
+    _check_model(req.name)
+    with metrics.track(req.name, "/encode"):
+        feature = (await _encode_cached(req.name, [req.input]))[0]
+    return vector_response(request, feature, req.encoding)
+
+
+@app.post("/generate_stream")
+async def generate_stream(req: GeneratorRequest) -> StreamingResponse:
+    """Stream generations as newline-delimited JSON as soon as they are produced."""
+    _check_model(req.name)
+    target_prefix = req.prefix if req.prefix is not None else ""
+
+    async def generated():
+        seen = set()
+        async for out in executor.stream(
+            req.name, "generate_stream", req.input, target_prefix
+        ):
+            if out[0] not in seen:
+                seen.add(out[0])
+                yield out
+
+    def outputs():
+        if cache is None:
+            return generated()
+        key = cache_key(
+            req.name, models.config(req.name), "generate", req.input, target_prefix
+        )
+        budget = current_budget.get()
+        # Shares its entry with `/generate`, whose outputs are sorted by score.
+        return cache.get_or_stream(
+            key,
+            generated,
+            cacheable=lambda _: budget is None or budget.scale >= 1.0,
+            collect=lambda outs: sorted(outs, key=lambda out: out[1], reverse=True),
+        )
+
+    async def lines():
+        with metrics.track(req.name, "/generate_stream"):
+            async for out in outputs():
+                metrics.CANDIDATES.inc(req.name)
+                yield json.dumps({"output": out[0], "score": out[1]}) + "\n"
+
+    # Wait for the first line before responding, so that a request rejected by
+    # admission control still gets a 429/503 rather than an empty stream.
+    stream = lines()
+    try:
+        first = [await stream.__anext__()]
+    except StopAsyncIteration:
+        first = []
+
+    async def body():
+        for line in first:
+            yield line
+        async for line in stream:
+            yield line
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+@app.post("/generate_batch")
+async def generate_batch(req: GeneratorBatchRequest) -> GeneratorBatchResponse:
+    _check_model(req.name)
+    if req.prefixes is not None and len(req.prefixes) != len(req.inputs):
+        raise HTTPException(
+            status_code=422, detail="`prefixes` must be as long as `inputs`"
+        )
+    with metrics.track(req.name, "/generate_batch"):
+        outputs = await executor.run(
+            req.name, "generate_batch", req.inputs, req.prefixes
+        )
+    metrics.CANDIDATES.inc(req.name, amount=sum(len(batch) for batch in outputs))
+    return GeneratorBatchResponse(
+        outputs=[
+            [Generation(output=out[0], score=out[1]) for out in batch]
+            for batch in outputs
+        ]
+    )
+
+
+@app.post("/encode_batch", response_model=EncoderBatchResponse)
+async def encode_batch(req: EncoderBatchRequest, request: Request) -> Response:
+    _check_model(req.name)
+    with metrics.track(req.name, "/encode_batch"):
+        features = await _encode_cached(req.name, req.inputs)
+    return vector_response(request, features, req.encoding)
+
+
+def _premise_index() -> PremiseIndex:
+    global premise_index
+    with premise_index_lock:
+        if premise_index is None:
+            root = _premises_dir()
+            paths = [
+                os.path.join(root, f) for f in ["embeddings.npy", "dictionary.json"]
+            ]
+            if not is_corpus(root) and not all(os.path.exists(p) for p in paths):
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"No premise embeddings in {root}; set LEAN_COPILOT_PREMISES",
+                )
+            # The files of the C++ FFI are converted to a corpus at startup.
+            try:
+                corpus = load_premises(root, _premises_dtype(), convert=False)
+            except FileNotFoundError as e:
+                raise HTTPException(
+                    status_code=503, detail=f"{e}; restart the server to convert them"
+                )
+            # An IVF index built by `scripts/build_premise_ann.py`, if any.
+            ann_dir = os.path.join(corpus.directory, "ivf")
+            ann = None
+            if os.getenv("LEAN_COPILOT_PREMISES_ANN", "1") != "0" and os.path.exists(
+                os.path.join(ann_dir, "meta.json")
+            ):
+                nprobe = int(os.getenv("LEAN_COPILOT_PREMISES_NPROBE", "8"))
+                ann = IVFIndex.load(ann_dir, corpus, nprobe)
+            # Premises accessible from each file, from `scripts/build_premise_access.py`.
+            access_dir = os.path.join(corpus.directory, "access")
+            access = None
+            if os.path.exists(os.path.join(access_dir, "meta.json")):
+                access = Accessibility(access_dir)
+            # Terms of the premises, from `scripts/build_premise_lexical.py`.
+            lexical_dir = os.path.join(corpus.directory, "lexical")
+            lexical = None
+            if os.path.exists(os.path.join(lexical_dir, "meta.json")):
+                lexical = LexicalIndex(lexical_dir)
+            premise_index = PremiseIndex(
+                corpus, ann=ann, access=access, lexical=lexical
+            )
+        return premise_index
+
+
+async def _retrieve(
+    req: Union[RetrieverRequest, RetrieverBatchRequest], inputs: List[str]
+) -> List[List[Dict[str, Any]]]:
+    if req.k < 1:
+        raise HTTPException(status_code=422, detail="`k` must be positive")
+    if req.mode not in MODES:
+        raise HTTPException(
+            status_code=422, detail=f"`mode` must be one of {', '.join(MODES)}"
+        )
+    # Loading and scoring the premises block, so they run outside the event loop.
+    index = await asyncio.to_thread(_premise_index)
+    if (req.file is not None or req.imports is not None) and index.access is None:
+        raise HTTPException(
+            status_code=422,
+            detail="The premises have no accessibility index for `file` or `imports`",
+        )
+    if req.mode != "dense" and index.lexical is None:
+        raise HTTPException(
+            status_code=422, detail=f"The premises have no lexical index for {req.mode}"
+        )
+    queries = None
+    if req.mode != "lexical":  # Lexical retrieval does not need the encoder.
+        queries = await _encode_cached(req.name, inputs)
+        if queries.shape[-1] != index.dim:
+            raise HTTPException(
+                status_code=422,
+                detail=f"{req.name} has dimension {queries.shape[-1]}, "
+                f"but the premise embeddings have dimension {index.dim}",
+            )
+    with tracing.span("retrieve"):
+        try:
+            return await asyncio.to_thread(
+                index.retrieve, queries, req.k, req.file, req.imports, inputs, req.mode
+            )
+        except KeyError as e:  # An unknown file or module.
+            raise HTTPException(status_code=422, detail=e.args[0])
+
+
+@app.post("/retrieve")
+async def retrieve(req: RetrieverRequest) -> RetrieverResponse:
+    _check_model(req.name)
+    with metrics.track(req.name, "/retrieve"):
+        premises = (await _retrieve(req, [req.input]))[0]
+    return RetrieverResponse(outputs=[Premise(**p) for p in premises])
+
+
+@app.post("/retrieve_batch")
+async def retrieve_batch(req: RetrieverBatchRequest) -> RetrieverBatchResponse:
+    _check_model(req.name)
+    with metrics.track(req.name, "/retrieve_batch"):
+        premises = await _retrieve(req, req.inputs)
+    return RetrieverBatchResponse(
+        outputs=[[Premise(**p) for p in batch] for batch in premises]
+    )
+
+
+@app.get("/models")
+async def list_models() -> ModelsResponse:
+    return ModelsResponse(
+        available=models.names(),
+        resident=models.resident(),
+        memory_usage=models.memory_usage(),
+        max_memory=models.max_memory,
+    )
+
+
+@app.get("/cache")
+async def cache_stats() -> CacheResponse:
+    return CacheResponse(
+        enabled=cache is not None,
+        stats=cache.stats() if cache is not None else {},
+        embeddings=embeddings.stats() if embeddings is not None else {},
+    )
+
+
+metrics.CallbackGauge(
+    "lean_copilot_process_resident_memory_bytes",
+    "Resident memory of the server process.",
+    [],
+    lambda: {(): process_memory()},
+)
+metrics.CallbackGauge(
+    "lean_copilot_model_memory_bytes",
+    "Estimated weight memory of resident models.",
+    ["model"],
+    lambda: {(name,): size for name, size in models.resident().items()},
+)
+metrics.CallbackGauge(
+    "lean_copilot_cache",
+    "Result cache hits, misses, coalesced requests and entries.",
+    ["stat"],
+    lambda: {(k,): v for k, v in cache.stats().items()} if cache is not None else {},
+)
+
+
+@app.get("/metrics")
+async def prometheus_metrics() -> Response:
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.on_event("startup")
+def startup() -> None:
+    # Convert the files of the C++ FFI to a corpus before serving, rather than in
+    # the first /retrieve.
+    root = _premises_dir()
+    ffi = [os.path.join(root, f) for f in ["embeddings.npy", "dictionary.json"]]
+    if all(os.path.exists(p) for p in ffi) and needs_conversion(
+        root, _premises_dtype()
+    ):
+        load_premises(root, _premises_dtype())
+    for name in models.names():
+        if executor.config(name).kind == "worker":
+            executor.start(name)
+
+
+@app.on_event("shutdown")
+def shutdown() -> None:
+    executor.shutdown()
+    if cache is not None:
+        cache.close()
+    if embeddings is not None:
+        embeddings.close()
+
+
+if __name__ == "__main__":
+    # `uvicorn server:app` serves TCP only. Running this file also listens on a
+    # Unix domain socket, which avoids TCP overhead for local clients.
+    import socket
+    import uvicorn
+
+    port = int(os.getenv("LEAN_COPILOT_PORT", "23337"))
+    uds = os.getenv("LEAN_COPILOT_UDS", "/tmp/lean-copilot.sock")
+    config = uvicorn.Config(
+        app,
+        timeout_keep_alive=int(os.getenv("LEAN_COPILOT_KEEP_ALIVE", "60")),
+    )
+    sockets = [socket.create_server(("127.0.0.1", port))]
+    if uds:
+        if os.path.exists(uds):
+            os.unlink(uds)
+        unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        unix_socket.bind(uds)
+        sockets.append(unix_socket)
+    asyncio.run(uvicorn.Server(config).serve(sockets=sockets))
@@ -0,0 +1,108 @@
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+# The classes below follow the interfaces of transformers' `StoppingCriteria` and
+# `LogitsProcessor` without subclassing them, so that importing this module does
+# not import transformers.
+if TYPE_CHECKING:
+    import torch
+
+
+class StopStrings:
+    """Finds the rows of a batch being generated whose text after the first
+    `prompt_length` tokens contains one of `stop`."""
+
+    def __init__(self, tokenizer: Any, stop: List[str], prompt_length: int) -> None:
+        self.tokenizer = tokenizer
+        self.stop = stop
+        self.prompt_length = prompt_length
+        # Every token decodes to at least one byte, so a stop string is in the
+        # `window` tokens up to its last one; one more covers a character split
+        # across tokens.
+        self.window = max((len(s.encode("utf-8")) for s in stop), default=0) + 1
+        # The length of the rows when they were last checked.
+        self.checked_length = prompt_length
+
+    def finished(self, input_ids: "torch.Tensor") -> "torch.Tensor":
+        import torch
+
+        # Only stop strings ending in the tokens added since the last check are
+        # looked for (usually one token, more with assisted generation), which does
+        # not depend on how beams were reordered. Special tokens are kept, e.g.,
+        # "<|im_end|>".
+        start = max(self.prompt_length, self.checked_length - self.window + 1)
+        self.checked_length = input_ids.shape[1]
+        texts = self.tokenizer.batch_decode(
+            input_ids[:, start:], skip_special_tokens=False
+        )
+        return torch.tensor(
+            [any(s in text for s in self.stop) for text in texts],
+            dtype=torch.bool,
+            device=input_ids.device,
+        )
+
+
+class StopRows(StopStrings):
+    """Stopping criteria that finish each sample (or greedy row) on its own."""
+
+    def __call__(
+        self, input_ids: "torch.Tensor", scores: "torch.Tensor", **kwargs
+    ) -> "torch.Tensor":
+        return self.finished(input_ids)
+
+
+class ForceEOS(StopStrings):
+    """Logits processor that makes each beam containing a stop string emit EOS next.
+
+    Stopping criteria only end beam search once every beam is done, so finished
+    beams are ended through their next token instead. Scores are log-probabilities
+    at that point, and EOS gets 0, so the score of the beam does not change.
+    """
+
+    def __init__(
+        self, tokenizer: Any, stop: List[str], prompt_length: int, eos_token_id: int
+    ) -> None:
+        super().__init__(tokenizer, stop, prompt_length)
+        self.eos_token_id = eos_token_id
+
+    def __call__(
+        self, input_ids: "torch.Tensor", scores: "torch.Tensor"
+    ) -> "torch.Tensor":
+        finished = self.finished(input_ids)
+        if finished.any():
+            scores[finished] = float("-inf")
+            scores[finished, self.eos_token_id] = 0.0
+        return scores
+
+
+def stopping_kwargs(
+    tokenizer: Any,
+    stop: Optional[List[str]],
+    prompt_length: int,
+    num_beams: int = 1,
+    eos_token_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Arguments of `generate` that end each beam or sample as soon as its generated
+    text (the tokens after `prompt_length`) contains one of `stop`."""
+    if not stop:
+        return {}
+    from transformers import LogitsProcessorList, StoppingCriteriaList
+
+    if num_beams > 1:
+        if eos_token_id is None:
+            eos_token_id = tokenizer.eos_token_id
+        processor = ForceEOS(tokenizer, stop, prompt_length, eos_token_id)
+        return {"logits_processor": LogitsProcessorList([processor])}
+    return {
+        "stopping_criteria": StoppingCriteriaList(
+            [StopRows(tokenizer, stop, prompt_length)]
+        )
+    }
+
+
+def truncate(text: str, stop: Optional[List[str]]) -> str:
+    """`text` up to the first occurrence of any of `stop`."""
+    for s in stop or []:
+        i = text.find(s)
+        if i >= 0:
+            text = text[:i]
+    return text
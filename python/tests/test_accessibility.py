@@ -0,0 +1,61 @@
+import numpy as np
+
+from accessibility import Accessibility, build_accessibility, parse_imports
+from corpus import Corpus, write_corpus
+
+
+def build(tmp_path, imports, paths):
+    directory = str(tmp_path / "corpus")
+    write_corpus(
+        directory,
+        np.zeros((len(paths), 2), dtype=np.float32),
+        [{"full_name": f"p{i}", "path": p, "code": ""} for i, p in enumerate(paths)],
+    )
+    build_accessibility(Corpus(directory), imports)
+    return Accessibility(f"{directory}/access")
+
+
+def test_diamond_imports(tmp_path):
+    # A imports B and C, C imports B, B imports D.
+    paths = ["Pkg/A.lean", "Pkg/B.lean", "Pkg/C.lean", "Pkg/D.lean"]
+    imports = {
+        "Pkg/A.lean": ["Pkg.B", "Pkg.C"],
+        "Pkg/C.lean": ["Pkg.B"],
+        "Pkg/B.lean": ["Pkg.D"],
+        "Pkg/D.lean": [],
+    }
+    access = build(tmp_path, imports, paths)
+    assert access.premises("Pkg.C").tolist() == [1, 3]
+    assert access.premises("Pkg.B").tolist() == [3]
+    assert access.premises("Pkg.A").tolist() == [1, 2, 3]
+    assert access.premises(imports=["Pkg.C"]).tolist() == [1, 2, 3]
+
+
+def test_every_order_of_a_chain(tmp_path):
+    # The closure must not depend on the order in which files are visited.
+    paths = [f"Pkg/F{i}.lean" for i in range(6)]
+    imports = {p: [f"Pkg.F{j}" for j in range(i)] for i, p in enumerate(paths)}
+    access = build(tmp_path, imports, paths[::-1])
+    for i in range(6):
+        expected = sorted(5 - j for j in range(i))
+        assert access.premises(f"Pkg.F{i}").tolist() == expected
+
+
+def test_plain_header_imports_init():
+    source = "/- Copyright -/\nimport A\nimport all B C -- comment\n\ntheorem t : True := trivial\nimport D\n"
+    assert parse_imports(source) == ["Init", "A", "B", "C"]
+
+
+def test_module_header():
+    source = (
+        "module\n\npublic import Mathlib.Data.Nat.Basic\nimport B\n"
+        "meta import C\npublic meta import D\n\npublic section\n"
+    )
+    assert parse_imports(source) == ["Init", "Mathlib.Data.Nat.Basic", "B", "C", "D"]
+
+
+def test_prelude_header_does_not_import_init():
+    assert parse_imports("prelude\nimport Init.Core\n") == ["Init.Core"]
+    assert parse_imports("module\n\nprelude\npublic import Init.Prelude\n") == [
+        "Init.Prelude"
+    ]
@@ -0,0 +1,30 @@
+import time
+import asyncio
+import pytest
+
+from admission import AdmissionQueue, Budget, DeadlineExceeded
+
+
+def test_infeasible_deadline_is_rejected_with_a_free_slot():
+    async def main():
+        queue = AdmissionQueue("m", limit=1)
+        queue.service_time.observe(0.3)
+        with pytest.raises(DeadlineExceeded):
+            await queue.acquire(Budget(deadline=time.monotonic() + 0.02))
+        # The slot is still free, and there is no other.
+        await asyncio.wait_for(queue.acquire(Budget()), 1.0)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.acquire(Budget()), 0.01)
+
+    asyncio.run(main())
+
+
+def test_feasible_deadline_takes_a_free_slot():
+    async def main():
+        queue = AdmissionQueue("m", limit=1)
+        queue.service_time.observe(0.3)
+        await queue.acquire(Budget(deadline=time.monotonic() + 1.0))
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.acquire(Budget()), 0.01)
+
+    asyncio.run(main())
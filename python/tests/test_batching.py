@@ -0,0 +1,68 @@
+import time
+import asyncio
+
+from admission import Budget, DeadlineExceeded, current_budget
+from batching import BatchScheduler
+from tracing import Trace, current_trace, span
+
+
+class FakeExecutor:
+    """Runs `encode_batch` unless the deadline of the batch is less than 50 ms away."""
+
+    def __init__(self) -> None:
+        self.batches = []
+
+    async def run(self, name, method, inputs):
+        budget = current_budget.get()
+        remaining = budget.remaining()
+        if remaining is not None and remaining < 0.05:
+            raise DeadlineExceeded("too late")
+        self.batches.append(list(inputs))
+        with span("model.encode"):
+            pass
+        return [x.upper() for x in inputs]
+
+
+def test_an_infeasible_deadline_only_rejects_its_own_request():
+    async def request(scheduler, x, budget):
+        current_budget.set(budget)
+        try:
+            return await scheduler.run("m", "encode", x)
+        except DeadlineExceeded:
+            return None
+
+    async def main():
+        executor = FakeExecutor()
+        scheduler = BatchScheduler(executor)
+        scheduler.configure("m", max_batch_size=8, max_wait_ms=5.0)
+        now = time.monotonic()
+        budgets = [
+            Budget(deadline=now + 0.01),
+            Budget(deadline=now + 10.0),
+            Budget(),
+            Budget(),
+            Budget(priority=1),
+        ]
+        return executor, await asyncio.gather(
+            *(request(scheduler, x, b) for x, b in zip("abcde", budgets))
+        )
+
+    executor, results = asyncio.run(main())
+    assert results == [None, "B", "C", "D", "E"]
+    assert sorted(executor.batches) == [["b"], ["c", "d"], ["e"]]
+
+
+def test_every_request_of_a_batch_gets_its_spans():
+    async def request(scheduler, x):
+        trace = Trace(x)
+        current_trace.set(trace)
+        await scheduler.run("m", "encode", x)
+        return trace
+
+    async def main():
+        scheduler = BatchScheduler(FakeExecutor())
+        scheduler.configure("m", max_batch_size=3, max_wait_ms=5.0)
+        return await asyncio.gather(*(request(scheduler, x) for x in "abc"))
+
+    for trace in asyncio.run(main()):
+        assert set(trace.breakdown()) == {"batch", "model.encode"}
@@ -0,0 +1,106 @@
+import asyncio
+import pytest
+
+from admission import DeadlineExceeded
+from cache import ResultCache
+
+
+def coalesced(first, cacheable=lambda value: True, cancel=False):
+    """Start `first` and then a second computation of the same key (cancelling the
+    first one if `cancel`); return what the second request gets and how often it
+    computed."""
+
+    async def main():
+        cache = ResultCache()
+        calls = []
+
+        async def second():
+            calls.append(1)
+            return "second"
+
+        task = asyncio.ensure_future(
+            cache.get_or_compute("k", first, cacheable=cacheable)
+        )
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(cache.get_or_compute("k", second))
+        if cancel:
+            await asyncio.sleep(0.01)
+            task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return await waiter, len(calls)
+
+    return asyncio.run(main())
+
+
+def test_waiters_share_a_cacheable_result():
+    async def first():
+        await asyncio.sleep(0.02)
+        return "first"
+
+    assert coalesced(first) == ("first", 0)
+
+
+def test_waiters_compute_when_the_result_is_not_cacheable():
+    async def first():
+        return "scaled"
+
+    assert coalesced(first, cacheable=lambda value: False) == ("second", 1)
+
+
+def test_waiters_compute_when_the_first_request_is_rejected():
+    async def first():
+        await asyncio.sleep(0.005)
+        raise DeadlineExceeded("too late")
+
+    assert coalesced(first) == ("second", 1)
+
+
+def test_waiters_compute_when_the_first_request_is_cancelled():
+    async def first():
+        await asyncio.sleep(1)
+
+    assert coalesced(first, cancel=True) == ("second", 1)
+
+
+def test_waiters_share_errors():
+    async def first():
+        await asyncio.sleep(0.005)
+        raise ValueError("bad input")
+
+    with pytest.raises(ValueError):
+        coalesced(first)
+
+
+def test_persistent_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+
+    async def compute():
+        return [["rfl", 0.5]]
+
+    async def main():
+        cache = ResultCache(path=path)
+        try:
+            return await cache.get_or_compute("k", compute), cache.stats()["hits"]
+        finally:
+            cache.close()
+
+    assert asyncio.run(main()) == ([["rfl", 0.5]], 0)
+    assert asyncio.run(main()) == ([["rfl", 0.5]], 1)
+
+
+def test_streams_are_cached_once_complete():
+    async def stream():
+        for item in [("simp", 0.2), ("rfl", 0.5)]:
+            yield item
+
+    async def main():
+        cache = ResultCache()
+        collect = lambda items: sorted(items, key=lambda item: item[1], reverse=True)
+        first = [x async for x in cache.get_or_stream("k", stream, collect=collect)]
+        second = [x async for x in cache.get_or_stream("k", stream, collect=collect)]
+        return first, second, await cache.get("k"), cache.stats()
+
+    first, second, value, stats = asyncio.run(main())
+    assert first == [("simp", 0.2), ("rfl", 0.5)]
+    assert second == value == [("rfl", 0.5), ("simp", 0.2)]
+    assert (stats["hits"], stats["misses"]) == (1, 1)
@@ -0,0 +1,44 @@
+import os
+import json
+import numpy as np
+import pytest
+
+from corpus import load_premises, needs_conversion
+
+
+def write_ffi(root, embeddings):
+    np.save(os.path.join(root, "embeddings.npy"), embeddings)
+    with open(os.path.join(root, "dictionary.json"), "w") as f:
+        premises = {
+            str(i): {"full_name": f"p{i}", "path": "A.lean", "code": ""}
+            for i in range(len(embeddings))
+        }
+        json.dump(premises, f)
+
+
+def test_conversion_keeps_the_indexes_of_the_corpus(tmp_path):
+    root = str(tmp_path)
+    write_ffi(root, np.eye(3))
+    corpus = load_premises(root)
+    os.makedirs(os.path.join(corpus.directory, "ivf"))
+    with open(os.path.join(corpus.directory, "ivf", "meta.json"), "w") as f:
+        f.write("{}")
+
+    assert not needs_conversion(root)
+    assert needs_conversion(root, "int8")
+    corpus = load_premises(root, "int8")
+    assert corpus.meta["dtype"] == "int8"
+    assert os.path.exists(os.path.join(corpus.directory, "ivf", "meta.json"))
+    assert sorted(os.listdir(root)) == ["corpus", "dictionary.json", "embeddings.npy"]
+
+
+def test_changed_files_are_not_converted_unless_asked(tmp_path):
+    root = str(tmp_path)
+    write_ffi(root, np.eye(3))
+    corpus = load_premises(root)
+    # Converted before the files changed.
+    os.utime(os.path.join(corpus.directory, "meta.json"), (0, 0))
+    write_ffi(root, np.eye(4))
+    with pytest.raises(FileNotFoundError):
+        load_premises(root, convert=False)
+    assert len(load_premises(root)) == 4
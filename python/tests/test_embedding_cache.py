@@ -0,0 +1,55 @@
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+KEYS = {name: f"{i + 1:032x}" for i, name in enumerate("abcd")}
+
+
+def vector(value: float) -> np.ndarray:
+    return np.full(4, value, dtype=np.float32)
+
+
+def test_reader_never_gets_the_vector_of_another_key(tmp_path):
+    writer = EmbeddingCache(str(tmp_path), dim=4, capacity=2, eviction="fifo")
+    reader = EmbeddingCache(str(tmp_path), readonly=True)
+    writer.put(KEYS["a"], vector(1))
+    writer.put(KEYS["b"], vector(2))
+    np.testing.assert_array_equal(reader.get(KEYS["a"]), vector(1))
+
+    # The reader looks `a` up after `c` was written to the row of `a`, but before
+    # the writer appended the record of `c` to the index.
+    seen = []
+    index_file = writer._index_file
+
+    class Hook:
+        def write(self, data):
+            seen.append(reader.get(KEYS["a"]))
+            return index_file.write(data)
+
+        def __getattr__(self, name):
+            return getattr(index_file, name)
+
+    writer._index_file = Hook()
+    writer.put(KEYS["c"], vector(3))
+    writer._index_file = index_file
+    assert seen == [None]
+
+    assert reader.get(KEYS["a"]) is None
+    np.testing.assert_array_equal(reader.get(KEYS["b"]), vector(2))
+    np.testing.assert_array_equal(reader.get(KEYS["c"]), vector(3))
+    writer.put(KEYS["d"], vector(4))
+    assert reader.get(KEYS["b"]) is None
+    np.testing.assert_array_equal(reader.get(KEYS["d"]), vector(4))
+    writer.close()
+    reader.close()
+
+
+def test_reopened_cache_keeps_its_vectors(tmp_path):
+    writer = EmbeddingCache(str(tmp_path), dim=4, capacity=8)
+    for i, key in enumerate(KEYS.values()):
+        writer.put(key, vector(i))
+    writer.close()
+    reader = EmbeddingCache(str(tmp_path), readonly=True)
+    for i, key in enumerate(KEYS.values()):
+        np.testing.assert_array_equal(reader.get(key), vector(i))
+    reader.close()
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from models import EncoderOnlyTransformer, length_buckets
+
+GOALS = [
+    "⊢ True",
+    "n : ℕ\n⊢ gcd n n = n",
+    "a b c : Nat\n⊢ a + b + c = a + c + b",
+    "α : Type u_1\ninst✝ : DecidableEq α\ns t : Finset α\nh : s ⊆ t\n⊢ s ∪ t = t",
+    "x y : ℝ\nhx : 0 < x\nhy : 0 < y\n⊢ Real.log (x * y) = Real.log x + Real.log y",
+    "",
+]
+
+
+def test_length_buckets_cover_every_input_once():
+    lengths = [5, 1, 40, 3, 3, 17, 2]
+    buckets = length_buckets(lengths, max_batch_tokens=20)
+    assert sorted(i for bucket in buckets for i in bucket) == list(range(len(lengths)))
+    for bucket in buckets:
+        assert len(bucket) == 1 or max(lengths[i] for i in bucket) * len(bucket) <= 20
+
+
+@pytest.fixture(scope="module")
+def encoder() -> EncoderOnlyTransformer:
+    """A ByT5 encoder with tiny random weights, without downloading anything."""
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+
+    torch.manual_seed(0)
+    config = transformers.T5Config(
+        vocab_size=384, d_model=32, d_kv=8, d_ff=64, num_layers=2, num_heads=4
+    )
+    model = EncoderOnlyTransformer.__new__(EncoderOnlyTransformer)
+    model.tokenizer = transformers.ByT5Tokenizer()
+    model.model = transformers.T5EncoderModel(config).eval()
+    model.precision = "fp32"
+    return model
+
+
+@pytest.mark.parametrize("max_batch_tokens", [16384, 64])
+def test_encode_batch_matches_encode(encoder, max_batch_tokens):
+    batched = encoder.encode_batch(GOALS, max_batch_tokens=max_batch_tokens)
+    assert batched.dtype == np.float32 and batched.flags.c_contiguous
+    assert batched.shape == (len(GOALS), encoder.model.config.d_model)
+    single = np.stack([encoder.encode(goal) for goal in GOALS])
+    np.testing.assert_allclose(batched, single, atol=1e-5)
+
+
+def test_encode_batch_of_nothing(encoder):
+    assert encoder.encode_batch([]).shape == (0, encoder.model.config.d_model)
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+
+from admission import AdmissionQueue, Budget
+from executor import InferenceExecutor
+from registry import ModelRegistry
+from tracing import Trace, current_trace
+
+
+class Blocking:
+    def __init__(self) -> None:
+        self.started = threading.Event()
+        self.proceed = threading.Event()
+
+    def generate(self, input: str) -> str:
+        self.started.set()
+        self.proceed.wait(5)
+        return input
+
+
+async def free_slots(queue: AdmissionQueue) -> int:
+    """The number of slots of `queue` that can be acquired right away."""
+    free = 0
+    while free < queue.limit:
+        try:
+            await asyncio.wait_for(queue.acquire(Budget()), 0.01)
+        except asyncio.TimeoutError:
+            break
+        free += 1
+    for _ in range(free):
+        queue.release()
+    return free
+
+
+def test_cancelled_request_keeps_its_slot_until_the_call_is_done():
+    async def main():
+        models = ModelRegistry()
+        models.register("m", Blocking)
+        executor = InferenceExecutor(models)
+        queue = executor.queue("m")
+        model = models["m"]
+
+        task = asyncio.ensure_future(executor.run("m", "generate", "x"))
+        await asyncio.to_thread(model.started.wait, 5)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # The model is still working on the request.
+        assert await free_slots(queue) == 0
+
+        model.proceed.set()
+        for _ in range(100):
+            if await free_slots(queue) == 1:
+                break
+            await asyncio.sleep(0.01)
+        assert await free_slots(queue) == 1
+        executor.shutdown()
+
+    asyncio.run(main())
+
+
+def test_cancelled_request_that_has_not_started_frees_its_slot():
+    async def main():
+        models = ModelRegistry()
+        models.register("m", Blocking)
+        executor = InferenceExecutor(models)
+        executor.configure("m", max_concurrency=2)
+        queue = executor.queue("m")
+        model = models["m"]
+
+        # The pool has one thread, so the second call waits for the first.
+        first = asyncio.ensure_future(executor.run("m", "generate", "x"))
+        await asyncio.to_thread(model.started.wait, 5)
+        second = asyncio.ensure_future(executor.run("m", "generate", "y"))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        assert await free_slots(queue) == 1
+
+        model.proceed.set()
+        assert await first == "x"
+        assert await free_slots(queue) == 2
+        executor.shutdown()
+
+    asyncio.run(main())
+
+
+def test_streams_load_the_model_like_calls():
+    class Streaming:
+        def generate_stream(self, input: str):
+            yield from input
+
+    async def main():
+        models = ModelRegistry()
+        models.register("m", Streaming)
+        executor = InferenceExecutor(models)
+        trace = Trace("/generate_stream")
+        current_trace.set(trace)
+        items = [item async for item in executor.stream("m", "generate_stream", "ab")]
+        executor.shutdown()
+        return items, trace
+
+    items, trace = asyncio.run(main())
+    assert items == ["a", "b"]
+    assert "load_model" in trace.breakdown()
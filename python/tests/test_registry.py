@@ -0,0 +1,64 @@
+import pytest
+
+from registry import ModelRegistry, estimate_memory
+
+
+def test_int8_linear_layers_are_counted():
+    torch = pytest.importorskip("torch")
+
+    model = torch.nn.Sequential(torch.nn.Linear(64, 64), torch.nn.ReLU())
+    fp32 = estimate_memory(type("Model", (), {"model": model})())
+    quantized = torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    int8 = estimate_memory(type("Model", (), {"model": quantized})())
+    # int8 weights and an fp32 bias.
+    assert int8 == 64 * 64 + 64 * 4
+    assert fp32 == (64 * 64 + 64) * 4
+
+
+class Tensor:
+    def __init__(self, size: int) -> None:
+        self.size = size
+
+    def numel(self) -> int:
+        return self.size
+
+    def element_size(self) -> int:
+        return 1
+
+
+class Module:
+    def __init__(self, size: int) -> None:
+        self.tensors = [Tensor(size)]
+
+    def parameters(self):
+        return self.tensors
+
+    def buffers(self):
+        return []
+
+    def modules(self):
+        return [self]
+
+
+def test_models_are_evicted_before_a_model_is_loaded_again():
+    registry = ModelRegistry(max_memory=100)
+    peaks = []
+
+    def factory(size):
+        def load():
+            # The memory of the resident models while this one loads.
+            peaks.append(registry.memory_usage())
+            return type("Model", (), {"model": Module(size)})()
+
+        return load
+
+    registry.register("a", factory(60))
+    registry.register("b", factory(60))
+    registry["a"]
+    registry["b"]  # First load: `a` is only evicted once `b` is loaded.
+    assert list(registry.resident()) == ["b"]
+    registry["a"]  # `b` is evicted before `a` is loaded again.
+    assert list(registry.resident()) == ["a"]
+    assert peaks == [0, 60, 0]
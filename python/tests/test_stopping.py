@@ -0,0 +1,61 @@
+import pytest
+
+from stopping import StopStrings, truncate
+
+
+class ByteTokenizer:
+    """One token per byte; records the number of tokens decoded."""
+
+    def __init__(self) -> None:
+        self.decoded = 0
+
+    def encode(self, text: str):
+        return list(text.encode("utf-8"))
+
+    def batch_decode(self, rows, skip_special_tokens=False):
+        self.decoded += sum(len(row) for row in rows)
+        return [bytes(row.tolist()).decode("utf-8", errors="ignore") for row in rows]
+
+
+def generate(tokenizer, stop, prompt, texts, step=1):
+    """Feed `texts` (one per row) after `prompt`, `step` tokens at a time; return
+    the number of tokens after which each row first contains a stop string."""
+    torch = pytest.importorskip("torch")
+
+    prompt_ids = tokenizer.encode(prompt)
+    rows = [prompt_ids + tokenizer.encode(t) for t in texts]
+    length = max(len(row) for row in rows)
+    ids = torch.tensor([row + [32] * (length - len(row)) for row in rows])
+    criteria = StopStrings(tokenizer, stop, len(prompt_ids))
+    stopped = [None] * len(texts)
+    for end in range(len(prompt_ids) + step, length + step, step):
+        for i, done in enumerate(criteria.finished(ids[:, : min(end, length)])):
+            if done and stopped[i] is None:
+                stopped[i] = min(end, length) - len(prompt_ids)
+    return stopped
+
+
+def test_stop_strings_across_tokens():
+    stopped = generate(
+        ByteTokenizer(),
+        ["```\n", "<|im_end|>"],
+        "```lean\n⊢ True```\n",
+        ["trivial\n```\nmore", "simp<|im_end|>", "ring", "ℕ → ℕ```\n"],
+    )
+    assert stopped == [12, 14, None, 15]
+
+
+def test_assisted_steps_of_several_tokens():
+    stopped = generate(ByteTokenizer(), ["```\n"], "", ["rfl```\n  ", "omega"], step=5)
+    assert stopped == [9, None]
+
+
+def test_only_the_last_tokens_are_decoded():
+    tokenizer = ByteTokenizer()
+    generate(tokenizer, ["```\n"], "⊢ True", ["x" * 1000])
+    assert tokenizer.decoded <= 1000 * (len("```\n") + 1)
+
+
+def test_truncate():
+    assert truncate("simp\n```\nrest", ["```\n"]) == "simp\n"
+    assert truncate("simp", None) == "simp"
@@ -0,0 +1,39 @@
+import pytest
+
+from external_models.external_parser import post_process_output
+from server import models
+from stopping import truncate
+
+# Raw outputs of the chat models, after `<|im_end|>`.
+SAMPLES = [
+    "```lean\nsimp\n```\n",
+    "```lean\nomega\n```\nThis closes the goal with lean arithmetic.",
+    # Kimina thinks before its final lean block.
+    "<think>\nMaybe ```lean\nsimp\n```\nfails here; induction works.\n</think>\n"
+    "```lean4\ntheorem t (n : ℕ) : n + 0 = n := by\n  induction n <;> simp\n```\n",
+]
+
+
+def configured_stops():
+    for name in models.names():
+        kwargs = models.config(name)["kwargs"]
+        if kwargs.get("stop") and "model" in kwargs:
+            yield name, kwargs["model"], kwargs["stop"]
+
+
+@pytest.mark.parametrize("name,model,stop", list(configured_stops()))
+def test_stops_keep_the_candidates(name, model, stop):
+    for sample in SAMPLES:
+        try:
+            expected = post_process_output(model, sample)
+        except (NotImplementedError, IndexError):
+            continue
+        assert post_process_output(model, truncate(sample, stop)) == expected
+
+
+def test_a_fence_stop_would_change_the_candidate_of_kimina():
+    model = "AI-MO/Kimina-Prover-Preview-Distill-7B"
+    assert post_process_output(model, SAMPLES[2]) == "induction n <;> simp"
+    assert post_process_output(model, truncate(SAMPLES[2], ["```\n"])) != (
+        "induction n <;> simp"
+    )
@@ -0,0 +1,46 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from transport import MSGPACK, NegotiatedRoute
+
+msgpack = pytest.importorskip("msgpack")
+
+
+class Echo(BaseModel):
+    input: str
+
+
+app = FastAPI()
+app.router.route_class = NegotiatedRoute
+
+
+@app.post("/echo")
+def echo(req: Echo) -> dict:
+    return {"output": req.input}
+
+
+def post(body: bytes):
+    return TestClient(app).post(
+        "/echo", content=body, headers={"content-type": MSGPACK, "accept": MSGPACK}
+    )
+
+
+def test_msgpack_round_trip():
+    response = post(msgpack.packb({"input": "⊢ True"}))
+    assert response.status_code == 200
+    assert msgpack.unpackb(response.content) == {"output": "⊢ True"}
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b"\xc1",
+        msgpack.packb({"input": "x"})[:-1],
+        msgpack.packb({"input": b"x"}),
+        msgpack.packb({"input": msgpack.ExtType(1, b"x")}),
+    ],
+)
+def test_invalid_msgpack_is_a_bad_request(body):
+    assert post(body).status_code == 400
@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+
+import metrics
+from executor import InferenceExecutor
+from registry import ModelRegistry
+from workers import WorkerPool
+
+
+class Echo:
+    def generate(self, input: str) -> str:
+        metrics.record_tokens(len(input))
+        return input.upper()
+
+
+class Device:
+    type = "cuda"
+
+
+class OnCuda(Echo):
+    device = Device()
+
+
+def test_worker_metrics_reach_the_parent():
+    pool = WorkerPool("echo-metrics", Echo(), replicas=2)
+    try:
+        before = metrics.GENERATED_TOKENS.value("echo-metrics")
+        results = [pool.submit("generate", (x,)).result(30) for x in ["ab", "cde"]]
+        assert results == ["AB", "CDE"]
+        assert metrics.GENERATED_TOKENS.value("echo-metrics") == before + 5
+    finally:
+        pool.shutdown()
+
+
+def test_cuda_models_need_spawn():
+    with pytest.raises(ValueError):
+        WorkerPool("cuda", OnCuda(), start_method="fork")
+
+
+def test_evicting_a_model_replaces_its_workers():
+    loads = []
+
+    def load():
+        loads.append(1)
+        return Echo()
+
+    async def main():
+        models = ModelRegistry()
+        models.register("echo", load)
+        executor = InferenceExecutor(models)
+        executor.configure("echo", kind="worker")
+        assert await executor.run("echo", "generate", "x") == "X"
+        models.evict("echo")
+        # The workers of the evicted model are stopped, and new ones get the model
+        # loaded again.
+        assert await executor.run("echo", "generate", "y") == "Y"
+        executor.shutdown()
+
+    asyncio.run(main())
+    assert len(loads) == 2
+
+
+class Tactics:
+    def generate(self, input: str, target_prefix: str = ""):
+        metrics.record_tokens(3)
+        return [(target_prefix + "simp", 0.5)]
+
+
+def test_server_with_worker_pool():
+    from fastapi.testclient import TestClient
+
+    import server
+
+    server.models.register("tactics-worker", Tactics)
+    server.executor.configure("tactics-worker", kind="worker", max_workers=2)
+    with TestClient(server.app) as client:
+        response = client.post(
+            "/generate",
+            json={"name": "tactics-worker", "input": "⊢ True", "prefix": None},
+        )
+        assert response.status_code == 200
+        assert response.json()["outputs"] == [{"output": "simp", "score": 0.5}]
+        assert 'lean_copilot_generated_tokens_total{model="tactics-worker"} 3' in (
+            client.get("/metrics").text
+        )
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import uuid
+import cProfile
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+
+class Trace:
+    """Timings of the stages of one request."""
+
+    def __init__(self, name: str, profile: bool = False) -> None:
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.profile = profile
+        self.start = time.perf_counter()
+        self.timestamp = time.time()
+        self.duration: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, duration: float) -> None:
+        with self._lock:
+            self.spans.append(
+                {"name": name, "start": start - self.start, "duration": duration}
+            )
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self.start
+
+    def breakdown(self) -> Dict[str, float]:
+        """Total seconds spent in each stage."""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for s in self.spans:
+                totals[s["name"]] = totals.get(s["name"], 0.0) + s["duration"]
+        return totals
+
+    def server_timing(self) -> str:
+        """The breakdown as a `Server-Timing` header value (durations in ms)."""
+        return ", ".join(
+            f'{name.replace(".", "-")};dur={seconds * 1000:.2f};desc="{name}"'
+            for name, seconds in self.breakdown().items()
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "id": self.id,
+            "name": self.name,
+            "timestamp": self.timestamp,
+            "duration": self.duration,
+            "spans": spans,
+        }
+
+
+class Traces:
+    """The traces of several requests served by one call, e.g., a batch, which all
+    get the spans of that call."""
+
+    def __init__(self, traces: List[Trace]) -> None:
+        self.traces = traces
+        # Profiled if any request asked to be, under the id of the first that did.
+        profiled = [t for t in traces if t.profile] or traces
+        self.id = profiled[0].id
+        self.profile = profiled[0].profile
+
+    def add(self, name: str, start: float, duration: float) -> None:
+        for trace in self.traces:
+            trace.add(name, start, duration)
+
+
+current_trace: ContextVar[Optional[Union[Trace, Traces]]] = ContextVar(
+    "current_trace", default=None
+)
+
+
+def joined(traces: List[Optional[Trace]]) -> Optional[Union[Trace, Traces]]:
+    """The trace recording the spans of a call serving requests with `traces`."""
+    traces = [t for t in traces if t is not None]
+    if len(traces) <= 1:
+        return traces[0] if traces else None
+    return Traces(traces)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time a stage of the current request. Costs a context variable lookup when
+    the request is not traced."""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter() - start)
+
+
+def traced(name: str) -> Callable:
+    """Decorator that times every call of a function as stage `name`."""
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class JsonLinesExporter:
+    """Appends finished traces to a JSON-lines file."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace) -> None:
+        line = json.dumps(trace.to_dict())
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+exporters: List[Any] = []
+
+
+def export(trace: Trace) -> None:
+    for exporter in exporters:
+        exporter.export(trace)
+
+
+def profiled(fn: Callable, *args) -> Any:
+    """Call `fn` under cProfile if the current request asked to be profiled.
+
+    The profile is written to `$LEAN_COPILOT_PROFILE_DIR/<trace id>.prof`. While the
+    call runs, the thread is named after the trace so that it can be found in
+    sampling profilers such as `py-spy dump`.
+    """
+    trace = current_trace.get()
+    if trace is None or not trace.profile:
+        return fn(*args)
+    thread = threading.current_thread()
+    thread_name = thread.name
+    thread.name = f"trace-{trace.id}"
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn, *args)
+    finally:
+        thread.name = thread_name
+        directory = os.getenv("LEAN_COPILOT_PROFILE_DIR", ".")
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, f"{trace.id}.prof"))
@@ -0,0 +1,110 @@
+import json
+import base64
+import numpy as np
+from typing import Callable
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+MSGPACK = "application/msgpack"
+FLOAT32 = "application/x-float32"
+
+
+def _accepts(request: Request, media_type: str) -> bool:
+    return media_type in request.headers.get("accept", "")
+
+
+def _no_extensions(code: int, data: bytes) -> None:
+    raise ValueError(f"Unsupported msgpack extension type {code}")
+
+
+def _as_json(body: bytes) -> bytes:
+    """The JSON equivalent of a msgpack body. Raises `ValueError` if it is malformed
+    or has values without a JSON equivalent (bin, extension types)."""
+    try:
+        return json.dumps(msgpack.unpackb(body, ext_hook=_no_extensions)).encode()
+    except TypeError as e:
+        raise ValueError(e) from e
+
+
+def _as_json_request(request: Request, body: bytes) -> Request:
+    """A copy of `request` with a msgpack body replaced by the equivalent JSON."""
+    body = _as_json(body)
+    headers = [(k, v) for k, v in request.scope["headers"] if k != b"content-type"]
+    headers.append((b"content-type", b"application/json"))
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request(dict(request.scope, headers=headers), receive)
+
+
+class NegotiatedRoute(APIRoute):
+    """Accepts msgpack request bodies and returns msgpack to clients that ask for it."""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def negotiated_handler(request: Request) -> Response:
+            if request.headers.get("content-type", "").startswith(MSGPACK):
+                if msgpack is None:
+                    return Response("msgpack is not installed", status_code=415)
+                try:
+                    request = _as_json_request(request, await request.body())
+                except ValueError as e:
+                    return JSONResponse(
+                        {"detail": f"Invalid msgpack body: {e or type(e).__name__}"},
+                        status_code=400,
+                    )
+            response = await handler(request)
+            if (
+                msgpack is not None
+                and _accepts(request, MSGPACK)
+                and response.media_type == "application/json"
+            ):
+                return Response(
+                    msgpack.packb(json.loads(response.body)),
+                    status_code=response.status_code,
+                    media_type=MSGPACK,
+                )
+            return response
+
+        return negotiated_handler
+
+
+def vector_response(request: Request, features: np.ndarray, encoding: str) -> Response:
+    """Encode a vector (or a matrix, one row per input) in the requested format.
+
+    - `Accept: application/x-float32`: raw little-endian float32, with the shape in
+      the `X-Shape` header.
+    - `Accept: application/msgpack`: `{"outputs": ...}` with single-precision floats.
+    - `encoding == "base64"`: JSON `{"data": ..., "dtype": "float32", "shape": ...}`
+      with the base64-encoded little-endian float32 values.
+    - Otherwise: JSON `{"outputs": ...}` with a list of numbers.
+    """
+    features = np.ascontiguousarray(features, dtype="<f4")
+    shape = ",".join(str(d) for d in features.shape)
+    if _accepts(request, FLOAT32):
+        return Response(
+            features.tobytes(), media_type=FLOAT32, headers={"X-Shape": shape}
+        )
+    if msgpack is not None and _accepts(request, MSGPACK):
+        return Response(
+            msgpack.packb({"outputs": features.tolist()}, use_single_float=True),
+            media_type=MSGPACK,
+        )
+    if encoding == "base64":
+        return JSONResponse(
+            {
+                "data": base64.b64encode(features.tobytes()).decode("ascii"),
+                "dtype": "float32",
+                "shape": list(features.shape),
+            }
+        )
+    return JSONResponse({"outputs": features.tolist()})
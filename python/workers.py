@@ -0,0 +1,206 @@
+import os
+import threading
+import multiprocessing as mp
+from concurrent.futures import Future
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+
+import metrics
+
+# How worker processes are started. "spawn" and "forkserver" start them from a
+# fresh interpreter, without the threads of the server (thread pools, OpenMP) or
+# its CUDA context; "fork" is only safe for CPU models in a process without threads.
+START_METHODS = ("spawn", "forkserver", "fork")
+
+
+def _share_weights(model: Any) -> None:
+    """Move the tensors of a local model to shared memory.
+
+    Workers then map the same pages instead of copying the weights: spawned ones
+    receive handles to the shared memory, and forked ones would otherwise copy the
+    pages that Python reference counting and PyTorch's own bookkeeping touch.
+    """
+    module = getattr(model, "model", None)
+    if hasattr(module, "share_memory"):
+        module.share_memory()
+
+
+def _on_cuda(model: Any) -> bool:
+    try:
+        return model.device.type == "cuda"
+    except AttributeError:
+        return False
+
+
+def _serve(name: str, model: Any, conn: Connection, num_threads: Optional[int]) -> None:
+    """Main loop of a worker process."""
+    if num_threads is not None:
+        try:
+            import torch
+
+            torch.set_num_threads(num_threads)
+        except ImportError:
+            pass
+    metrics.current_model.set(name)
+    metrics.drain()  # Anything inherited from the parent is already counted there.
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if request is None:
+            break
+        request_id, method, args = request
+        try:
+            response = (request_id, True, getattr(model, method)(*args))
+        except Exception as e:
+            response = (request_id, False, e)
+        # The metrics recorded by the call are added to those of the server.
+        recorded = metrics.drain()
+        try:
+            conn.send(response + (recorded,))
+        except Exception as e:  # E.g., the result or the exception is unpicklable.
+            conn.send((request_id, False, RuntimeError(repr(e)), recorded))
+    conn.close()
+
+
+class _Replica:
+    """A worker process and the requests sent to it that have not completed."""
+
+    def __init__(
+        self,
+        name: str,
+        index: int,
+        model: Any,
+        num_threads: Optional[int],
+        start_method: str,
+    ):
+        self.name = f"{name}-{index}"
+        context = mp.get_context(start_method)
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_serve,
+            args=(name, model, child_conn, num_threads),
+            name=self.name,
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.pending: Dict[int, Future] = {}
+        self._send_lock = threading.Lock()
+        self._reader = threading.Thread(
+            target=self._read, name=f"{self.name}-reader", daemon=True
+        )
+        self._reader.start()
+
+    def submit(self, request_id: int, method: str, args: tuple) -> Future:
+        future: Future = Future()
+        self.pending[request_id] = future
+        try:
+            with self._send_lock:
+                self.conn.send((request_id, method, args))
+        except Exception:
+            del self.pending[request_id]
+            raise
+        # The worker cannot be stopped once it has the request, so the future cannot
+        # be cancelled either.
+        future.set_running_or_notify_cancel()
+        return future
+
+    def _read(self) -> None:
+        while True:
+            try:
+                request_id, ok, value, recorded = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            metrics.merge(recorded)
+            future = self.pending.pop(request_id)
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        # The worker is gone; fail whatever it was working on.
+        error = RuntimeError(f"Worker {self.name} exited")
+        for future in list(self.pending.values()):
+            future.set_exception(error)
+        self.pending.clear()
+
+    def close(self) -> None:
+        try:
+            with self._send_lock:
+                self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class WorkerPool:
+    """Replicas of one model in worker processes.
+
+    The model is loaded once in the parent and passed to the workers with its
+    weights in shared memory, so they are shared rather than loaded again per
+    replica (with `share_memory=False`, each worker gets a copy). Models on CUDA
+    need `start_method="spawn"`. Each request goes to the replica with the fewest
+    outstanding requests, and the metrics recorded in the workers are added to
+    those of the parent.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        model: Any,
+        replicas: int = 1,
+        num_threads: Optional[int] = None,
+        share_memory: bool = True,
+        start_method: str = "spawn",
+    ) -> None:
+        if start_method not in START_METHODS:
+            raise ValueError(f"Unknown start method: {start_method}")
+        if _on_cuda(model) and start_method != "spawn":
+            raise ValueError(
+                f"{name} is on CUDA, which only works in workers started with spawn"
+            )
+        try:
+            # Registers how tensors are passed to other processes (shared memory
+            # handles rather than copies).
+            import torch.multiprocessing
+        except ImportError:
+            pass
+        if share_memory:
+            _share_weights(model)
+        if num_threads is None:
+            # Split the cores between the replicas instead of letting each of
+            # them start one intra-op thread per core.
+            num_threads = max(1, (os.cpu_count() or 1) // replicas)
+        logger.info(
+            f"Starting {replicas} worker(s) for {name} with {num_threads} thread(s) each"
+        )
+        self.name = name
+        self._replicas: List[_Replica] = [
+            _Replica(name, i, model, num_threads, start_method) for i in range(replicas)
+        ]
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def _route(self) -> Tuple[int, _Replica]:
+        with self._lock:
+            self._next_id += 1
+            replica = min(self._replicas, key=lambda r: len(r.pending))
+            return self._next_id, replica
+
+    def submit(self, method: str, args: tuple) -> Future:
+        """Call `method` with `args` on the least-loaded replica."""
+        request_id, replica = self._route()
+        return replica.submit(request_id, method, args)
+
+    def load(self) -> List[int]:
+        """Number of outstanding requests per replica."""
+        return [len(r.pending) for r in self._replicas]
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False) -> None:
+        for replica in self._replicas:
+            replica.close()
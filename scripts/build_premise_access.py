@@ -0,0 +1,61 @@
+"""Record which premises of a corpus each file can use (see `python/accessibility.py`).
+
+Examples:
+
+    # From the `corpus.jsonl` of a LeanDojo benchmark, which lists the imports of
+    # each file.
+    python scripts/build_premise_access.py corpus --leandojo-corpus corpus.jsonl
+    # From the `import` lines of the Lean sources of the premises.
+    python scripts/build_premise_access.py corpus --lean-root path/to/project
+
+The index is saved in the `access` directory of the corpus. The server then takes
+`file` (a path or module name) or `imports` in `/retrieve` and `/retrieve_batch`,
+and only scores the premises of the files they import, directly or transitively.
+"""
+
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python")
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("premises", help="Corpus or directory of the C++ FFI files.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--leandojo-corpus", help="corpus.jsonl of LeanDojo.")
+    source.add_argument("--lean-root", help="Directory the paths are relative to.")
+    args = parser.parse_args()
+
+    from accessibility import Accessibility, build_accessibility, read_imports
+    from corpus import load_premises
+
+    corpus = load_premises(args.premises)
+    if args.leandojo_corpus:
+        with open(args.leandojo_corpus) as f:
+            files = [json.loads(line) for line in f if line.strip()]
+        imports = {f["path"]: f["imports"] for f in files}
+    else:
+        paths = {corpus.string("path", i) for i in range(len(corpus))}
+        imports = read_imports(args.lean_root, sorted(paths))
+    build_accessibility(corpus, imports)
+
+    access = Accessibility(os.path.join(corpus.directory, "access"))
+    sizes = [
+        len(access.premises(file=f))
+        for f in access.files
+        if access.offsets[access.index[f] + 1] > access.offsets[access.index[f]]
+    ]
+    print(
+        f"Saved the imports of {len(access.files)} files; a file can use "
+        f"{np.mean(sizes) / len(corpus):.1%} of the {len(corpus)} premises on average"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Build an IVF(-PQ) index of the premises of a corpus (see `python/ann.py`).
+
+Examples:
+
+    # Exact scores within the probed lists (IVF-Flat).
+    python scripts/build_premise_ann.py corpus
+    # Product quantization of the 1472-dimensional embeddings of the ByT5 retriever
+    # into 92 bytes per premise, and a check against exact search.
+    python scripts/build_premise_ann.py corpus --pq-m 92 --check
+
+The argument is a corpus (`scripts/export_premise_corpus.py`) or a directory with
+the `embeddings.npy` and `dictionary.json` of the C++ FFI, which is converted to a
+corpus first. The index is saved in the `ivf` directory of the corpus, where the
+server loads it (`LEAN_COPILOT_PREMISES_NPROBE` lists are probed per goal, 8 by
+default). With `--check`, the script reports the recall of the top 10 premises and
+the latency per query for several values of `nprobe`, using the embeddings of random
+premises as queries.
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python")
+)
+
+
+def check(index, num_queries: int = 100, k: int = 10) -> None:
+    from retrieval import PremiseIndex
+
+    exact = PremiseIndex(index.corpus)
+    rng = np.random.default_rng(1)
+    rows = rng.choice(len(exact), size=min(num_queries, len(exact)), replace=False)
+    queries = index.corpus.take(np.sort(rows))
+
+    start = time.perf_counter()
+    expected, _ = exact.search(queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    print(f"  exact: {exact_ms:.2f} ms/query")
+    for nprobe in [1, 4, 8, 16, 64]:
+        if nprobe > len(index.centroids):
+            break
+        start = time.perf_counter()
+        actual, _ = index.search(queries, k, nprobe=nprobe)
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = np.mean(
+            [len(set(e) & set(a)) / len(e) for e, a in zip(expected, actual)]
+        )
+        print(f"  nprobe={nprobe:3d}: recall@{k} {recall:.3f}, {ms:.2f} ms/query")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("premises", help="Corpus or directory of the C++ FFI files.")
+    parser.add_argument("--nlist", type=int, default=None, help="4 sqrt(N) if unset.")
+    parser.add_argument(
+        "--pq-m", type=int, default=None, help="Bytes per premise (PQ subvectors)."
+    )
+    parser.add_argument("--sample-size", type=int, default=100_000)
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    from ann import IVFIndex
+    from corpus import load_premises
+
+    corpus = load_premises(args.premises)
+    start = time.perf_counter()
+    index = IVFIndex.build(
+        corpus,
+        nlist=args.nlist,
+        pq_m=args.pq_m,
+        sample_size=args.sample_size,
+        iters=args.iters,
+    )
+    directory = os.path.join(corpus.directory, "ivf")
+    index.save(directory)
+    print(
+        f"Saved an index of {len(index)} premises in {len(index.centroids)} lists "
+        f"to {directory} ({time.perf_counter() - start:.1f} s)"
+    )
+
+    if args.check:
+        check(IVFIndex.load(directory, corpus))
+
+
+if __name__ == "__main__":
+    main()
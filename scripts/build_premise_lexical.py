@@ -0,0 +1,59 @@
+"""Build a BM25 index of the identifiers of the premises of a corpus (see
+`python/lexical.py`).
+
+Example:
+
+    python scripts/build_premise_lexical.py corpus --query "n : ℕ\\n⊢ Nat.gcd n n = n"
+
+The index is saved in the `lexical` directory of the corpus. The server then takes
+`mode` in `/retrieve` and `/retrieve_batch`: "lexical" (BM25 alone, without
+encoding the goal), "rerank" (the best premises by BM25, re-ranked by their
+embeddings) or "fusion" (the rankings of BM25 and embeddings fused). With `--query`,
+the script prints the best premises by BM25 for a goal.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python")
+)
+
+
+def size(directory: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory)
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("premises", help="Corpus or directory of the C++ FFI files.")
+    parser.add_argument("--query", default=None, help="A goal (`\\n` for line breaks).")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    from corpus import load_premises
+    from lexical import LexicalIndex, build_lexical
+
+    corpus = load_premises(args.premises)
+    start = time.perf_counter()
+    build_lexical(corpus)
+    directory = os.path.join(corpus.directory, "lexical")
+    index = LexicalIndex(directory)
+    print(
+        f"Saved {index.meta['terms']} terms of {len(index)} premises to {directory} "
+        f"({size(directory) / 2**20:.1f} MiB, {time.perf_counter() - start:.1f} s)"
+    )
+
+    if args.query:
+        ids, scores = index.search([args.query.replace("\\n", "\n")], args.k)
+        for i, score in zip(ids[0], scores[0]):
+            if i >= 0:
+                print(f"  {score:7.3f} {corpus.string('full_name', i)}")
+
+
+if __name__ == "__main__":
+    main()
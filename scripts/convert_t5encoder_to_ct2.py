@@ -50,9 +50,11 @@ class T5EncoderLoader(ModelLoader):
     def set_stack(self, spec, module):
         self.set_layer_norm(spec.layer_norm, module.final_layer_norm)
         self.set_embeddings(
-            spec.embeddings[0]
-            if isinstance(spec.embeddings, list)
-            else spec.embeddings,
+            (
+                spec.embeddings[0]
+                if isinstance(spec.embeddings, list)
+                else spec.embeddings
+            ),
             module.embed_tokens,
         )
 
@@ -113,15 +115,18 @@ class T5EncoderLoader(ModelLoader):
         spec.gamma = layer_norm.weight
 
 
-_MODEL_LOADERS["T5Config"] = T5EncoderLoader()
+if __name__ == "__main__":
+    _MODEL_LOADERS["T5Config"] = T5EncoderLoader()
 
-converter = TransformersConverter("kaiyuy/leandojo-lean4-retriever-byt5-small")
-converter.convert("ct2-leandojo-lean4-retriever-byt5-small", force=True)
+    converter = TransformersConverter("kaiyuy/leandojo-lean4-retriever-byt5-small")
+    converter.convert("ct2-leandojo-lean4-retriever-byt5-small", force=True)
 
-encoder = ctranslate2.Encoder("ct2-leandojo-lean4-retriever-byt5-small")
-state = "n : ℕ\n⊢ gcd n n = n"
-tokenizer = AutoTokenizer.from_pretrained("kaiyuy/leandojo-lean4-retriever-byt5-small")
-output = encoder.forward_batch(
-    [tokenizer.convert_ids_to_tokens(tokenizer.encode(state))]
-)
-feature = np.array(output.last_hidden_state).mean(axis=1)
+    encoder = ctranslate2.Encoder("ct2-leandojo-lean4-retriever-byt5-small")
+    state = "n : ℕ\n⊢ gcd n n = n"
+    tokenizer = AutoTokenizer.from_pretrained(
+        "kaiyuy/leandojo-lean4-retriever-byt5-small"
+    )
+    output = encoder.forward_batch(
+        [tokenizer.convert_ids_to_tokens(tokenizer.encode(state))]
+    )
+    feature = np.array(output.last_hidden_state).mean(axis=1)
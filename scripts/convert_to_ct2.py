@@ -0,0 +1,196 @@
+"""Convert a Hugging Face model to CTranslate2 and compare the two.
+
+Examples:
+
+    python scripts/convert_to_ct2.py kaiyuy/leandojo-lean4-tacgen-byt5-small \\
+        --kind encoder-decoder --quantization int8 --check
+    python scripts/convert_to_ct2.py kaiyuy/leandojo-lean4-retriever-byt5-small \\
+        --kind encoder --quantization int8_float32 --check
+    python scripts/convert_to_ct2.py wellecks/llmstep-mathlib4-pythia2.8b \\
+        --kind decoder --quantization int8 --check
+
+With `--check`, the converted model is run next to the Hugging Face model from
+`python/models.py` on a few goals (or those in `--goals`, one per line with `\\n`
+for line breaks), which decoder-only models get in the format of `--prompt`. The
+script reports the speed of both and how close their outputs are: the cosine
+similarity of the embeddings for encoders, and the agreement of the top candidates
+for generators. It exits with a non-zero status if the outputs are
+further apart than `--min-cosine` / `--min-top1`.
+"""
+
+import os
+import sys
+import time
+import argparse
+import contextlib
+import numpy as np
+from typing import Callable, List
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python")
+)
+
+GOALS = [
+    "n : ℕ\n⊢ gcd n n = n",
+    "a b c : Nat\n⊢ a + b + c = a + c + b",
+    "α : Type u_1\ninst✝ : DecidableEq α\ns t : Finset α\nh : s ⊆ t\n⊢ s ∪ t = t",
+    "x y : ℝ\nhx : 0 < x\nhy : 0 < y\n⊢ Real.log (x * y) = Real.log x + Real.log y",
+]
+
+
+@contextlib.contextmanager
+def t5_encoder_loader():
+    """Convert T5 checkpoints as encoder-only models."""
+    from ctranslate2.converters.transformers import _MODEL_LOADERS
+    from convert_t5encoder_to_ct2 import T5EncoderLoader
+
+    loader = _MODEL_LOADERS.get("T5Config")
+    _MODEL_LOADERS["T5Config"] = T5EncoderLoader()
+    try:
+        yield
+    finally:
+        _MODEL_LOADERS["T5Config"] = loader
+
+
+def convert(name: str, kind: str, output: str, quantization: str, force: bool) -> None:
+    from ctranslate2.converters import TransformersConverter
+
+    converter = TransformersConverter(name)
+    if kind == "encoder":
+        with t5_encoder_loader():
+            converter.convert(output, quantization=quantization, force=force)
+    else:
+        converter.convert(output, quantization=quantization, force=force)
+
+
+def timed(fn: Callable, goals: List[str]) -> tuple:
+    start = time.perf_counter()
+    outputs = [fn(goal) for goal in goals]
+    return outputs, time.perf_counter() - start
+
+
+def check_encoder(args: argparse.Namespace, goals: List[str]) -> bool:
+    from models import CT2EncoderOnly, EncoderOnlyTransformer
+
+    hf = EncoderOnlyTransformer(args.name)
+    ct2 = CT2EncoderOnly(
+        args.output,
+        args.name,
+        compute_type=args.compute_type,
+        intra_threads=args.intra_threads,
+    )
+    expected, hf_seconds = timed(hf.encode, goals)
+    actual, ct2_seconds = timed(ct2.encode, goals)
+    cosines = [
+        float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+        for a, b in zip(expected, actual)
+    ]
+    max_diff = max(float(np.abs(a - b).max()) for a, b in zip(expected, actual))
+    report_speed(len(goals), hf_seconds, ct2_seconds)
+    print(f"  min cosine similarity {min(cosines):.5f}, max abs diff {max_diff:.2e}")
+    return min(cosines) >= args.min_cosine
+
+
+def check_generator(args: argparse.Namespace, goals: List[str]) -> bool:
+    from models import (
+        CT2DecoderOnly,
+        CT2EncoderDecoder,
+        DecoderOnlyTransformer,
+        EncoderDecoderTransformer,
+    )
+
+    if args.kind == "encoder-decoder":
+        hf_cls, ct2_cls = EncoderDecoderTransformer, CT2EncoderDecoder
+    else:
+        hf_cls, ct2_cls = DecoderOnlyTransformer, CT2DecoderOnly
+    if args.kind == "decoder":
+        goals = [args.prompt.format(goal=goal) for goal in goals]
+    hf = hf_cls(args.name, args.num_return_sequences, args.max_length)
+    ct2 = ct2_cls(
+        args.output,
+        args.name,
+        args.num_return_sequences,
+        args.max_length,
+        compute_type=args.compute_type,
+        intra_threads=args.intra_threads,
+    )
+    expected, hf_seconds = timed(hf.generate, goals)
+    actual, ct2_seconds = timed(ct2.generate, goals)
+    top1 = np.mean([e[0][0] == a[0][0] for e, a in zip(expected, actual)])
+    overlap = np.mean(
+        [
+            len({o for o, _ in e} & {o for o, _ in a}) / max(len(e), 1)
+            for e, a in zip(expected, actual)
+        ]
+    )
+    report_speed(len(goals), hf_seconds, ct2_seconds)
+    print(f"  top-1 agreement {top1:.2f}, candidate overlap {overlap:.2f}")
+    return top1 >= args.min_top1
+
+
+def report_speed(count: int, hf_seconds: float, ct2_seconds: float) -> None:
+    print(f"{count} goals")
+    print(f"  transformers: {count / hf_seconds:8.2f} goals/s")
+    print(
+        f"  ctranslate2:  {count / ct2_seconds:8.2f} goals/s "
+        f"({hf_seconds / ct2_seconds:.1f}x)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("name", help="Hugging Face model name or path.")
+    parser.add_argument(
+        "--kind", choices=["encoder-decoder", "encoder", "decoder"], required=True
+    )
+    parser.add_argument(
+        "--output", default=None, help="Default: ct2-<model name without the owner>."
+    )
+    parser.add_argument(
+        "--quantization",
+        default=None,
+        choices=["int8", "int8_float32", "int8_float16", "float16", "bfloat16"],
+        help="Type of the saved weights (default: as in the checkpoint).",
+    )
+    parser.add_argument("--force", action="store_true", help="Overwrite --output.")
+    parser.add_argument("--skip-conversion", action="store_true")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--goals", default=None, help="One goal per line.")
+    parser.add_argument("--compute-type", default="int8")
+    parser.add_argument("--intra-threads", type=int, default=0)
+    parser.add_argument("--num-return-sequences", type=int, default=8)
+    parser.add_argument("--max-length", type=int, default=256)
+    parser.add_argument(
+        "--prompt",
+        default="[GOAL]{goal}[PROOFSTEP]",
+        help="Prompt of decoder-only models (default: the format of llmstep).",
+    )
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    # Quantized weights may change the order of close candidates, but the best
+    # tactic should mostly stay the same.
+    parser.add_argument("--min-top1", type=float, default=0.75)
+    args = parser.parse_args()
+    if args.output is None:
+        args.output = "ct2-" + args.name.rstrip("/").split("/")[-1]
+
+    if not args.skip_conversion:
+        convert(args.name, args.kind, args.output, args.quantization, args.force)
+        print(f"Saved {args.output}")
+
+    if args.check:
+        if args.goals:
+            with open(args.goals) as f:
+                goals = [l.rstrip("\n").replace("\\n", "\n") for l in f if l.strip()]
+        else:
+            goals = GOALS
+        if args.kind == "encoder":
+            ok = check_encoder(args, goals)
+        else:
+            ok = check_generator(args, goals)
+        if not ok:
+            print("FAIL: outputs differ more than allowed", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
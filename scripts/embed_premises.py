@@ -0,0 +1,81 @@
+"""Encode premises with a retriever into a premise corpus (see `python/embed_corpus.py`).
+
+Examples:
+
+    # From a JSON Lines file of premises with their `full_name`, `path` and `code`.
+    python scripts/embed_premises.py premises.jsonl corpus --workers 4
+    # From the `dictionary.json` of the C++ FFI, in int8.
+    python scripts/embed_premises.py dictionary.json corpus --dtype int8
+
+The corpus is written in the order of the premises and can be served directly
+(`LEAN_COPILOT_PREMISES=corpus`). Running the script again on an updated list of
+premises only encodes the premises whose text changed or that are new, and reuses
+the embeddings of the others. Encoded chunks are saved in `corpus.work` as they
+complete, so an interrupted run continues where it stopped. With `--workers` above 1,
+the model is loaded once and shared with that many processes (see
+`python/workers.py`). The indexes built in the corpus (`ivf`, `access`, `lexical`) are
+kept but no longer match its premises; build them again.
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python")
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "premises", help="A corpus, dictionary.json or JSON Lines of premises."
+    )
+    parser.add_argument("output", help="Directory of the corpus.")
+    parser.add_argument("--model", default="kaiyuy/leandojo-lean4-retriever-byt5-small")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--chunk-rows", type=int, default=4096)
+    parser.add_argument(
+        "--dtype", choices=["float32", "float16", "int8"], default="float32"
+    )
+    parser.add_argument(
+        "--no-normalize",
+        action="store_true",
+        help="Keep the raw embeddings (ReProver normalizes those of premises).",
+    )
+    args = parser.parse_args()
+
+    from embed_corpus import InlinePool, embed_premises, load_premise_list
+    from models import EncoderOnlyTransformer
+    from workers import WorkerPool
+
+    premises = load_premise_list(args.premises)
+    model = EncoderOnlyTransformer(args.model, args.device, args.precision)
+    if args.workers > 1:
+        pool = WorkerPool(args.model, model, replicas=args.workers)
+    else:
+        pool = InlinePool(model)
+    try:
+        stats = embed_premises(
+            premises,
+            args.output,
+            pool,
+            args.model,
+            dtype=args.dtype,
+            normalize=not args.no_normalize,
+            batch_size=args.batch_size,
+            chunk_rows=args.chunk_rows,
+        )
+    finally:
+        pool.shutdown()
+    print(
+        f"Saved {stats['premises']} premises to {args.output} "
+        f"({stats['encoded']} encoded)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Export premise embeddings and their records to a corpus (see `python/corpus.py`).
+
+Examples:
+
+    # From the files of the C++ FFI (`embeddings.npy` and `dictionary.json`).
+    python scripts/export_premise_corpus.py corpus --from-files \\
+        ~/.cache/lean_copilot/models/huggingface.co/kaiyuy/premise-embeddings-leandojo-lean4-retriever-byt5-small
+    # From the `indexed_corpus.pickle` of ReProver (`retrieval/index.py`).
+    python scripts/export_premise_corpus.py corpus --from-pickle indexed_corpus.pickle \\
+        --dtype int8 --check
+
+A corpus is a directory that the server reads without parsing or copying anything
+(`LEAN_COPILOT_PREMISES`). Embeddings are stored in float32, float16 or int8 with a
+scale per row. With `--check`, the script compares the corpus with its source: the
+sizes on disk, the largest error of the embeddings, and how many of the top 10
+premises stay the same when the embeddings of random premises are used as queries.
+"""
+
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python")
+)
+
+
+def size(*paths: str) -> int:
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            total += size(*[os.path.join(path, f) for f in os.listdir(path)])
+        else:
+            total += os.path.getsize(path)
+    return total
+
+
+def check(source: np.ndarray, directory: str, num_queries: int = 100) -> None:
+    from corpus import Corpus
+    from retrieval import PremiseIndex, top_k
+
+    index = PremiseIndex(Corpus(directory))
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(source), size=min(num_queries, len(source)), replace=False)
+    queries = np.asarray(source[np.sort(rows)], dtype=np.float32)
+
+    max_error = 0.0
+    expected = []
+    for start in range(0, len(source), index.block_size):
+        block = np.asarray(source[start : start + index.block_size], dtype=np.float32)
+        stored = index.corpus.vectors(start, start + index.block_size)
+        max_error = max(max_error, float(np.abs(block - stored).max()))
+        expected.append(queries @ block.T)
+    expected_top, _ = top_k(np.concatenate(expected, axis=1), 10)
+    actual_top, _ = index.search(queries, 10)
+    overlap = np.mean(
+        [len(set(e) & set(a)) / len(e) for e, a in zip(expected_top, actual_top)]
+    )
+    print(f"  max abs error of the embeddings: {max_error:.2e}")
+    print(f"  top-10 overlap with the source embeddings: {overlap:.3f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", help="Directory of the corpus.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--from-files", help="Directory with embeddings.npy and dictionary.json."
+    )
+    source.add_argument("--from-pickle", help="indexed_corpus.pickle of ReProver.")
+    parser.add_argument(
+        "--dtype", choices=["float32", "float16", "int8"], default="float32"
+    )
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    from corpus import migrate, write_corpus
+
+    if args.from_files:
+        embeddings_path = os.path.join(args.from_files, "embeddings.npy")
+        dictionary_path = os.path.join(args.from_files, "dictionary.json")
+        migrate(embeddings_path, dictionary_path, args.output, args.dtype)
+        source = np.load(embeddings_path, mmap_mode="r")
+        sources = [embeddings_path, dictionary_path]
+    else:
+        import pickle
+
+        with open(args.from_pickle, "rb") as f:
+            indexed_corpus = pickle.load(f)
+        source = indexed_corpus.embeddings.float().numpy()
+        write_corpus(
+            args.output,
+            source,
+            (
+                {"full_name": p.full_name, "path": p.path, "code": p.code}
+                for p in indexed_corpus.corpus.all_premises
+            ),
+            args.dtype,
+        )
+        sources = [args.from_pickle]
+    with open(os.path.join(args.output, "meta.json")) as f:
+        meta = json.load(f)
+    print(f"Saved {meta['count']} premises ({meta['dtype']}) to {args.output}")
+
+    if args.check:
+        print(
+            f"  {size(*sources) / 2**20:.1f} MiB -> {size(args.output) / 2**20:.1f} MiB"
+        )
+        check(source, args.output)
+
+
+if __name__ == "__main__":
+    main()